@@ -1,4 +1,5 @@
 import { Link } from 'react-router-dom';
+import { LOGIN_URL } from '../services/api';
 import './Navbar.scss';
 
 function Navbar() {
@@ -16,6 +17,7 @@ function Navbar() {
           <li><Link to="/scan-barcode">Scan</Link></li>
           <li><Link to="/reviews">Reviews</Link></li>
           <li><Link to="/delivery-history">History</Link></li>
+          <li><a href={LOGIN_URL}>Log in</a></li>
         </ul>
       </div>
     </nav>
@@ -14,6 +14,19 @@ function TrackingMap() {
     fetchData();
   }, [id]);
 
+  useEffect(() => {
+    const stream = trackingAPI.stream(id);
+    stream.addEventListener('location', (event) => {
+      const location = JSON.parse(event.data);
+      setLocations((current) => [location, ...current]);
+    });
+    stream.addEventListener('status', (event) => {
+      const { new_status } = JSON.parse(event.data);
+      setParcel((current) => current && { ...current, status: new_status, status_display: new_status.replace('_', ' ') });
+    });
+    return () => stream.close();
+  }, [id]);
+
   const fetchData = async () => {
     try {
       const parcelRes = await parcelAPI.detail(id);
@@ -2,11 +2,19 @@ import axios from 'axios';
 
 const API_BASE_URL = 'http://localhost:8001/api';
 
+// The API scopes every request to the caller's organizations, so requests carry the Django session
+// (log in at LOGIN_URL; cookies are shared across localhost ports) and the CSRF token for writes.
+export const LOGIN_URL = 'http://localhost:8001/api-auth/login/';
+
 const api = axios.create({
   baseURL: API_BASE_URL,
   headers: {
     'Content-Type': 'application/json',
   },
+  withCredentials: true,
+  withXSRFToken: true,
+  xsrfCookieName: 'csrftoken',
+  xsrfHeaderName: 'X-CSRFToken',
 });
 
 // Parcel APIs
@@ -16,7 +24,9 @@ export const parcelAPI = {
   create: (data) => api.post('/parcels/', data),
   update: (id, data) => api.patch(`/parcels/${id}/`, data),
   delete: (id) => api.delete(`/parcels/${id}/`),
-  searchByBarcode: (trackingNumber) => api.get('/parcels/search_by_barcode/', { params: { tracking_number: trackingNumber } }),
+  // fields: optional comma-separated subset, e.g. 'status,current_location'
+  searchByBarcode: (trackingNumber, fields) =>
+    api.get('/parcels/search_by_barcode/', { params: { tracking_number: trackingNumber, fields } }),
   updateStatus: (id, status, notes = '') => api.post(`/parcels/${id}/update_status/`, { status, notes }),
   myParcels: () => api.get('/parcels/my_parcels/'),
 };
@@ -47,6 +57,8 @@ export const trackingAPI = {
   createLocation: (data) => api.post('/tracking-locations/', data),
   routes: (parcelId) => api.get('/delivery-routes/', { params: { parcel: parcelId } }),
   createRoute: (data) => api.post('/delivery-routes/', data),
+  // Server-Sent Events stream of new locations and status changes for one parcel
+  stream: (parcelId) => new EventSource(`${API_BASE_URL}/stream/?parcel=${parcelId}`, { withCredentials: true }),
 };
 
 // Notification APIs
@@ -54,6 +66,12 @@ export const notificationAPI = {
   list: () => api.get('/notifications/'),
   markAsRead: (id) => api.post(`/notifications/${id}/mark_as_read/`),
   markAllAsRead: () => api.post('/notifications/mark_all_as_read/'),
+  // Unread count and notifications newer than `since`; resolves with status 304 while `etag` is current
+  poll: (since = 0, etag = null) => api.get('/notifications/poll/', {
+    params: { since },
+    headers: etag ? { 'If-None-Match': etag } : {},
+    validateStatus: (status) => status === 200 || status === 304,
+  }),
 };
 
 // Delivery History APIs
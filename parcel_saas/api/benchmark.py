@@ -0,0 +1,245 @@
+"""Synthetic data and scenario benchmarks for the parcel API.
+
+``generate`` fills the database with organizations, departments, parcels
+and long ``TrackingLocation``/``ParcelStatusHistory`` chains using
+``bulk_create``, then rebuilds the derived tables the write paths would
+normally maintain (search index, daily rollups). Everything is drawn from a
+seeded ``random.Random`` so a given scale is reproducible.
+
+``run_scenario`` drives one endpoint through the full middleware and DRF
+stack with ``APIClient`` and records throughput, p50/p99 latency and
+queries per request; ``compare`` flags scenarios that issue more queries
+than a stored baseline or whose p99 grew beyond a tolerance.
+``serializer_throughput`` compares the list serializer over model instances
+with its ``values()`` row path. ``manage.py run_benchmarks`` ties these together on a throwaway test
+database.
+"""
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import rollups, search
+from .bulk import iter_chunks
+from .rows import values_rows
+from .serializers import ParcelListSerializer
+from .models import (
+    Department, Organization, Parcel, ParcelDeliveryHistory, ParcelStatusHistory, TrackingLocation, UserParcel
+)
+
+DEFAULT_BATCH_SIZE = 2000
+
+# Status each generated history chain walks through, in order
+STATUS_PATH = ('pending', 'received', 'in_transit', 'delivered')
+
+
+class BenchmarkData:
+    """What the scenarios need to know about a generated dataset"""
+
+    def __init__(self, user, organization_id, parcel_ids, tracking_numbers):
+        self.user = user
+        self.organization_id = organization_id
+        self.parcel_ids = parcel_ids
+        self.tracking_numbers = tracking_numbers
+
+
+def generate(organizations=2, departments=3, parcels=10000, locations=10, history=4, linked_share=0.2,
+             seed=0, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Create a synthetic dataset; returns ``BenchmarkData`` for the first organization"""
+    rng = random.Random(seed)
+    now = timezone.now()
+    courier = User.objects.create_user(username=f'bench-courier-{seed}')
+    admins, organization_ids, department_ids = [], [], {}
+    for index in range(organizations):
+        admin = User.objects.create_user(username=f'bench-admin-{seed}-{index}')
+        organization = Organization.objects.create(name=f'Benchmark {index}', admin=admin)
+        admins.append(admin)
+        organization_ids.append(organization.id)
+        department_ids[organization.id] = [
+            Department.objects.create(organization=organization, name=f'Department {number}').id
+            for number in range(departments)
+        ]
+
+    own_parcel_ids, own_tracking_numbers = [], []
+    statuses = [status for status, _ in Parcel.STATUS_CHOICES]
+    types = [parcel_type for parcel_type, _ in Parcel.TYPE_CHOICES]
+    admin_by_organization = dict(zip(organization_ids, admins))
+    for start in range(0, parcels, batch_size):
+        batch = []
+        for number in range(start, min(start + batch_size, parcels)):
+            organization_id = organization_ids[number % organizations]
+            batch.append(Parcel(
+                organization_id=organization_id,
+                department_id=rng.choice(department_ids[organization_id]) if departments else None,
+                tracking_number=f'BENCH-{seed}-{number:08d}',
+                parcel_type=rng.choice(types),
+                status=rng.choice(statuses),
+                sender_name=f'Sender {rng.randrange(1000)}',
+                receiver_name=f'Receiver {rng.randrange(1000)}',
+                latitude=rng.uniform(-1.5, -1.0),
+                longitude=rng.uniform(36.6, 37.1),
+            ))
+        Parcel.objects.bulk_create(batch)
+        _write_chains(batch, rng, now, locations, history, linked_share, courier, admin_by_organization)
+        for parcel in batch:
+            if parcel.organization_id == organization_ids[0]:
+                own_parcel_ids.append(parcel.id)
+                own_tracking_numbers.append(parcel.tracking_number)
+        if progress:
+            progress(min(start + batch_size, parcels), parcels)
+
+    backend = search.get_backend()
+    if backend is not None:
+        for label in search.DOCUMENTS:
+            backend.rebuild(label)
+    today = timezone.localdate()
+    rollups.backfill(today - timedelta(days=1), today)
+    return BenchmarkData(admins[0], organization_ids[0], own_parcel_ids, own_tracking_numbers)
+
+
+def _write_chains(parcels, rng, now, locations, history, linked_share, courier, admin_by_organization):
+    points, changes, deliveries, index_rows = [], [], [], []
+    for parcel in parcels:
+        latitude, longitude = parcel.latitude, parcel.longitude
+        for step in range(locations):
+            latitude += rng.uniform(-0.01, 0.01)
+            longitude += rng.uniform(-0.01, 0.01)
+            points.append(TrackingLocation(
+                parcel_id=parcel.id, latitude=round(latitude, 6), longitude=round(longitude, 6),
+                location_name=f'Checkpoint {step}', status=parcel.status,
+                timestamp=now - timedelta(minutes=10 * (locations - step)),
+            ))
+        for step in range(history):
+            previous = STATUS_PATH[step % len(STATUS_PATH)]
+            changes.append(ParcelStatusHistory(
+                parcel_id=parcel.id, previous_status=previous,
+                new_status=STATUS_PATH[(step + 1) % len(STATUS_PATH)], notes='benchmark',
+            ))
+        if rng.random() < linked_share:
+            sender = admin_by_organization[parcel.organization_id]
+            for user, role in ((sender, 'sender'), (courier, 'receiver')):
+                deliveries.append(ParcelDeliveryHistory(user=user, parcel_id=parcel.id, role=role))
+                index_rows.append(UserParcel(
+                    user=user, parcel_id=parcel.id, role=role, status=parcel.status, created_at=parcel.created_at
+                ))
+    for model, rows in ((TrackingLocation, points), (ParcelStatusHistory, changes),
+                        (ParcelDeliveryHistory, deliveries), (UserParcel, index_rows)):
+        for chunk in iter_chunks(rows, DEFAULT_BATCH_SIZE):
+            model.objects.bulk_create(chunk)
+
+
+def _detail(data, rng):
+    return 'get', f'/api/parcels/{rng.choice(data.parcel_ids)}/', None
+
+
+def _search_by_barcode(data, rng):
+    return 'get', '/api/parcels/search_by_barcode/', {'tracking_number': rng.choice(data.tracking_numbers)}
+
+
+def _update_status(data, rng):
+    status = rng.choice(STATUS_PATH)
+    return 'post', f'/api/parcels/{rng.choice(data.parcel_ids)}/update_status/', {'status': status}
+
+
+# Scenario name -> function building ``(method, path, payload)`` for one request
+SCENARIOS = {
+    'parcel_list': lambda data, rng: ('get', '/api/parcels/', None),
+    'parcel_detail': _detail,
+    'search_by_barcode': _search_by_barcode,
+    'update_status': _update_status,
+    'statistics': lambda data, rng: ('get', f'/api/organizations/{data.organization_id}/statistics/', None),
+    'my_parcels': lambda data, rng: ('get', '/api/parcels/my_parcels/', None),
+}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def run_scenario(name, data, iterations=200, warmup=20, seed=0, client=None):
+    """Time ``iterations`` requests of one scenario after ``warmup`` untimed ones"""
+    build = SCENARIOS[name]
+    rng = random.Random(seed)
+    if client is None:
+        client = APIClient()
+        client.force_authenticate(data.user)
+
+    def issue():
+        method, path, payload = build(data, rng)
+        if method == 'get':
+            response = client.get(path, payload)
+        else:
+            response = client.post(path, payload, format='json')
+        if response.status_code >= 400:
+            raise RuntimeError(f'{name}: {method.upper()} {path} returned {response.status_code}')
+
+    for _ in range(warmup):
+        issue()
+    durations, queries = [], []
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            issue()
+            durations.append(time.perf_counter() - start)
+        queries.append(len(captured))
+    total = sum(durations)
+    return {
+        'iterations': iterations,
+        'throughput_rps': round(iterations / total, 1) if total else None,
+        'mean_ms': round(statistics.fmean(durations) * 1000, 3),
+        'p50_ms': round(percentile(durations, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(durations, 0.99) * 1000, 3),
+        'queries_p50': percentile(queries, 0.5),
+        'queries_max': max(queries),
+    }
+
+
+def serializer_throughput(queryset, repeat=5):
+    """Rows per second for ``ParcelListSerializer`` over model instances and over ``values_rows`` dicts.
+
+    Each timing includes the query, as a list page pays for both.
+    """
+    def best(serialize):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = serialize()
+            timings.append(time.perf_counter() - start)
+        return round(len(rows) / min(timings), 1) if rows else None
+
+    instances = best(lambda: ParcelListSerializer(queryset.select_related('department'), many=True).data)
+    values = best(lambda: ParcelListSerializer(values_rows(queryset, ParcelListSerializer()), many=True).data)
+    return {
+        'rows': queryset.count(),
+        'instances_rows_per_s': instances,
+        'values_rows_per_s': values,
+        'speedup': round(values / instances, 2) if instances and values else None,
+    }
+
+
+def compare(results, baseline, tolerance=0.5):
+    """Regression messages for scenarios present in both result sets"""
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['queries_max'] > expected['queries_max']:
+            regressions.append(
+                f"{name}: up to {result['queries_max']} queries per request (baseline {expected['queries_max']})"
+            )
+        limit = expected['p99_ms'] * (1 + tolerance)
+        if result['p99_ms'] > limit:
+            regressions.append(
+                f"{name}: p99 {result['p99_ms']:.1f} ms exceeds baseline {expected['p99_ms']:.1f} ms "
+                f"by more than {tolerance:.0%}"
+            )
+    return regressions
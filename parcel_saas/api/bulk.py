@@ -0,0 +1,155 @@
+"""Bulk parcel ingestion.
+
+Rows are consumed lazily in chunks. Each chunk is validated field by field
+without touching the database, then checked against existing tracking
+numbers, organizations and departments with one set-based query per relation
+before being inserted with ``bulk_create``. Invalid rows are reported by
+index and skipped; the rest of the batch is still written.
+"""
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from . import rollups, search, stats
+from .models import Department, Organization, Parcel
+from .parsers import UnparsedRow
+from .serializers import ParcelBulkRowSerializer
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 10000
+
+
+def get_batch_size(requested=None):
+    """Resolve the chunk size from a request value or the PARCEL_BULK_BATCH_SIZE setting"""
+    default = getattr(settings, 'PARCEL_BULK_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    try:
+        size = int(requested) if requested else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, MAX_BATCH_SIZE))
+
+
+def iter_chunks(rows, size):
+    iterator = iter(rows)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class BulkParcelImporter:
+    """Validate and insert parcel rows in chunks, collecting per-row errors"""
+
+    def __init__(self, batch_size=None, organizations=None, departments=None):
+        self.batch_size = get_batch_size(batch_size)
+        # Rows may only reference these; callers pass tenant-scoped querysets
+        self.organizations = Organization.objects.all() if organizations is None else organizations
+        self.departments = Department.objects.all() if departments is None else departments
+        self.created = 0
+        self.errors = []
+        self._seen_tracking_numbers = set()
+        self._organization_ids = set()
+        self._department_ids = set()
+
+    def run(self, rows):
+        offset = 0
+        for chunk in iter_chunks(rows, self.batch_size):
+            self._import_chunk(offset, chunk)
+            offset += len(chunk)
+        return {'received': offset, 'created': self.created, 'failed': len(self.errors), 'errors': self.errors}
+
+    def _error(self, index, errors):
+        self.errors.append({'row': index, 'errors': errors})
+
+    def _import_chunk(self, offset, chunk):
+        valid = []
+        for index, row in enumerate(chunk, start=offset):
+            if isinstance(row, UnparsedRow):
+                self._error(index, {'non_field_errors': [row.message]})
+                continue
+            if not isinstance(row, dict):
+                self._error(index, {'non_field_errors': ['Expected an object.']})
+                continue
+            serializer = ParcelBulkRowSerializer(data=row)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                self._error(index, serializer.errors)
+
+        valid = self._check_relations(valid)
+        parcels = [(index, self._build_parcel(data)) for index, data in valid]
+        self._insert(parcels)
+
+    def _check_relations(self, rows):
+        tracking_numbers = {data['tracking_number'] for _, data in rows}
+        existing = set(
+            Parcel.objects.filter(tracking_number__in=tracking_numbers).values_list('tracking_number', flat=True)
+        )
+        self._remember(
+            self._organization_ids, self.organizations,
+            {data['organization'] for _, data in rows},
+        )
+        self._remember(
+            self._department_ids, self.departments,
+            {data['department'] for _, data in rows if data.get('department')},
+        )
+
+        checked = []
+        for index, data in rows:
+            tracking_number = data['tracking_number']
+            if tracking_number in existing or tracking_number in self._seen_tracking_numbers:
+                self._error(index, {'tracking_number': ['A parcel with this tracking number already exists.']})
+            elif data['organization'] not in self._organization_ids:
+                self._error(index, {'organization': [f'Invalid pk "{data["organization"]}" - object does not exist.']})
+            elif data.get('department') and data['department'] not in self._department_ids:
+                self._error(index, {'department': [f'Invalid pk "{data["department"]}" - object does not exist.']})
+            else:
+                self._seen_tracking_numbers.add(tracking_number)
+                checked.append((index, data))
+        return checked
+
+    def _remember(self, known, queryset, ids):
+        """Add the ids from ``ids`` that exist in ``queryset`` to the ``known`` cache"""
+        unknown = ids - known
+        if unknown:
+            known.update(queryset.filter(pk__in=unknown).values_list('pk', flat=True))
+
+    def _build_parcel(self, data):
+        data = dict(data)
+        data['organization_id'] = data.pop('organization')
+        data['department_id'] = data.pop('department', None)
+        return Parcel(**data)
+
+    def _insert(self, parcels):
+        if not parcels:
+            return
+        try:
+            with transaction.atomic():
+                Parcel.objects.bulk_create([parcel for _, parcel in parcels], batch_size=self.batch_size)
+                created = [parcel for _, parcel in parcels]
+                # bulk_create bypasses the save signal that maintains the search index
+                search.index_instances(created)
+        except IntegrityError:
+            # A concurrent writer took some tracking numbers; retry row by row
+            created = []
+            for index, parcel in parcels:
+                parcel.pk = None
+                parcel._state.adding = True
+                try:
+                    with transaction.atomic():
+                        parcel.save(force_insert=True)
+                    created.append(parcel)
+                except IntegrityError:
+                    self._error(index, {'tracking_number': ['A parcel with this tracking number already exists.']})
+        self.created += len(created)
+        self._record_statistics(created)
+
+    def _record_statistics(self, parcels):
+        added = {}
+        for parcel in parcels:
+            added.setdefault(parcel.organization_id, []).append(stats.parcel_key(parcel))
+        for organization_id, keys in added.items():
+            stats.apply_count_deltas(organization_id, added=keys)
+        rollups.record_parcels_created(parcels)
@@ -0,0 +1,262 @@
+"""Read-through cache of serialized parcel detail payloads keyed by tracking number.
+
+Lookups go to an in-process LRU first, then to an optional shared Django
+cache backend, and only then to the database. Entries are dropped by parcel
+id whenever the parcel or one of its nested relations changes (see
+``api.signals``). Configure with the ``PARCEL_DETAIL_CACHE`` setting::
+
+    PARCEL_DETAIL_CACHE = {
+        'MAX_ENTRIES': 10000,   # in-process LRU size, 0 disables it
+        'TIMEOUT': 300,         # seconds an entry may be served from BACKEND
+        'BACKEND': None,        # optional CACHES alias shared across workers
+        'LOCAL_TIMEOUT': None,  # in-process TTL, 5s by default
+    }
+
+An invalidation only reaches the in-process LRU of the worker that made the
+write (and the shared backend), so local entries are short-lived by default:
+other workers serve a stale payload for at most ``LOCAL_TIMEOUT``. Raise it
+only for single-process deployments.
+
+Every invalidation also bumps a per-parcel version. A miss takes a token with
+``begin()`` before reading the database and ``set()`` refuses to store the
+payload if the parcel was invalidated meanwhile, so a payload built from rows
+read before a concurrent write is never cached. Until a worker has seen a
+tracking number's parcel id, the token falls back to a count of all
+invalidations.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+DEFAULTS = {
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 300,
+    'BACKEND': None,
+    'LOCAL_TIMEOUT': None,
+}
+
+# Default local TTL, bounding staleness after another worker invalidates
+SHARED_LOCAL_TIMEOUT = 5
+
+GENERATION_KEY = 'parcel-detail-generation'
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU mapping with per-entry expiry"""
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ParcelDetailCache:
+    """Tracking number -> serialized ``ParcelDetailSerializer`` payload"""
+
+    def __init__(self):
+        self._local = None
+        self._local_ids = None
+        self._parcel_ids = None
+        self._versions = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.discarded = 0
+
+    @property
+    def config(self):
+        return {**DEFAULTS, **getattr(settings, 'PARCEL_DETAIL_CACHE', {})}
+
+    def _build_local(self):
+        config = self.config
+        local_timeout = config['LOCAL_TIMEOUT']
+        if local_timeout is None:
+            local_timeout = min(SHARED_LOCAL_TIMEOUT, config['TIMEOUT'])
+        self._local = LRUCache(config['MAX_ENTRIES'], local_timeout)
+        self._local_ids = LRUCache(config['MAX_ENTRIES'], local_timeout)
+        # Outlive the payloads: tokens must see every invalidation since the build began
+        self._parcel_ids = LRUCache(config['MAX_ENTRIES'], config['TIMEOUT'])
+        self._versions = LRUCache(config['MAX_ENTRIES'], config['TIMEOUT'])
+
+    @property
+    def local(self):
+        if self._local is None:
+            self._build_local()
+        return self._local
+
+    @property
+    def local_ids(self):
+        if self._local_ids is None:
+            self._build_local()
+        return self._local_ids
+
+    @property
+    def parcel_ids(self):
+        if self._parcel_ids is None:
+            self._build_local()
+        return self._parcel_ids
+
+    @property
+    def versions(self):
+        if self._versions is None:
+            self._build_local()
+        return self._versions
+
+    @property
+    def shared(self):
+        alias = self.config['BACKEND']
+        return caches[alias] if alias else None
+
+    @staticmethod
+    def _payload_key(tracking_number):
+        return f'parcel-detail:{tracking_number}'
+
+    @staticmethod
+    def _id_key(parcel_id):
+        return f'parcel-detail-id:{parcel_id}'
+
+    @staticmethod
+    def _version_key(parcel_id):
+        return f'parcel-detail-version:{parcel_id}'
+
+    def _stamp(self, parcel_id):
+        """Current version of ``parcel_id``, or of the whole cache when it is None"""
+        shared = self.shared
+        if parcel_id is None:
+            local, key = self._generation, GENERATION_KEY
+        else:
+            local, key = self.versions.get(parcel_id) or 0, self._version_key(parcel_id)
+        return local, shared.get(key, 0) if shared is not None else 0
+
+    def _bump(self, parcel_id):
+        with self._lock:
+            self._generation += 1
+            self.versions.set(parcel_id, (self.versions.get(parcel_id) or 0) + 1)
+        shared = self.shared
+        if shared is not None:
+            for key, timeout in ((GENERATION_KEY, None), (self._version_key(parcel_id), self.config['TIMEOUT'])):
+                try:
+                    shared.incr(key)
+                except ValueError:
+                    # Never stored or expired; tokens taken before then read 0, so they still differ
+                    shared.set(key, 1, timeout)
+
+    def begin(self, tracking_number):
+        """Token to pass to ``set()``, taken before the payload's rows are read"""
+        parcel_id = self.parcel_ids.get(tracking_number)
+        return parcel_id, self._stamp(parcel_id)
+
+    def get(self, tracking_number):
+        key = self._payload_key(tracking_number)
+        payload = self.local.get(key)
+        if payload is not None:
+            self.hits += 1
+            return payload
+        shared = self.shared
+        if shared is not None:
+            payload = shared.get(key)
+            if payload is not None:
+                self.shared_hits += 1
+                self.local.set(key, payload)
+                return payload
+        self.misses += 1
+        return None
+
+    def set(self, tracking_number, parcel_id, payload, token):
+        """Store ``payload`` unless the parcel was invalidated since ``begin()`` returned ``token``"""
+        self.parcel_ids.set(tracking_number, parcel_id)
+        token_parcel_id, stamp = token
+        if token_parcel_id not in (None, parcel_id) or self._stamp(token_parcel_id) != stamp:
+            self.discarded += 1
+            return
+        key = self._payload_key(tracking_number)
+        self.local.set(key, payload)
+        self.local_ids.set(parcel_id, tracking_number)
+        shared = self.shared
+        if shared is not None:
+            timeout = self.config['TIMEOUT']
+            shared.set_many({key: payload, self._id_key(parcel_id): tracking_number}, timeout)
+
+    def invalidate(self, parcel_id, tracking_number=None):
+        """Drop a parcel's entry by id, plus ``tracking_number`` if it may have changed"""
+        self.invalidations += 1
+        self._bump(parcel_id)
+        id_key = self._id_key(parcel_id)
+        tracking_numbers = {tracking_number, self.local_ids.get(parcel_id)}
+        self.local_ids.delete(parcel_id)
+        shared = self.shared
+        if shared is not None:
+            tracking_numbers.add(shared.get(id_key))
+        keys = [self._payload_key(value) for value in tracking_numbers if value]
+        for key in keys:
+            self.local.delete(key)
+        if shared is not None:
+            shared.delete_many(keys + [id_key])
+
+    def invalidate_many(self, parcel_ids):
+        for parcel_id in parcel_ids:
+            self.invalidate(parcel_id)
+
+    def clear(self):
+        """Drop the in-process cache and reset counters (the shared backend is left as is)"""
+        self._local = None
+        self._local_ids = None
+        self._parcel_ids = None
+        self._versions = None
+        self.hits = self.shared_hits = self.misses = self.invalidations = self.discarded = 0
+
+    def stats(self):
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'discarded': self.discarded,
+            'hit_rate': round((self.hits + self.shared_hits) / lookups, 4) if lookups else None,
+            'local_entries': len(self.local),
+            'max_entries': self.local.max_entries,
+            'shared_backend': self.config['BACKEND'],
+        }
+
+
+parcel_detail_cache = ParcelDetailCache()
@@ -0,0 +1,132 @@
+"""Tracking event fan-out.
+
+Events are published to ``parcel:<id>`` and ``organization:<id>`` channels
+and delivered to Server-Sent Events subscribers (see ``api.streaming``). The
+broker is chosen by the ``PARCEL_EVENT_BROKER`` setting so the in-process
+implementation can be replaced by one backed by an external broker; it only
+needs ``publish``, ``subscribe``, ``unsubscribe`` and ``replay``.
+"""
+import asyncio
+import itertools
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .serializers import TrackingLocationSerializer
+
+DEFAULT_BROKER = 'api.events.InProcessBroker'
+
+# Recent events kept for Last-Event-ID resume
+REPLAY_BUFFER_SIZE = 1000
+
+# Undelivered events per subscriber before the oldest are dropped
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+def parcel_channel(parcel_id):
+    return f'parcel:{parcel_id}'
+
+
+def organization_channel(organization_id):
+    return f'organization:{organization_id}'
+
+
+class Subscription:
+    """A subscriber's queue, bound to the event loop that consumes it"""
+
+    def __init__(self, channels, loop):
+        self.channels = set(channels)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, event):
+        # Called on the subscriber's loop; drop the oldest event rather than block the publisher
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InProcessBroker:
+    """Publish/subscribe within a single process.
+
+    ``publish`` may be called from any thread (sync views run in a worker
+    thread under ASGI); delivery is handed to each subscriber's event loop.
+    """
+
+    def __init__(self, replay_size=REPLAY_BUFFER_SIZE):
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._recent = deque(maxlen=replay_size)
+
+    def publish(self, channels, event_type, data):
+        with self._lock:
+            event = {'id': next(self._ids), 'type': event_type, 'channels': list(channels), 'data': data}
+            self._recent.append(event)
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.channels.intersection(channels):
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+                except RuntimeError:
+                    # The subscriber's loop has closed without unsubscribing
+                    self.unsubscribe(subscription)
+        return event
+
+    def subscribe(self, channels):
+        subscription = Subscription(channels, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def replay(self, channels, last_event_id):
+        """Buffered events on ``channels`` newer than ``last_event_id``"""
+        with self._lock:
+            recent = list(self._recent)
+        channels = set(channels)
+        return [
+            event for event in recent
+            if event['id'] > last_event_id and channels.intersection(event['channels'])
+        ]
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(getattr(settings, 'PARCEL_EVENT_BROKER', DEFAULT_BROKER))()
+    return _broker
+
+
+def publish_on_commit(parcel_id, organization_id, event_type, data):
+    """Publish to the parcel's and organization's channels once the transaction commits"""
+    channels = [parcel_channel(parcel_id), organization_channel(organization_id)]
+    transaction.on_commit(lambda: get_broker().publish(channels, event_type, data))
+
+
+def publish_location(location, organization_id):
+    publish_on_commit(location.parcel_id, organization_id, 'location', TrackingLocationSerializer(location).data)
+
+
+def publish_status(parcel_id, organization_id, tracking_number, previous_status, new_status):
+    publish_on_commit(parcel_id, organization_id, 'status', {
+        'parcel': parcel_id,
+        'tracking_number': tracking_number,
+        'previous_status': previous_status,
+        'new_status': new_status,
+    })
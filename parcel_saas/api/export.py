@@ -0,0 +1,134 @@
+"""Streaming exports of parcels and their history.
+
+``GET /api/parcels/export/`` streams every parcel matching the usual
+``ParcelViewSet`` filters (``?organization=``, ``?status=``, ``?search=``,
+``?near=`` ...). ``?dataset=status_history`` or ``?dataset=tracking_locations``
+exports those rows for the matching parcels instead. ``?output=csv`` (the
+default) or ``?output=ndjson`` picks the format and ``?compression=gzip``
+compresses the stream.
+
+Rows are read in primary-key order with ``iterator(chunk_size=...)``, which
+uses a server-side cursor on PostgreSQL, serialized from ``values()`` rows and
+written out as they arrive through ``StreamingHttpResponse``, so memory stays
+flat whatever the size of the export. Every row carries its ``id``; an
+interrupted export resumes with ``?after=<last id received>``.
+"""
+import csv
+import io
+import zlib
+
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import ParcelStatusHistory, TrackingLocation
+from .rows import values_rows
+from .serializers import ParcelListSerializer, ParcelStatusHistorySerializer, TrackingLocationSerializer
+
+CHUNK_SIZE = 2000
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Dataset -> (model, or None for the parcels themselves; serializer)
+DATASETS = {
+    'parcels': (None, ParcelListSerializer),
+    'status_history': (ParcelStatusHistory, ParcelStatusHistorySerializer),
+    'tracking_locations': (TrackingLocation, TrackingLocationSerializer),
+}
+
+
+def parse_options(params):
+    """Validate the export query parameters"""
+    options = {
+        'dataset': params.get('dataset', 'parcels'),
+        'output': params.get('output', 'csv'),
+        'compression': params.get('compression') or None,
+        'after': params.get('after'),
+    }
+    errors = {}
+    if options['dataset'] not in DATASETS:
+        errors['dataset'] = f"Must be one of: {', '.join(DATASETS)}"
+    if options['output'] not in FORMATS:
+        errors['output'] = f"Must be one of: {', '.join(FORMATS)}"
+    if options['compression'] not in (None, 'gzip'):
+        errors['compression'] = 'Must be gzip'
+    if options['after'] is not None:
+        try:
+            options['after'] = int(options['after'])
+        except ValueError:
+            errors['after'] = 'Must be an id'
+    if errors:
+        raise ValidationError(errors)
+    return options
+
+
+def csv_chunks(columns, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows([row.get(column) for column in columns] for row in rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def ndjson_chunks(chunks):
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for rows in chunks:
+        yield ''.join(encoder.encode(row) + '\n' for row in rows).encode('utf-8')
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def serialized_chunks(queryset, serializer, chunk_size=CHUNK_SIZE):
+    """Lists of serialized rows, ``chunk_size`` at a time"""
+    rows = []
+    for row in values_rows(queryset, serializer).iterator(chunk_size=chunk_size):
+        rows.append(serializer.to_representation(row))
+        if len(rows) == chunk_size:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+
+def export_response(parcels, dataset='parcels', output='csv', compression=None, after=None, chunk_size=CHUNK_SIZE):
+    """Stream ``dataset`` for the ``parcels`` queryset"""
+    model, serializer_class = DATASETS[dataset]
+    if model is None:
+        queryset = parcels
+    else:
+        queryset = model.objects.filter(parcel__in=parcels.order_by().values('id'))
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    queryset = queryset.order_by('pk')
+
+    serializer = serializer_class()
+    chunks = serialized_chunks(queryset, serializer, chunk_size)
+    if output == 'csv':
+        content = csv_chunks(list(serializer.fields), chunks)
+    else:
+        content = ndjson_chunks(chunks)
+    filename = f'{dataset}.{output}'
+    content_type = FORMATS[output]
+    if compression == 'gzip':
+        content = gzip_chunks(content)
+        filename += '.gz'
+        content_type = 'application/gzip'
+
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
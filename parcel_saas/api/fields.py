@@ -0,0 +1,58 @@
+from django.db import models
+
+from .geo import GEOHASH_PRECISION, geohash_encode
+
+
+class GeohashField(models.CharField):
+    """Geohash of the model's latitude/longitude, recomputed whenever the row is written.
+
+    Computed in ``pre_save`` so it is kept current by ``save()`` and
+    ``bulk_create``; models using it also inherit ``GeohashMixin`` so that
+    ``save(update_fields=[...])`` naming a coordinate writes it too.
+    ``bulk_update`` and ``QuerySet.update`` callers that move a point must
+    set it themselves.
+    """
+
+    def __init__(self, *args, latitude_field='latitude', longitude_field='longitude', **kwargs):
+        self.latitude_field = latitude_field
+        self.longitude_field = longitude_field
+        kwargs.setdefault('max_length', GEOHASH_PRECISION)
+        kwargs.setdefault('editable', False)
+        kwargs.setdefault('blank', True)
+        kwargs.setdefault('null', True)
+        kwargs.setdefault('db_index', True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.latitude_field != 'latitude':
+            kwargs['latitude_field'] = self.latitude_field
+        if self.longitude_field != 'longitude':
+            kwargs['longitude_field'] = self.longitude_field
+        return name, path, args, kwargs
+
+    def compute(self, instance):
+        latitude = getattr(instance, self.latitude_field)
+        longitude = getattr(instance, self.longitude_field)
+        if latitude is None or longitude is None:
+            return None
+        return geohash_encode(latitude, longitude)
+
+    def pre_save(self, model_instance, add):
+        value = self.compute(model_instance)
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+class GeohashMixin:
+    """Adds the model's geohash fields to ``save(update_fields=...)`` when their coordinates are listed"""
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            for field in self._meta.concrete_fields:
+                if isinstance(field, GeohashField) and {field.latitude_field, field.longitude_field} & update_fields:
+                    update_fields.add(field.name)
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
@@ -0,0 +1,101 @@
+"""Sparse fieldsets and optional expansion.
+
+``?fields=id,status,current_location`` limits a response to those fields and
+``?expand=parcel`` swaps a related id for the nested object, for serializers
+using ``SparseFieldsMixin``; expandable relations are declared in the
+serializer's ``Meta``::
+
+    class Meta:
+        expandable = {'parcel': ParcelListSerializer}
+
+Expanded fields are kept even when ``?fields=`` does not list them. The view
+passes the parsed parameters in the serializer context (see
+``PrefetchPlanMixin``) and builds its query from the pruned fields, so a
+relation no remaining field reads is neither joined nor prefetched and only
+the columns those fields read are loaded.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from .rows import DISPLAY_SOURCE
+
+
+def parse_names(value):
+    return [name for name in (part.strip() for part in (value or '').split(',')) if name]
+
+
+def requested_fieldset(request):
+    """``(fields or None, expand)`` from the query string"""
+    fields = parse_names(request.query_params.get('fields')) or None
+    return fields, parse_names(request.query_params.get('expand'))
+
+
+def prune_payload(payload, fields):
+    """Keep ``fields`` of an already serialized payload"""
+    unknown = [name for name in fields if name not in payload]
+    if unknown:
+        raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}"})
+    return {name: payload[name] for name in fields}
+
+
+class SparseFieldsMixin:
+    """Keeps ``context['fields']`` and expands ``context['expand']`` from ``Meta.expandable``.
+
+    Only the serializer's own context is consulted, so nested serializers
+    declared on a parent are never pruned by the parent's parameters.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self._context.get('fields')
+        expand = self._context.get('expand') or ()
+        expandable = getattr(self.Meta, 'expandable', {})
+
+        unknown = [name for name in expand if name not in expandable or name not in fields]
+        if unknown:
+            raise ValidationError({'expand': f"Cannot expand: {', '.join(unknown)}"})
+        for name in expand:
+            fields[name] = expandable[name](read_only=True)
+
+        if requested is None:
+            return fields
+        unknown = [name for name in requested if name not in fields]
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}"})
+        keep = set(requested) | set(expand)
+        return {name: field for name, field in fields.items() if name in keep}
+
+
+def fields_read(model, fields):
+    """``(columns, relations, nested select_related)`` that bound ``fields`` read from ``model``.
+
+    ``columns`` is None when a reverse relation is kept: Django refuses to
+    ``select_related`` one through a deferred instance, and prefetched rows hold
+    the parent instance, whose columns their serializers may read. Returns
+    None when a field reads something that cannot be traced to model fields
+    (method fields, ``source='*'``, properties).
+    """
+    columns, relations, nested = {model._meta.pk.name}, set(), []
+    restrict = True
+    for field in fields.values():
+        display = DISPLAY_SOURCE.fullmatch(field.source)
+        root = display.group(1) if display else field.source.split('.')[0]
+        try:
+            model_field = model._meta.get_field(root)
+        except FieldDoesNotExist:
+            return None
+        if not model_field.is_relation:
+            columns.add(root)
+            continue
+        relations.add(root)
+        if not model_field.concrete:
+            restrict = False
+        else:
+            columns.add(root)
+            if isinstance(field, serializers.BaseSerializer):
+                # A forward relation expanded with its own plan
+                nested.extend(
+                    f'{root}__{lookup}' for lookup in getattr(field.Meta, 'select_related', ())
+                )
+    return columns if restrict else None, relations, nested
@@ -0,0 +1,110 @@
+"""Custom filter backends"""
+from functools import reduce
+from math import radians
+from operator import or_
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, OrderingFilter, SearchFilter
+
+from . import search
+from .geo import EARTH_RADIUS_KM, bounding_box, covering_geohashes
+
+DEFAULT_RADIUS_KM = 5.0
+MAX_RADIUS_KM = 500.0
+
+# Sorts after every geohash character, so prefix <= geohash < prefix + '~' is a prefix match
+GEOHASH_RANGE_END = '~'
+
+
+def _floats(value, count, name):
+    try:
+        numbers = [float(part) for part in value.split(',')]
+    except ValueError:
+        numbers = []
+    if len(numbers) != count:
+        raise ValidationError({name: f'Expected {count} comma-separated numbers.'})
+    return numbers
+
+
+def geohash_prefix_q(prefixes, field='geohash'):
+    """Index-friendly range lookups matching any of the geohash ``prefixes``"""
+    return reduce(or_, (
+        Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + GEOHASH_RANGE_END}) for prefix in prefixes
+    ))
+
+
+def distance_km_expression(latitude, longitude):
+    """Haversine distance in km from a point to each row's latitude/longitude"""
+    point_lat = Value(radians(latitude), output_field=FloatField())
+    point_lon = Value(radians(longitude), output_field=FloatField())
+    row_lat = Radians(F('latitude'))
+    row_lon = Radians(F('longitude'))
+    a = (
+        Power(Sin((row_lat - point_lat) / 2), 2)
+        + Cos(point_lat) * Cos(row_lat) * Power(Sin((row_lon - point_lon) / 2), 2)
+    )
+    return 2 * EARTH_RADIUS_KM * ASin(Sqrt(a))
+
+
+def filter_bbox(queryset, min_lat, min_lon, max_lat, max_lon):
+    """Restrict to a box, narrowing by geohash prefix first so the index does the work"""
+    queryset = queryset.filter(
+        latitude__gte=min_lat, latitude__lte=max_lat, longitude__gte=min_lon, longitude__lte=max_lon
+    )
+    prefixes = covering_geohashes(min_lat, min_lon, max_lat, max_lon)
+    if prefixes:
+        queryset = queryset.filter(geohash_prefix_q(prefixes))
+    return queryset
+
+
+def filter_near(queryset, latitude, longitude, radius_km):
+    """Restrict to rows within ``radius_km``, annotated with ``distance_km``"""
+    queryset = filter_bbox(queryset, *bounding_box(latitude, longitude, radius_km))
+    return queryset.annotate(distance_km=distance_km_expression(latitude, longitude)).filter(
+        distance_km__lte=radius_km
+    )
+
+
+class SpatialFilterBackend(BaseFilterBackend):
+    """``?near=lat,lon&radius_km=`` and ``?within_bbox=min_lat,min_lon,max_lat,max_lon`` filters"""
+
+    def filter_queryset(self, request, queryset, view):
+        near = request.query_params.get('near')
+        bbox = request.query_params.get('within_bbox')
+        if bbox:
+            min_lat, min_lon, max_lat, max_lon = _floats(bbox, 4, 'within_bbox')
+            if min_lat > max_lat:
+                raise ValidationError({'within_bbox': 'min_lat must not exceed max_lat.'})
+            queryset = filter_bbox(queryset, min_lat, min_lon, max_lat, max_lon)
+        if near:
+            latitude, longitude = _floats(near, 2, 'near')
+            radius = request.query_params.get('radius_km', DEFAULT_RADIUS_KM)
+            (radius,) = _floats(str(radius), 1, 'radius_km')
+            if not 0 < radius <= MAX_RADIUS_KM:
+                raise ValidationError({'radius_km': f'Must be between 0 and {MAX_RADIUS_KM}.'})
+            queryset = filter_near(queryset, latitude, longitude, radius)
+        return queryset
+
+
+class FullTextSearchFilter(SearchFilter):
+    """``?search=`` through the full-text index, falling back to ``icontains`` without one"""
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        ranked = search.search_queryset(queryset, ' '.join(terms))
+        if ranked is None:
+            return super().filter_queryset(request, queryset, view)
+        return ranked
+
+
+class RankedOrderingFilter(OrderingFilter):
+    """Orders full-text matches by relevance unless ``?ordering=`` is given"""
+
+    def get_ordering(self, request, queryset, view):
+        if not request.query_params.get(self.ordering_param) and search.RANK_FIELD in queryset.query.annotations:
+            return [f'-{search.RANK_FIELD}', *(self.get_default_ordering(view) or [])]
+        return super().get_ordering(request, queryset, view)
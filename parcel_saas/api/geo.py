@@ -0,0 +1,94 @@
+"""Geographic helpers shared by tracking, search and routing code"""
+from math import asin, cos, radians, sin, sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres between two WGS84 points"""
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(a))
+
+
+# Geohash cells: interleaved longitude/latitude bisection, base32 encoded
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+KM_PER_DEGREE = 111.32
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                value = value * 2 + 1
+                lon_range[0] = mid
+            else:
+                value *= 2
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                value = value * 2 + 1
+                lat_range[0] = mid
+            else:
+                value *= 2
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """(height, width) in degrees of a geohash cell at ``precision``"""
+    total_bits = 5 * precision
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def degrees_for_radius(latitude, radius_km):
+    """(latitude, longitude) degree deltas spanning ``radius_km`` around ``latitude``"""
+    dlat = radius_km / KM_PER_DEGREE
+    dlon = radius_km / (KM_PER_DEGREE * max(cos(radians(latitude)), 1e-6))
+    return dlat, dlon
+
+
+def bounding_box(latitude, longitude, radius_km):
+    dlat, dlon = degrees_for_radius(latitude, radius_km)
+    return latitude - dlat, longitude - dlon, latitude + dlat, longitude + dlon
+
+
+def covering_geohashes(min_lat, min_lon, max_lat, max_lon, max_cells=16):
+    """Geohash prefixes whose cells together cover the bounding box.
+
+    Uses the longest precision at which the box spans at most ``max_cells``
+    cells; returns an empty list when no precision is coarse enough (e.g.
+    boxes crossing the antimeridian), meaning no prefix narrowing applies.
+    """
+    if min_lon > max_lon:
+        return []
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = geohash_cell_size(precision)
+        first_row, last_row = int(min_lat // height), int(max_lat // height)
+        first_col, last_col = int(min_lon // width), int(max_lon // width)
+        if (last_row - first_row + 1) * (last_col - first_col + 1) > max_cells:
+            continue
+        cells = set()
+        for row in range(first_row, last_row + 1):
+            latitude = min(max((row + 0.5) * height, -90.0), 89.999999)
+            for col in range(first_col, last_col + 1):
+                longitude = min(max((col + 0.5) * width, -180.0), 179.999999)
+                cells.add(geohash_encode(latitude, longitude, precision))
+        return sorted(cells)
+    return []
@@ -0,0 +1,242 @@
+"""Buffered GPS position ingestion.
+
+Device reports are queued in a bounded in-memory buffer and written as
+``TrackingLocation`` rows with ``bulk_create`` once ``FLUSH_SIZE`` positions
+are pending or the oldest has waited ``FLUSH_INTERVAL`` seconds. Fixes that
+land within ``MIN_DISTANCE_METERS`` and ``MIN_INTERVAL_SECONDS`` of the
+parcel's previous accepted fix are dropped, and each flush moves
+``Parcel.latitude/longitude/current_location`` to the latest fix only.
+
+Buffered positions live in process memory until flushed, so a crash can
+lose at most one flush window. Configure with ``PARCEL_GPS_INGEST``.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import events
+from .cache import parcel_detail_cache
+from .geo import geohash_encode, haversine_km
+from .models import Parcel, TrackingLocation
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FLUSH_SIZE': 500,
+    'FLUSH_INTERVAL': 2.0,
+    'MAX_PENDING': 50000,
+    'MIN_DISTANCE_METERS': 25,
+    'MIN_INTERVAL_SECONDS': 30,
+    'FLUSH_THREAD': True,
+}
+
+# Parcels whose last accepted fix is remembered for deduplication
+LAST_FIX_CACHE_SIZE = 100000
+
+DEFAULT_STATUS = 'in_transit'
+
+
+class BufferFull(Exception):
+    """Raised when the pending queue is at ``MAX_PENDING``"""
+
+
+class PositionBuffer:
+
+    def __init__(self, config=None):
+        self.config = {**DEFAULTS, **(config or {})}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._oldest_pending_at = None
+        self._last_fix = OrderedDict()
+        self._thread = None
+        self.accepted = 0
+        self.dropped = 0
+        self.written = 0
+
+    def add(self, positions, organization_ids):
+        """Queue validated positions; returns (accepted, dropped) counts.
+
+        ``organization_ids`` maps parcel id to organization id for the parcels
+        referenced by ``positions``.
+        """
+        accepted = dropped = 0
+        with self._lock:
+            if len(self._pending) + len(positions) > self.config['MAX_PENDING']:
+                raise BufferFull()
+            for position in sorted(positions, key=lambda p: p['timestamp']):
+                if self._is_duplicate(position):
+                    dropped += 1
+                    continue
+                self._remember(position)
+                position['organization_id'] = organization_ids[position['parcel']]
+                self._pending.append(position)
+                accepted += 1
+            if self._pending and self._oldest_pending_at is None:
+                self._oldest_pending_at = time.monotonic()
+            self.accepted += accepted
+            self.dropped += dropped
+            due = self._flush_due()
+        if due:
+            self.flush()
+        else:
+            self._ensure_thread()
+        return accepted, dropped
+
+    def _is_duplicate(self, position):
+        previous = self._last_fix.get(position['parcel'])
+        if previous is None:
+            return False
+        latitude, longitude, timestamp = previous
+        elapsed = (position['timestamp'] - timestamp).total_seconds()
+        if elapsed < 0:
+            # Out-of-order fix older than one already accepted
+            return True
+        if elapsed >= self.config['MIN_INTERVAL_SECONDS']:
+            return False
+        distance_m = haversine_km(latitude, longitude, position['latitude'], position['longitude']) * 1000
+        return distance_m < self.config['MIN_DISTANCE_METERS']
+
+    def _remember(self, position):
+        self._last_fix[position['parcel']] = (position['latitude'], position['longitude'], position['timestamp'])
+        self._last_fix.move_to_end(position['parcel'])
+        while len(self._last_fix) > LAST_FIX_CACHE_SIZE:
+            self._last_fix.popitem(last=False)
+
+    def _flush_due(self):
+        if len(self._pending) >= self.config['FLUSH_SIZE']:
+            return True
+        return (
+            self._oldest_pending_at is not None
+            and time.monotonic() - self._oldest_pending_at >= self.config['FLUSH_INTERVAL']
+        )
+
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Write every pending position; returns the number of rows inserted"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._oldest_pending_at = None
+            if not batch:
+                return 0
+            self._write(batch)
+            self.written += len(batch)
+            return len(batch)
+
+    def _write(self, batch):
+        # Parcels deleted since their positions were queued would fail the foreign key
+        existing = set(Parcel.objects.filter(id__in={p['parcel'] for p in batch}).values_list('id', flat=True))
+        batch = [position for position in batch if position['parcel'] in existing]
+        rows = [
+            TrackingLocation(
+                parcel_id=position['parcel'],
+                latitude=position['latitude'],
+                longitude=position['longitude'],
+                location_name=position['location_name'],
+                status=position['status'],
+                timestamp=position['timestamp'],
+            )
+            for position in batch
+        ]
+        latest = {}
+        for position in batch:
+            current = latest.get(position['parcel'])
+            if current is None or position['timestamp'] >= current['timestamp']:
+                latest[position['parcel']] = position
+        parcels = [
+            Parcel(
+                id=parcel_id,
+                latitude=position['latitude'],
+                longitude=position['longitude'],
+                geohash=geohash_encode(position['latitude'], position['longitude']),
+                current_location=position['location_name'],
+                updated_at=timezone.now(),
+            )
+            for parcel_id, position in latest.items()
+        ]
+
+        with transaction.atomic():
+            TrackingLocation.objects.bulk_create(rows, batch_size=self.config['FLUSH_SIZE'])
+            Parcel.objects.bulk_update(
+                parcels, ['latitude', 'longitude', 'geohash', 'current_location', 'updated_at'],
+                batch_size=self.config['FLUSH_SIZE'],
+            )
+            # bulk_create and bulk_update bypass model signals
+            for row, position in zip(rows, batch):
+                events.publish_location(row, position['organization_id'])
+        parcel_detail_cache.invalidate_many(latest)
+
+    def _ensure_thread(self):
+        if not self.config['FLUSH_THREAD'] or (self._thread and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='gps-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        interval = max(self.config['FLUSH_INTERVAL'] / 2, 0.1)
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                due = self._flush_due()
+            if due:
+                close_old_connections()
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception('GPS position flush failed')
+
+    def stats(self):
+        return {
+            'pending': len(self._pending),
+            'accepted': self.accepted,
+            'dropped': self.dropped,
+            'written': self.written,
+        }
+
+
+def prepare_positions(report):
+    """Fill defaults on a validated ``GPSReportSerializer`` payload"""
+    now = timezone.now()
+    positions = []
+    for position in report['positions']:
+        position = dict(position)
+        position.setdefault('timestamp', now)
+        position.setdefault('status', DEFAULT_STATUS)
+        position.setdefault(
+            'location_name', f"{position['latitude']:.5f}, {position['longitude']:.5f}"
+        )
+        positions.append(position)
+    return positions
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_position_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = PositionBuffer(getattr(settings, 'PARCEL_GPS_INGEST', None))
+    return _buffer
+
+
+@receiver(setting_changed)
+def reset_position_buffer(setting, **kwargs):
+    global _buffer
+    if setting == 'PARCEL_GPS_INGEST':
+        _buffer = None
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import retention
+
+
+class Command(BaseCommand):
+    help = 'Prune notifications, tracking points and status history according to PARCEL_RETENTION'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--policy', choices=sorted(retention.POLICIES), action='append',
+                            help='Only apply this policy (repeatable); defaults to every enabled policy')
+        parser.add_argument('--batch-size', type=int, default=retention.DEFAULT_BATCH_SIZE,
+                            help='Rows examined and deleted per transaction')
+        parser.add_argument('--archive', metavar='PATH',
+                            help='Append pruned rows to this gzip-compressed NDJSON file before deleting them')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between batches to leave room for other writers')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be pruned')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        policies = retention.get_policies(options['policy'])
+        if not policies:
+            self.stdout.write('No retention policy is enabled')
+            return
+
+        archive = retention.Archive(options['archive']) if options['archive'] and not options['dry_run'] else None
+        try:
+            for policy in policies:
+                count = policy.run(
+                    batch_size=options['batch_size'], archive=archive, dry_run=options['dry_run'], pause=options['pause']
+                )
+                verb = 'Would delete' if options['dry_run'] else 'Deleted'
+                self.stdout.write(self.style.SUCCESS(f'{policy.name}: {verb} {count} rows older than {policy.days} days'))
+        finally:
+            if archive is not None:
+                archive.close()
+                self.stdout.write(f'Archived {archive.rows} rows to {options["archive"]}')
@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from api import rollups
+
+
+def date_argument(value):
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise CommandError(f'Invalid date "{value}"; expected YYYY-MM-DD')
+    return parsed
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily parcel and review metrics rollups for a date range from the source rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='since', type=date_argument,
+                            help='First day to rebuild (default: 30 days before --to)')
+        parser.add_argument('--to', dest='until', type=date_argument,
+                            help='Last day to rebuild (default: today)')
+        parser.add_argument('--organization', type=int, action='append',
+                            help='Only rebuild this organization id (repeatable); defaults to all')
+
+    def handle(self, *args, **options):
+        until = options['until'] or timezone.localdate()
+        since = options['since'] or until - timedelta(days=rollups.DEFAULT_METRICS_DAYS - 1)
+        if since > until:
+            raise CommandError('--from must not be after --to')
+
+        rows = rollups.backfill(since, until, organization_ids=options['organization'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {rows} daily metrics rows for {since} to {until}'))
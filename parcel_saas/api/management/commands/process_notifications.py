@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import notifications
+
+
+class Command(BaseCommand):
+    help = 'Fan out queued parcel status changes as notifications to every linked user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Process the jobs that are due now and exit instead of polling')
+        parser.add_argument('--batch-size', type=int,
+                            help='Jobs claimed per transaction (default: PARCEL_NOTIFICATIONS BATCH_SIZE)')
+        parser.add_argument('--interval', type=float,
+                            help='Seconds to sleep when the queue is empty (default: PARCEL_NOTIFICATIONS POLL_INTERVAL)')
+        parser.add_argument('--coalesce-seconds', type=float,
+                            help='Only take jobs unchanged for this long (default: PARCEL_NOTIFICATIONS COALESCE_SECONDS)')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        batch = {'batch_size': options['batch_size'], 'coalesce_seconds': options['coalesce_seconds']}
+
+        if options['once']:
+            jobs, written = notifications.drain(**batch)
+            self.stdout.write(self.style.SUCCESS(f'Processed {jobs} jobs, wrote {written} notifications'))
+            return
+
+        self.stdout.write('Waiting for notification jobs (Ctrl+C to stop)')
+        try:
+            notifications.run_worker(interval=options['interval'], **batch)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from api import search
+
+MODEL_CHOICES = {
+    'parcel': 'api.parcel',
+    'review': 'api.deliveryreview',
+}
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for parcels and reviews from their source rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=sorted(MODEL_CHOICES), action='append',
+                            help='Only rebuild this model (repeatable); defaults to all')
+        parser.add_argument('--batch-size', type=int, default=search.DEFAULT_BATCH_SIZE,
+                            help='Source rows copied per statement')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        backend = search.get_backend(options['database'], require_tables=False)
+        if backend is None:
+            raise CommandError('Full-text search is not supported on this database')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        labels = [MODEL_CHOICES[name] for name in options['model'] or sorted(MODEL_CHOICES)]
+        backend.create_tables()
+        for label in labels:
+            with transaction.atomic(using=options['database']):
+                count = backend.rebuild(label, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Indexed {count} {label} rows'))
@@ -0,0 +1,107 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+from api import benchmark
+from api.models import Parcel
+
+
+class Command(BaseCommand):
+    help = ('Generate a synthetic dataset in a throwaway test database and benchmark the main parcel endpoints, '
+            'optionally failing on regressions against a stored baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=sorted(benchmark.SCENARIOS),
+                            help='Scenario to run (repeatable); defaults to all')
+        parser.add_argument('--organizations', type=int, default=2, help='Organizations to generate')
+        parser.add_argument('--departments', type=int, default=3, help='Departments per organization')
+        parser.add_argument('--parcels', type=int, default=10000, help='Parcels to generate across organizations')
+        parser.add_argument('--locations', type=int, default=10, help='Tracking locations per parcel')
+        parser.add_argument('--history', type=int, default=4, help='Status history rows per parcel')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for data and request parameters')
+        parser.add_argument('--iterations', type=int, default=200, help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=20, help='Untimed requests per scenario')
+        parser.add_argument('--serializer-rows', type=int, default=500,
+                            help='Parcels serialized when comparing list serializer paths (0 to skip)')
+        parser.add_argument('--output', help='Write the results as JSON to this path')
+        parser.add_argument('--baseline', help='Compare against results previously written with --output')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='Allowed p99 growth over the baseline as a fraction (default: 0.5)')
+        parser.add_argument('--no-fail', action='store_true',
+                            help='Report regressions without exiting with an error')
+
+    def handle(self, *args, **options):
+        if options['parcels'] < 1 or options['organizations'] < 1 or options['iterations'] < 1:
+            raise CommandError('--parcels, --organizations and --iterations must be positive')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)['scenarios']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f'Could not read baseline {options["baseline"]}: {e}')
+
+        verbosity = options['verbosity']
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            with override_settings(DEBUG=False, PARCEL_PROFILING={'ENABLED': False}):
+                results, serializers = self.run(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        if options['output']:
+            scale = {key: options[key] for key in ('organizations', 'departments', 'parcels', 'locations', 'history',
+                                                   'seed', 'iterations')}
+            with open(options['output'], 'w') as f:
+                payload = {'scale': scale, 'scenarios': results, 'serializers': serializers}
+                json.dump(payload, f, indent=2, sort_keys=True)
+                f.write('\n')
+            if verbosity:
+                self.stdout.write(f'Wrote {options["output"]}')
+
+        if baseline is None:
+            return
+        regressions = benchmark.compare(results, baseline, options['tolerance'])
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+            return
+        for message in regressions:
+            self.stdout.write(self.style.ERROR(message))
+        if not options['no_fail']:
+            raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}')
+
+    def run(self, options):
+        def progress(done, total):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Generated {done}/{total} parcels')
+
+        data = benchmark.generate(
+            organizations=options['organizations'], departments=options['departments'],
+            parcels=options['parcels'], locations=options['locations'], history=options['history'],
+            seed=options['seed'], progress=progress,
+        )
+        if not data.parcel_ids:
+            raise CommandError('The first organization received no parcels; increase --parcels')
+
+        results = {}
+        self.stdout.write(f'{"scenario":<20} {"req/s":>9} {"p50 ms":>9} {"p99 ms":>9} {"queries":>8}')
+        for name in options['scenario'] or benchmark.SCENARIOS:
+            result = benchmark.run_scenario(
+                name, data, iterations=options['iterations'], warmup=options['warmup'], seed=options['seed'],
+            )
+            results[name] = result
+            self.stdout.write(
+                f'{name:<20} {result["throughput_rps"]:>9} {result["p50_ms"]:>9.2f} {result["p99_ms"]:>9.2f} '
+                f'{result["queries_max"]:>8}'
+            )
+
+        serializers = None
+        if options['serializer_rows']:
+            parcels = Parcel.objects.filter(id__in=data.parcel_ids[:options['serializer_rows']]).order_by('-created_at')
+            serializers = benchmark.serializer_throughput(parcels)
+            self.stdout.write(
+                f'ParcelListSerializer over {serializers["rows"]} rows: {serializers["instances_rows_per_s"]} rows/s '
+                f'from instances, {serializers["values_rows_per_s"]} rows/s from values() ({serializers["speedup"]}x)'
+            )
+        return results, serializers
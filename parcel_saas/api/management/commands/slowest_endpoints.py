@@ -0,0 +1,69 @@
+import sys
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import profiling
+
+DEFAULT_URL = 'http://localhost:8001/api/_metrics'
+
+SORT_KEYS = {
+    'p99': lambda row: row['p99'] or 0,
+    'p50': lambda row: row['p50'] or 0,
+    'avg': lambda row: row['avg'],
+    'total': lambda row: row['total'],
+}
+
+
+class Command(BaseCommand):
+    help = 'Rank API routes by latency from a /api/_metrics scrape'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=DEFAULT_URL, help='Metrics endpoint of a running worker')
+        parser.add_argument('--token', help='Bearer token configured as PARCEL_PROFILING METRICS_TOKEN')
+        parser.add_argument('--file', help="Read a saved scrape instead ('-' for stdin)")
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='p99')
+        parser.add_argument('--limit', type=int, default=10)
+
+    def read_scrape(self, options):
+        if options['file'] == '-':
+            return sys.stdin.read()
+        if options['file']:
+            with open(options['file'], encoding='utf-8') as scrape:
+                return scrape.read()
+        request = Request(options['url'])
+        if options['token']:
+            request.add_header('Authorization', f'Bearer {options["token"]}')
+        try:
+            with urlopen(request, timeout=10) as response:
+                return response.read().decode('utf-8')
+        except (URLError, OSError) as error:
+            raise CommandError(f'Could not fetch {options["url"]}: {error}')
+
+    def handle(self, *args, **options):
+        rows = []
+        for (route, method), stats in profiling.parse_prometheus(self.read_scrape(options)).items():
+            if not stats['count']:
+                continue
+            rows.append({
+                'route': f'{method} {route}',
+                'count': stats['count'],
+                'avg': stats['seconds'] / stats['count'],
+                'p50': profiling.histogram_quantile(stats['buckets'], 0.5),
+                'p99': profiling.histogram_quantile(stats['buckets'], 0.99),
+                'total': stats['seconds'],
+                'queries': stats['queries'] / stats['sampled'] if stats['sampled'] else None,
+            })
+        if not rows:
+            self.stdout.write('No requests recorded yet')
+            return
+
+        rows.sort(key=SORT_KEYS[options['sort']], reverse=True)
+        self.stdout.write(f'{"route":<50} {"count":>8} {"avg ms":>9} {"p50 ms":>9} {"p99 ms":>9} {"queries":>8}')
+        for row in rows[:options['limit']]:
+            queries = f'{row["queries"]:.1f}' if row['queries'] is not None else '-'
+            self.stdout.write(
+                f'{row["route"]:<50} {row["count"]:>8} {row["avg"] * 1000:>9.1f} '
+                f'{row["p50"] * 1000:>9.1f} {row["p99"] * 1000:>9.1f} {queries:>8}'
+            )
@@ -0,0 +1,22 @@
+"""Model managers"""
+from django.db import models
+
+
+class TenantQuerySet(models.QuerySet):
+    """QuerySet that can be restricted to a set of organizations.
+
+    Models declare ``tenant_lookup``, the lookup path from the model to its
+    owning ``Organization`` (for example ``'parcel__organization'``).
+    """
+
+    def for_organizations(self, organization_ids):
+        """Rows owned by ``organization_ids``; ``None`` leaves the queryset unrestricted"""
+        if organization_ids is None:
+            return self
+        return self.filter(**{f'{self.model.tenant_lookup}__in': organization_ids})
+
+    def for_tenant(self, tenant):
+        return self.for_organizations(tenant.organization_ids)
+
+
+TenantManager = models.Manager.from_queryset(TenantQuerySet)
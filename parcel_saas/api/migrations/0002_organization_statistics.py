@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrganizationStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_parcels', models.IntegerField(default=0)),
+                ('status_counts', models.JSONField(default=dict)),
+                ('type_counts', models.JSONField(default=dict)),
+                ('department_counts', models.JSONField(default=dict)),
+                ('computed_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('organization', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='statistics', to='api.organization')),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_organization_statistics'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trackinglocation',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:12
+
+import api.fields
+from django.db import migrations
+
+from api.geo import geohash_encode
+
+BATCH_SIZE = 2000
+
+
+def backfill_geohashes(apps, schema_editor):
+    for model_name in ('Parcel', 'TrackingLocation'):
+        model = apps.get_model('api', model_name)
+        rows = model.objects.filter(latitude__isnull=False, longitude__isnull=False).only('id', 'latitude', 'longitude')
+        batch = []
+        for row in rows.iterator(chunk_size=BATCH_SIZE):
+            row.geohash = geohash_encode(row.latitude, row.longitude)
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                model.objects.bulk_update(batch, ['geohash'])
+                batch = []
+        model.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_tracking_location_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parcel',
+            name='geohash',
+            field=api.fields.GeohashField(blank=True, db_index=True, editable=False, max_length=9, null=True),
+        ),
+        migrations.AddField(
+            model_name='trackinglocation',
+            name='geohash',
+            field=api.fields.GeohashField(blank=True, db_index=True, editable=False, max_length=9, null=True),
+        ),
+        migrations.RunPython(backfill_geohashes, migrations.RunPython.noop),
+    ]
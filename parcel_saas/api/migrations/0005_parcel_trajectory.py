@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParcelTrajectory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(max_length=20)),
+                ('points', models.JSONField(default=list)),
+                ('source_count', models.IntegerField(default=0)),
+                ('last_location_id', models.BigIntegerField(null=True)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('parcel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trajectories', to='api.parcel')),
+            ],
+            options={
+                'unique_together': {('parcel', 'resolution')},
+            },
+        ),
+    ]
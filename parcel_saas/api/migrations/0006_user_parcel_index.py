@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def backfill_user_parcels(apps, schema_editor):
+    ParcelDeliveryHistory = apps.get_model('api', 'ParcelDeliveryHistory')
+    UserParcel = apps.get_model('api', 'UserParcel')
+    # Ordered so the last history row of each (user, parcel) pair carries its current role
+    histories = ParcelDeliveryHistory.objects.order_by('user_id', 'parcel_id', 'timestamp', 'id').values_list(
+        'user_id', 'parcel_id', 'role', 'parcel__status', 'parcel__created_at'
+    )
+    batch, current = [], None
+    for user_id, parcel_id, role, status, created_at in histories.iterator(chunk_size=BATCH_SIZE):
+        if current is not None and (current.user_id, current.parcel_id) != (user_id, parcel_id):
+            batch.append(current)
+            if len(batch) >= BATCH_SIZE:
+                UserParcel.objects.bulk_create(batch)
+                batch = []
+        current = UserParcel(user_id=user_id, parcel_id=parcel_id, role=role, status=status, created_at=created_at)
+    if current is not None:
+        batch.append(current)
+    UserParcel.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_parcel_trajectory'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserParcel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('sender', 'Sender'), ('receiver', 'Receiver')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('received', 'Received'), ('in_transit', 'In Transit'), ('delivered', 'Delivered'), ('lost', 'Lost'), ('returned', 'Returned')], max_length=20)),
+                ('created_at', models.DateTimeField()),
+                ('parcel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_index', to='api.parcel')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parcel_index', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-created_at'], name='api_userpar_user_id_a4a780_idx'), models.Index(fields=['user', 'status', '-created_at'], name='api_userpar_user_id_611eb1_idx'), models.Index(fields=['user', 'role', '-created_at'], name='api_userpar_user_id_1fa8fa_idx')],
+                'unique_together': {('user', 'parcel')},
+            },
+        ),
+        migrations.RunPython(backfill_user_parcels, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:25
+
+from django.db import migrations
+
+from api.search import create_index_tables, drop_index_tables
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_user_parcel_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index_tables, drop_index_tables),
+    ]
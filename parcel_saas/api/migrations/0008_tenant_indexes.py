@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='parcel',
+            index=models.Index(fields=['organization', 'status'], name='api_parcel_organiz_c2d53e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parcel',
+            index=models.Index(fields=['organization', 'department', '-created_at'], name='api_parcel_organiz_e5bc1a_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_tenant_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyMetrics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('created_count', models.IntegerField(default=0)),
+                ('delivered_count', models.IntegerField(default=0)),
+                ('lost_count', models.IntegerField(default=0)),
+                ('returned_count', models.IntegerField(default=0)),
+                ('delivery_time_count', models.IntegerField(default=0)),
+                ('delivery_seconds_total', models.FloatField(default=0)),
+                ('review_count', models.IntegerField(default=0)),
+                ('rating_total', models.IntegerField(default=0)),
+                ('delivery_speed_rating_total', models.IntegerField(default=0)),
+                ('packaging_quality_rating_total', models.IntegerField(default=0)),
+                ('communication_rating_total', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('department', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_metrics', to='api.department')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_metrics', to='api.organization')),
+            ],
+            options={
+                'ordering': ['day'],
+                'indexes': [models.Index(fields=['organization', 'day'], name='api_dailyme_organiz_8794b0_idx')],
+                'constraints': [models.UniqueConstraint(fields=('organization', 'department', 'day'), name='daily_metrics_unique_department_day'), models.UniqueConstraint(condition=models.Q(('department__isnull', True)), fields=('organization', 'day'), name='daily_metrics_unique_organization_day')],
+            },
+        ),
+    ]
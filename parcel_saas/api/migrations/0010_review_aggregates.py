@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+ASPECTS = ('rating', 'delivery_speed_rating', 'packaging_quality_rating', 'communication_rating')
+
+
+def backfill_review_aggregates(apps, schema_editor):
+    DeliveryReview = apps.get_model('api', 'DeliveryReview')
+    ReviewAggregate = apps.get_model('api', 'ReviewAggregate')
+    totals = {}
+    reviews = DeliveryReview.objects.values_list(
+        'parcel__organization_id', 'parcel__department_id', 'created_at', 'would_recommend', *ASPECTS
+    )
+    for organization_id, department_id, created_at, would_recommend, *ratings in reviews.iterator(chunk_size=1000):
+        month = timezone.localdate(created_at).replace(day=1)
+        row = totals.setdefault((organization_id, department_id, month), dict.fromkeys(
+            ['review_count', 'recommend_count', *(f'{aspect}_total' for aspect in ASPECTS)], 0
+        ))
+        row['review_count'] += 1
+        row['recommend_count'] += 1 if would_recommend else 0
+        for aspect, value in zip(ASPECTS, ratings):
+            row[f'{aspect}_total'] += value
+    ReviewAggregate.objects.bulk_create([
+        ReviewAggregate(organization_id=organization_id, department_id=department_id, month=month, **row)
+        for (organization_id, department_id, month), row in totals.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_daily_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('review_count', models.IntegerField(default=0)),
+                ('rating_total', models.IntegerField(default=0)),
+                ('delivery_speed_rating_total', models.IntegerField(default=0)),
+                ('packaging_quality_rating_total', models.IntegerField(default=0)),
+                ('communication_rating_total', models.IntegerField(default=0)),
+                ('recommend_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('department', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='review_aggregates', to='api.department')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='review_aggregates', to='api.organization')),
+            ],
+            options={
+                'ordering': ['month'],
+                'indexes': [models.Index(fields=['organization', 'month'], name='api_reviewa_organiz_7b4b6a_idx')],
+                'constraints': [models.UniqueConstraint(fields=('organization', 'department', 'month'), name='review_aggregate_unique_department_month'), models.UniqueConstraint(condition=models.Q(('department__isnull', True)), fields=('organization', 'month'), name='review_aggregate_unique_organization_month')],
+            },
+        ),
+        migrations.RunPython(backfill_review_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_notification_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryroute',
+            name='optimized',
+            field=models.BooleanField(default=False),
+        ),
+    ]
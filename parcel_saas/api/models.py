@@ -1,5 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .fields import GeohashField, GeohashMixin
+from .managers import TenantManager
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
@@ -11,6 +15,9 @@ class Organization(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TenantManager()
+    tenant_lookup = 'id'
+
     def __str__(self):
         return self.name
 
@@ -25,6 +32,9 @@ class Department(models.Model):
     description = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TenantManager()
+    tenant_lookup = 'organization'
+
     def __str__(self):
         return f"{self.name} - {self.organization.name}"
 
@@ -33,7 +43,7 @@ class Department(models.Model):
         ordering = ['name']
 
 
-class Parcel(models.Model):
+class Parcel(GeohashMixin, models.Model):
     """Parcel model for tracking parcels and letters"""
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -79,12 +89,16 @@ class Parcel(models.Model):
     current_location = models.CharField(max_length=255, blank=True, null=True)
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
+    geohash = GeohashField()
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     delivered_at = models.DateTimeField(blank=True, null=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TenantManager()
+    tenant_lookup = 'organization'
+
     def __str__(self):
         return f"{self.tracking_number} - {self.receiver_name}"
 
@@ -94,6 +108,8 @@ class Parcel(models.Model):
             models.Index(fields=['tracking_number']),
             models.Index(fields=['status']),
             models.Index(fields=['organization', '-created_at']),
+            models.Index(fields=['organization', 'status']),
+            models.Index(fields=['organization', 'department', '-created_at']),
         ]
 
 
@@ -106,6 +122,9 @@ class ParcelStatusHistory(models.Model):
     notes = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TenantManager()
+    tenant_lookup = 'parcel__organization'
+
     def __str__(self):
         return f"{self.parcel.tracking_number}: {self.previous_status} → {self.new_status}"
 
@@ -113,11 +132,14 @@ class ParcelStatusHistory(models.Model):
         ordering = ['-created_at']
 
 
+DELIVERY_ROLE_CHOICES = [('sender', 'Sender'), ('receiver', 'Receiver')]
+
+
 class ParcelDeliveryHistory(models.Model):
     """Track delivery history for users"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='parcel_histories')
     parcel = models.ForeignKey(Parcel, on_delete=models.CASCADE, related_name='delivery_histories')
-    role = models.CharField(max_length=20, choices=[('sender', 'Sender'), ('receiver', 'Receiver')])
+    role = models.CharField(max_length=20, choices=DELIVERY_ROLE_CHOICES)
     timestamp = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -147,6 +169,9 @@ class DeliveryReview(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TenantManager()
+    tenant_lookup = 'parcel__organization'
+
     def __str__(self):
         return f"Review for {self.parcel.tracking_number}"
 
@@ -154,16 +179,21 @@ class DeliveryReview(models.Model):
         ordering = ['-created_at']
 
 
-class TrackingLocation(models.Model):
+class TrackingLocation(GeohashMixin, models.Model):
     """Real-time tracking locations"""
     parcel = models.ForeignKey(Parcel, on_delete=models.CASCADE, related_name='tracking_locations')
     latitude = models.FloatField()
     longitude = models.FloatField()
+    geohash = GeohashField()
     location_name = models.CharField(max_length=255)
     status = models.CharField(max_length=50)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Defaulted rather than auto_now_add so batched device reports keep their own fix times
+    timestamp = models.DateTimeField(default=timezone.now)
     notes = models.TextField(blank=True, null=True)
 
+    objects = TenantManager()
+    tenant_lookup = 'parcel__organization'
+
     def __str__(self):
         return f"{self.parcel.tracking_number} - {self.location_name}"
 
@@ -190,8 +220,13 @@ class DeliveryRoute(models.Model):
         ('in_progress', 'In Progress'),
         ('completed', 'Completed'),
     ], default='pending')
+    # Written by the route optimizer, whose next run replaces it while still pending
+    optimized = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TenantManager()
+    tenant_lookup = 'parcel__organization'
+
     def __str__(self):
         return f"{self.parcel.tracking_number} - Route {self.route_sequence}"
 
@@ -213,3 +248,166 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'is_read', '-created_at']),
+        ]
+
+
+class NotificationJob(models.Model):
+    """A parcel status change waiting to be fanned out as notifications.
+
+    At most one job exists per parcel: further changes before the worker runs
+    overwrite its status and push ``queued_at`` back, so they are coalesced.
+    """
+    parcel = models.OneToOneField(Parcel, on_delete=models.CASCADE, related_name='notification_job')
+    status = models.CharField(max_length=20, choices=Parcel.STATUS_CHOICES)
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    queued_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Notify {self.parcel_id} -> {self.status}"
+
+    class Meta:
+        ordering = ['queued_at']
+
+
+class NotificationCounter(models.Model):
+    """A user's unread notification count and a version bumped on every change"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+    unread_count = models.IntegerField(default=0)
+    # Highest notification id the user has been sent
+    latest_id = models.BigIntegerField(default=0)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.unread_count} unread"
+
+
+class OrganizationStatistics(models.Model):
+    """Cached parcel count snapshot per organization"""
+    organization = models.OneToOneField(Organization, on_delete=models.CASCADE, related_name='statistics')
+    total_parcels = models.IntegerField(default=0)
+    status_counts = models.JSONField(default=dict)
+    type_counts = models.JSONField(default=dict)
+    department_counts = models.JSONField(default=dict)
+    computed_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Statistics for {self.organization.name}"
+
+
+class ParcelTrajectory(models.Model):
+    """Simplified tracking polyline for a parcel at one resolution"""
+    parcel = models.ForeignKey(Parcel, on_delete=models.CASCADE, related_name='trajectories')
+    resolution = models.CharField(max_length=20)
+    points = models.JSONField(default=list)
+    source_count = models.IntegerField(default=0)
+    last_location_id = models.BigIntegerField(null=True)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.parcel.tracking_number} trajectory ({self.resolution})"
+
+    class Meta:
+        unique_together = ('parcel', 'resolution')
+
+
+class UserParcel(models.Model):
+    """Per-user parcel index derived from delivery history, with the parcel's status denormalized"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='parcel_index')
+    parcel = models.ForeignKey(Parcel, on_delete=models.CASCADE, related_name='user_index')
+    role = models.CharField(max_length=20, choices=DELIVERY_ROLE_CHOICES)
+    status = models.CharField(max_length=20, choices=Parcel.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user.username} - {self.parcel.tracking_number} ({self.role})"
+
+    class Meta:
+        unique_together = ('user', 'parcel')
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+            models.Index(fields=['user', 'status', '-created_at']),
+            models.Index(fields=['user', 'role', '-created_at']),
+        ]
+
+
+class DailyMetrics(models.Model):
+    """Per-day parcel and review counters for an organization and department"""
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='daily_metrics')
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_metrics')
+    day = models.DateField()
+
+    # Parcels created that day, and status changes made that day
+    created_count = models.IntegerField(default=0)
+    delivered_count = models.IntegerField(default=0)
+    lost_count = models.IntegerField(default=0)
+    returned_count = models.IntegerField(default=0)
+
+    # Summed time from creation to each delivery made that day
+    delivery_time_count = models.IntegerField(default=0)
+    delivery_seconds_total = models.FloatField(default=0)
+
+    # Summed ratings of reviews written that day
+    review_count = models.IntegerField(default=0)
+    rating_total = models.IntegerField(default=0)
+    delivery_speed_rating_total = models.IntegerField(default=0)
+    packaging_quality_rating_total = models.IntegerField(default=0)
+    communication_rating_total = models.IntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.organization.name} metrics for {self.day}"
+
+    class Meta:
+        ordering = ['day']
+        constraints = [
+            models.UniqueConstraint(fields=['organization', 'department', 'day'], name='daily_metrics_unique_department_day'),
+            models.UniqueConstraint(
+                fields=['organization', 'day'], condition=models.Q(department__isnull=True),
+                name='daily_metrics_unique_organization_day',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['organization', 'day']),
+        ]
+
+
+class ReviewAggregate(models.Model):
+    """Running review rating sums for an organization, department and month"""
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='review_aggregates')
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, null=True, blank=True, related_name='review_aggregates')
+    # First day of the month the reviews were written in
+    month = models.DateField()
+
+    review_count = models.IntegerField(default=0)
+    rating_total = models.IntegerField(default=0)
+    delivery_speed_rating_total = models.IntegerField(default=0)
+    packaging_quality_rating_total = models.IntegerField(default=0)
+    communication_rating_total = models.IntegerField(default=0)
+    recommend_count = models.IntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TenantManager()
+    tenant_lookup = 'organization'
+
+    def __str__(self):
+        return f"{self.organization.name} reviews for {self.month:%Y-%m}"
+
+    class Meta:
+        ordering = ['month']
+        constraints = [
+            models.UniqueConstraint(fields=['organization', 'department', 'month'], name='review_aggregate_unique_department_month'),
+            models.UniqueConstraint(
+                fields=['organization', 'month'], condition=models.Q(department__isnull=True),
+                name='review_aggregate_unique_organization_month',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['organization', 'month']),
+        ]
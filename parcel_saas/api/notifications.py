@@ -0,0 +1,172 @@
+"""Background notification fan-out.
+
+Status changes are queued as ``NotificationJob`` rows, one per parcel, by
+the request that made them; the request itself never writes
+``Notification`` rows. ``manage.py process_notifications`` (or
+``process_pending`` called from any scheduler) picks up jobs that have been
+quiet for ``COALESCE_SECONDS`` and writes one notification per linked user
+(the parcel's senders and receivers from the user parcel index, plus the
+user who made the change) with ``bulk_create``. Changes made to a parcel
+while its job waits replace the queued status, so a burst of updates
+produces a single notification per user; ``MAX_DELAY_SECONDS`` bounds how
+long a busy parcel can be held back.
+
+Each user's ``NotificationCounter`` carries their unread count, the highest
+notification id they have been sent and a version bumped on every change, so
+clients can poll for "anything new?" with one primary-key read. Counters are
+computed from the notifications table on first read and then kept current
+by the fan-out, the save/delete signals and the read-marking endpoints;
+deleting a parcel takes its cascaded unread notifications off the counters.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Max, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Notification, NotificationCounter, NotificationJob, UserParcel
+
+DEFAULTS = {
+    'COALESCE_SECONDS': 2.0,
+    'MAX_DELAY_SECONDS': 30.0,
+    'BATCH_SIZE': 500,
+    'POLL_INTERVAL': 1.0,
+}
+
+# Most notifications returned by one poll
+POLL_LIMIT = 100
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PARCEL_NOTIFICATIONS', {})}
+
+
+def enqueue_status_change(parcel_ids, status, actor=None):
+    """Queue a status notification for each parcel, coalescing with any job already waiting"""
+    now = timezone.now()
+    actor_id = getattr(actor, 'pk', actor)
+    jobs = [
+        NotificationJob(parcel_id=parcel_id, status=status, actor_id=actor_id, created_at=now, queued_at=now)
+        for parcel_id in parcel_ids
+    ]
+    NotificationJob.objects.bulk_create(
+        jobs, batch_size=get_config()['BATCH_SIZE'],
+        update_conflicts=True, unique_fields=['parcel'], update_fields=['status', 'actor', 'queued_at'],
+    )
+
+
+def _claim(queryset):
+    features = connection.features
+    if features.has_select_for_update_skip_locked:
+        # Concurrent workers take disjoint batches
+        options = {'skip_locked': True}
+        if features.has_select_for_update_of:
+            options['of'] = ('self',)
+        return queryset.select_for_update(**options)
+    return queryset
+
+
+def process_pending(batch_size=None, coalesce_seconds=None, max_delay_seconds=None):
+    """Fan out one batch of due jobs; returns ``(jobs processed, notifications written)``"""
+    config = get_config()
+    batch_size = batch_size or config['BATCH_SIZE']
+    coalesce_seconds = config['COALESCE_SECONDS'] if coalesce_seconds is None else coalesce_seconds
+    max_delay_seconds = config['MAX_DELAY_SECONDS'] if max_delay_seconds is None else max_delay_seconds
+    now = timezone.now()
+    due = Q(queued_at__lte=now - timedelta(seconds=coalesce_seconds))
+    due |= Q(created_at__lte=now - timedelta(seconds=max_delay_seconds))
+
+    with transaction.atomic():
+        jobs = list(
+            _claim(NotificationJob.objects.filter(due).order_by('queued_at'))
+            .values('id', 'parcel_id', 'parcel__tracking_number', 'status', 'actor_id')[:batch_size]
+        )
+        if not jobs:
+            return 0, 0
+
+        recipients = {job['parcel_id']: set() for job in jobs}
+        linked = UserParcel.objects.filter(parcel_id__in=recipients).values_list('parcel_id', 'user_id')
+        for parcel_id, user_id in linked:
+            recipients[parcel_id].add(user_id)
+
+        notifications = []
+        for job in jobs:
+            users = recipients[job['parcel_id']]
+            if job['actor_id'] is not None:
+                users.add(job['actor_id'])
+            notifications.extend(
+                Notification(
+                    user_id=user_id, parcel_id=job['parcel_id'],
+                    title=f"Status Updated: {job['parcel__tracking_number']}",
+                    message=f"Parcel status changed to {job['status']}",
+                )
+                for user_id in sorted(users)
+            )
+        Notification.objects.bulk_create(notifications, batch_size=batch_size)
+        # bulk_create bypasses the signal that maintains the unread counters
+        counts = {}
+        for notification in notifications:
+            unread, latest_id = counts.get(notification.user_id, (0, None))
+            counts[notification.user_id] = (unread + 1, max(latest_id or 0, notification.pk or 0) or None)
+        record_counts(counts)
+        # A job re-queued since it was read keeps its newer status for the next batch
+        NotificationJob.objects.filter(id__in=[job['id'] for job in jobs], queued_at__lte=now).delete()
+    return len(jobs), len(notifications)
+
+
+def drain(**options):
+    """Process batches until no job is due; returns the totals"""
+    jobs = written = 0
+    while True:
+        processed, created = process_pending(**options)
+        if not processed:
+            return jobs, written
+        jobs += processed
+        written += created
+
+
+def run_worker(interval=None, stop=None, **options):
+    """Poll for due jobs until ``stop()`` returns true"""
+    interval = get_config()['POLL_INTERVAL'] if interval is None else interval
+    while not (stop and stop()):
+        if not drain(**options)[0]:
+            time.sleep(interval)
+
+
+def get_counter(user_id):
+    """The user's counter, computed from their notifications the first time it is read"""
+    counter = NotificationCounter.objects.filter(user_id=user_id).first()
+    if counter is not None:
+        return counter
+    totals = Notification.objects.filter(user_id=user_id).aggregate(
+        unread=Count('id', filter=Q(is_read=False)), latest=Max('id')
+    )
+    try:
+        with transaction.atomic():
+            return NotificationCounter.objects.create(
+                user_id=user_id, unread_count=totals['unread'], latest_id=totals['latest'] or 0, version=1
+            )
+    except IntegrityError:
+        # Another request computed it first
+        return NotificationCounter.objects.get(user_id=user_id)
+
+
+def record_counts(changes):
+    """Apply ``{user_id: (unread delta, highest new notification id or None)}`` to the counters.
+
+    Users without a counter are skipped; theirs is computed on first read.
+    """
+    for user_id, (unread, latest_id) in changes.items():
+        update = {'unread_count': F('unread_count') + unread, 'version': F('version') + 1}
+        if latest_id is not None:
+            update['latest_id'] = Greatest(F('latest_id'), latest_id)
+        NotificationCounter.objects.filter(user_id=user_id).update(**update)
+
+
+def record_deleted(notifications):
+    """Take the unread ones among ``notifications``, about to be deleted, off their users' counters"""
+    unread = notifications.filter(is_read=False).order_by().values('user_id').annotate(count=Count('id'))
+    record_counts({row['user_id']: (-row['count'], None) for row in unread})
@@ -0,0 +1,238 @@
+"""Multi-stop delivery tour optimization.
+
+Builds a tour from a depot through every located parcel using
+nearest-neighbour construction over a precomputed haversine distance
+matrix, then improves it with 2-opt and Or-opt moves (each scan vectorized
+with NumPy) until no move helps or the time budget runs out. Tours either
+return to the depot or end at the last stop; the open case is handled with
+a zero-cost dummy end node so both share the same fixed-endpoint moves.
+"""
+import time
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+
+from .cache import parcel_detail_cache
+from .models import DeliveryRoute, Parcel
+from .routing import haversine_km_array, to_decimal_km
+
+DEFAULT_STATUSES = ('pending', 'received')
+DEFAULT_TIME_BUDGET_MS = 2000
+MAX_STOPS = 2000
+OR_OPT_SEGMENT_LENGTHS = (1, 2, 3)
+
+# Improvements smaller than this (km) are treated as noise
+EPSILON = 1e-9
+
+
+def distance_matrix(latitudes, longitudes):
+    """Pairwise haversine distances (km) between all points"""
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    return haversine_km_array(
+        latitudes[:, None], longitudes[:, None], latitudes[None, :], longitudes[None, :]
+    )
+
+
+def tour_length(matrix, tour):
+    tour = np.asarray(tour)
+    return float(matrix[tour[:-1], tour[1:]].sum())
+
+
+def nearest_neighbour(matrix, start, end):
+    """Greedy path from ``start`` visiting every node, finishing at ``end``"""
+    size = len(matrix)
+    visited = np.zeros(size, dtype=bool)
+    visited[[start, end]] = True
+    tour = [start]
+    current = start
+    for _ in range(size - 2):
+        distances = np.where(visited, np.inf, matrix[current])
+        current = int(np.argmin(distances))
+        visited[current] = True
+        tour.append(current)
+    tour.append(end)
+    return np.array(tour)
+
+
+def _expired(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def two_opt_pass(matrix, tour, deadline=None):
+    """Apply the best segment reversal for each start position; returns True if any improved.
+
+    Stops early once ``deadline`` (a ``time.monotonic()`` value) passes; every
+    move shortens the tour, so ``tour`` is then the best found so far.
+    """
+    improved = False
+    last = len(tour) - 1
+    for i in range(1, last - 1):
+        if _expired(deadline):
+            break
+        a, b = tour[i - 1], tour[i]
+        js = np.arange(i + 1, last)
+        c, d = tour[js], tour[js + 1]
+        delta = matrix[a, c] + matrix[b, d] - matrix[a, b] - matrix[c, d]
+        best = int(np.argmin(delta))
+        if delta[best] < -EPSILON:
+            j = int(js[best])
+            tour[i:j + 1] = tour[i:j + 1][::-1].copy()
+            improved = True
+    return improved
+
+
+def or_opt_pass(matrix, tour, deadline=None):
+    """Relocate short segments to their best insertion edge; returns True if any improved.
+
+    Stops early once ``deadline`` passes, like ``two_opt_pass``.
+    """
+    improved = False
+    for length in OR_OPT_SEGMENT_LENGTHS:
+        i = 1
+        while i + length < len(tour):
+            if _expired(deadline):
+                return improved
+            segment = tour[i:i + length]
+            prev_node, next_node = tour[i - 1], tour[i + length]
+            first, last = segment[0], segment[-1]
+            removal_gain = matrix[prev_node, first] + matrix[last, next_node] - matrix[prev_node, next_node]
+
+            rest = np.concatenate([tour[:i], tour[i + length:]])
+            a, b = rest[:-1], rest[1:]
+            forward = matrix[a, first] + matrix[last, b] - matrix[a, b]
+            backward = matrix[a, last] + matrix[first, b] - matrix[a, b]
+            costs = np.minimum(forward, backward)
+            # Reinserting where it was removed is not a move
+            costs[i - 1] = np.inf
+            position = int(np.argmin(costs))
+            if costs[position] < removal_gain - EPSILON:
+                insert = segment if forward[position] <= backward[position] else segment[::-1]
+                tour[:] = np.concatenate([rest[:position + 1], insert, rest[position + 1:]])
+                improved = True
+            else:
+                i += 1
+    return improved
+
+
+def optimize_tour(matrix, return_to_depot=True, time_budget_ms=DEFAULT_TIME_BUDGET_MS):
+    """Order nodes 1..n of ``matrix`` (node 0 is the depot).
+
+    Returns ``(stops, initial_km, final_km, passes)`` where ``stops`` lists
+    node indexes in visiting order, excluding the depot.
+    """
+    deadline = time.monotonic() + time_budget_ms / 1000
+    size = len(matrix)
+    if size <= 1:
+        return [], 0.0, 0.0, 0
+    if return_to_depot:
+        # A copy of the depot as the fixed end node
+        working = np.zeros((size + 1, size + 1))
+        working[:size, :size] = matrix
+        working[size, :size] = matrix[0]
+        working[:size, size] = matrix[:, 0]
+    else:
+        # A dummy end node reachable from anywhere at no cost
+        working = np.zeros((size + 1, size + 1))
+        working[:size, :size] = matrix
+    end = size
+
+    tour = nearest_neighbour(working, 0, end)
+    initial = tour_length(working, tour)
+    passes = 0
+    while time.monotonic() < deadline:
+        passes += 1
+        improved = two_opt_pass(working, tour, deadline)
+        if time.monotonic() >= deadline:
+            break
+        improved = or_opt_pass(working, tour, deadline) or improved
+        if not improved:
+            break
+    return [int(node) for node in tour[1:-1]], initial, tour_length(working, tour), passes
+
+
+def plan_route(parcels, depot, return_to_depot=True, time_budget_ms=DEFAULT_TIME_BUDGET_MS):
+    """Optimized visiting order for ``parcels`` (dicts with id/latitude/longitude) from ``depot``"""
+    latitudes = [depot['latitude']] + [parcel['latitude'] for parcel in parcels]
+    longitudes = [depot['longitude']] + [parcel['longitude'] for parcel in parcels]
+    matrix = distance_matrix(latitudes, longitudes)
+    order, initial, final, passes = optimize_tour(matrix, return_to_depot, time_budget_ms)
+
+    stops = []
+    previous = 0
+    for sequence, node in enumerate(order, start=1):
+        parcel = parcels[node - 1]
+        stops.append({
+            **parcel,
+            'sequence': sequence,
+            'from_node': previous,
+            'leg_distance_km': round(float(matrix[previous, node]), 3),
+        })
+        previous = node
+    return {
+        'stops': stops,
+        'initial_distance_km': round(initial, 3),
+        'total_distance_km': round(final, 3),
+        'improvement_pct': round(100 * (initial - final) / initial, 2) if initial else 0.0,
+        'passes': passes,
+    }
+
+
+def candidate_parcels(parcels=None, organization=None, department=None, statuses=DEFAULT_STATUSES):
+    """Located parcels to visit from ``parcels`` (default: all), and the count without coordinates"""
+    queryset = (Parcel.objects.all() if parcels is None else parcels).filter(status__in=statuses)
+    if organization is not None:
+        queryset = queryset.filter(organization_id=organization)
+    if department is not None:
+        queryset = queryset.filter(department_id=department)
+    located = queryset.filter(latitude__isnull=False, longitude__isnull=False)
+    parcels = list(
+        located.order_by('id').values(
+            'id', 'tracking_number', 'latitude', 'longitude', 'receiver_address', 'current_location'
+        )[:MAX_STOPS + 1]
+    )
+    unlocated = queryset.filter(Q(latitude__isnull=True) | Q(longitude__isnull=True)).count()
+    return parcels, unlocated
+
+
+def _stop_name(parcel):
+    return parcel['receiver_address'] or parcel['current_location'] or parcel['tracking_number']
+
+
+def write_routes(plan, parcels, depot):
+    """Store each stop as a DeliveryRoute leg from the previous stop, with one bulk_create.
+
+    The parcels' pending legs from an earlier optimizer run are deleted first,
+    in the same transaction; legs entered by hand, or already in progress or
+    completed, are kept.
+    """
+    depot_name = depot.get('name') or 'Depot'
+    nodes = [{'latitude': depot['latitude'], 'longitude': depot['longitude'], 'name': depot_name}] + [
+        {'latitude': parcel['latitude'], 'longitude': parcel['longitude'], 'name': _stop_name(parcel)}
+        for parcel in parcels
+    ]
+    parcel_nodes = {parcel['id']: node for node, parcel in enumerate(parcels, start=1)}
+    routes = []
+    for stop in plan['stops']:
+        origin, destination = nodes[stop['from_node']], nodes[parcel_nodes[stop['id']]]
+        routes.append(DeliveryRoute(
+            parcel_id=stop['id'],
+            route_sequence=stop['sequence'],
+            from_location=origin['name'][:255],
+            to_location=destination['name'][:255],
+            from_latitude=origin['latitude'],
+            from_longitude=origin['longitude'],
+            to_latitude=destination['latitude'],
+            to_longitude=destination['longitude'],
+            distance_km=to_decimal_km(stop['leg_distance_km']),
+            optimized=True,
+        ))
+    with transaction.atomic():
+        DeliveryRoute.objects.filter(
+            parcel_id__in=[route.parcel_id for route in routes], status='pending', optimized=True
+        ).delete()
+        DeliveryRoute.objects.bulk_create(routes, batch_size=500)
+    # bulk_create bypasses the signals that normally invalidate cached details
+    parcel_detail_cache.invalidate_many(route.parcel_id for route in routes)
+    return len(routes)
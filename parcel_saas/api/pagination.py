@@ -0,0 +1,141 @@
+"""Pagination for large, append-heavy collections.
+
+``KeysetPagination`` serves cursor (keyset) pages by default, which seek on
+the view's ordering index instead of issuing ``OFFSET`` plus ``COUNT(*)``.
+Clients that need page numbers can still pass ``?page=``; either mode accepts
+``?count=estimate`` to get a cheap row estimate in place of an exact count.
+"""
+import json
+from collections import OrderedDict
+
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+
+# Row count at which non-Postgres estimates stop counting
+ESTIMATE_CAP = 10000
+
+
+def estimate_count(queryset, cap=ESTIMATE_CAP):
+    """Return an approximate row count for ``queryset``.
+
+    Postgres answers from the planner's row estimate; other backends count at
+    most ``cap`` rows, so the result is exact below the cap and a lower bound
+    above it.
+    """
+    queryset = queryset.order_by()
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    return queryset[:cap].count()
+
+
+class EstimatedCountPage(Page):
+    """Page whose ``has_next`` comes from a look-ahead row rather than the count"""
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class EstimatedCountPaginator(Paginator):
+    """Django paginator that never runs an exact ``COUNT(*)``"""
+
+    @property
+    def count(self):
+        if not hasattr(self, '_estimated_count'):
+            self._estimated_count = estimate_count(self.object_list)
+        return self._estimated_count
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        return EstimatedCountPage(rows[:self.per_page], number, self, len(rows) > self.per_page)
+
+
+class EstimatedPageNumberPagination(PageNumberPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get('count') == 'estimate':
+            self.django_paginator_class = EstimatedCountPaginator
+        return super().paginate_queryset(queryset, request, view)
+
+
+class KeysetCursorPagination(CursorPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = '-created_at'
+
+    def get_ordering(self, request, queryset, view):
+        # Key the cursor on the view's default ordering, which matches its index
+        view_ordering = getattr(view, 'ordering', None)
+        if view_ordering:
+            self.ordering = view_ordering
+        return super().get_ordering(request, queryset, view)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.estimated_count = None
+        if request.query_params.get('count') == 'estimate':
+            self.estimated_count = estimate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        payload = OrderedDict()
+        if self.estimated_count is not None:
+            payload['count'] = self.estimated_count
+        payload['next'] = self.get_next_link()
+        payload['previous'] = self.get_previous_link()
+        payload['results'] = data
+        return Response(payload)
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination by default, page-number pagination when ``?page=`` is given"""
+
+    def get_paginator(self, request):
+        if not hasattr(self, '_paginator'):
+            if EstimatedPageNumberPagination.page_query_param in request.query_params:
+                self._paginator = EstimatedPageNumberPagination()
+            else:
+                self._paginator = KeysetCursorPagination()
+        return self._paginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.get_paginator(request).paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self._paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return KeysetCursorPagination().get_paginated_response_schema(schema)
+
+    @property
+    def display_page_controls(self):
+        return getattr(getattr(self, '_paginator', None), 'display_page_controls', False)
+
+    def to_html(self):
+        return self._paginator.to_html()
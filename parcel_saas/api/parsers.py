@@ -0,0 +1,58 @@
+"""Streaming parsers for bulk payloads.
+
+Both parsers return a lazy iterator of row dicts read line by line from the
+request stream, so large uploads are never held in memory as a whole. An
+NDJSON line that is not valid JSON is yielded as an ``UnparsedRow`` so the
+importer reports it as that row's error and carries on.
+"""
+import codecs
+import csv
+import json
+
+from django.conf import settings
+from rest_framework.parsers import BaseParser
+
+
+def _decoded_lines(stream, parser_context):
+    encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+    return codecs.iterdecode(stream, encoding)
+
+
+class UnparsedRow:
+    """A line that could not be parsed, in the place of its row"""
+    __slots__ = ('line_number', 'message')
+
+    def __init__(self, line_number, message):
+        self.line_number = line_number
+        self.message = message
+
+
+class NDJSONParser(BaseParser):
+    """Newline-delimited JSON: one object per line"""
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            return iter(())
+        return self._iter_rows(_decoded_lines(stream, parser_context))
+
+    def _iter_rows(self, lines):
+        for line_number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                yield UnparsedRow(line_number, f'Invalid JSON on line {line_number}: {exc}')
+
+
+class CSVParser(BaseParser):
+    """CSV with a header row; empty cells are treated as missing values"""
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            return iter(())
+        reader = csv.DictReader(_decoded_lines(stream, parser_context))
+        return ({key: value for key, value in row.items() if value != ''} for row in reader)
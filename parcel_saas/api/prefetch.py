@@ -0,0 +1,85 @@
+"""Declarative query plans for serializers.
+
+A serializer declares the relations it reads in its ``Meta``::
+
+    class Meta:
+        select_related = ['department__organization']
+        prefetch_related = ['tracking_locations', ('status_history', ParcelStatusHistorySerializer)]
+
+``prefetch_related`` entries are lookups or ``(lookup, serializer_class)``
+pairs; for a pair the nested serializer's own plan is applied to the related
+queryset, so plans compose down the serializer tree.
+"""
+from django.db.models import Prefetch
+
+from .fieldsets import fields_read, requested_fieldset
+
+
+def _root(entry):
+    lookup = entry[0] if isinstance(entry, tuple) else entry
+    return lookup.split('__')[0]
+
+
+def apply_prefetch_plan(queryset, serializer_class, fields=None):
+    """Return ``queryset`` with the serializer's select/prefetch plan applied.
+
+    Given the serializer's bound ``fields`` (pruned by ``?fields=``/``?expand=``),
+    the plan keeps only relations those fields read and the query loads only
+    their columns, plus any it is ordered by.
+    """
+    meta = getattr(serializer_class, 'Meta', None)
+    select_related = getattr(meta, 'select_related', ())
+    prefetch_related = getattr(meta, 'prefetch_related', ())
+
+    reads = fields_read(queryset.model, fields) if fields is not None else None
+    if reads is not None:
+        columns, relations, nested = reads
+        select_related = [lookup for lookup in select_related if _root(lookup) in relations] + nested
+        prefetch_related = [entry for entry in prefetch_related if _root(entry) in relations]
+        if columns is not None:
+            # Cursor pagination reads its position from the ordering columns
+            local = {field.name for field in queryset.model._meta.concrete_fields}
+            orderings = (ordering.lstrip('-') for ordering in queryset.query.order_by if isinstance(ordering, str))
+            columns.update(name for name in orderings if name in local)
+            queryset = queryset.only(*columns)
+
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+
+    lookups = []
+    for entry in prefetch_related:
+        if isinstance(entry, tuple):
+            lookup, nested_serializer = entry
+            related_model = queryset.model._meta.get_field(lookup).related_model
+            nested_queryset = apply_prefetch_plan(related_model._default_manager.all(), nested_serializer)
+            lookups.append(Prefetch(lookup, queryset=nested_queryset))
+        else:
+            lookups.append(entry)
+    if lookups:
+        queryset = queryset.prefetch_related(*lookups)
+    return queryset
+
+
+class PrefetchPlanMixin:
+    """Apply the active serializer's prefetch plan to every queryset the viewset serves.
+
+    The plan is applied in ``filter_queryset`` so it covers list, retrieve and
+    any action built on ``get_object``, whatever ``get_queryset`` returns.
+    On ``sparse_actions``, ``?fields=`` and ``?expand=`` reach the serializer
+    context and the plan is pruned to the fields that remain.
+    """
+    sparse_actions = ('list', 'retrieve')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in self.sparse_actions:
+            context['fields'], context['expand'] = requested_fieldset(self.request)
+        return context
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        fields = None
+        if self.action in self.sparse_actions and any(requested_fieldset(self.request)):
+            fields = self.get_serializer().fields
+        return apply_prefetch_plan(queryset, serializer_class, fields)
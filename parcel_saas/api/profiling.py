@@ -0,0 +1,408 @@
+"""Per-route request profiling.
+
+``ProfilingMiddleware`` times every request into a per-route latency
+histogram; that costs a clock read and a counter increment. A
+``SAMPLE_RATE`` share of requests is profiled in depth: every SQL statement
+is counted and timed through ``connection.execute_wrapper``, statements
+repeated at least ``DUPLICATE_QUERY_THRESHOLD`` times are flagged as a
+likely N+1, and viewsets using ``ProfiledSerializerMixin`` report the time
+spent in ``to_representation``. Sampled requests are kept in a bounded ring
+buffer.
+
+``/api/_metrics`` exposes the histograms, sampled totals and recent
+percentiles in the Prometheus text format (``?format=json`` lists the recent
+samples instead), and ``manage.py slowest_endpoints`` ranks routes from a
+scrape. All state lives in the worker process; each worker reports its own.
+"""
+import bisect
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, JsonResponse
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 0.1,
+    'RING_SIZE': 1000,
+    'DUPLICATE_QUERY_THRESHOLD': 5,
+    # Bearer token accepted by /api/_metrics; staff sessions are always accepted
+    'METRICS_TOKEN': None,
+}
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+RECENT_QUANTILES = (0.5, 0.99)
+
+UNMATCHED_ROUTE = 'unmatched'
+
+# Collapses "IN (%s, %s, ...)" so batches of different sizes count as one statement
+IN_LIST_PATTERN = re.compile(r'IN \((?:%s, )*%s\)')
+
+_current = ContextVar('parcel_profile', default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'PARCEL_PROFILING', {})}
+
+
+def normalize_sql(sql):
+    return IN_LIST_PATTERN.sub('IN (...)', sql)
+
+
+class RequestProfile:
+    """SQL and serializer measurements for one sampled request"""
+
+    def __init__(self):
+        self.statements = Counter()
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_seconds += time.perf_counter() - start
+            self.query_count += 1
+            self.statements[normalize_sql(sql)] += 1
+
+    def duplicates(self, threshold):
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= threshold]
+
+
+class RouteStats:
+    __slots__ = (
+        'buckets', 'count', 'seconds', 'sampled', 'queries', 'query_seconds', 'serializer_seconds', 'duplicates',
+    )
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.sampled = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.duplicates = 0
+
+
+class MetricsRegistry:
+    """Process-wide per-route counters and the ring buffer of recent samples"""
+
+    def __init__(self, ring_size=DEFAULTS['RING_SIZE']):
+        self._lock = threading.Lock()
+        self.routes = {}
+        self.recent = deque(maxlen=ring_size)
+
+    def observe(self, route, method, status, seconds, profile=None, duplicates=()):
+        key = (route, method)
+        with self._lock:
+            stats = self.routes.get(key)
+            if stats is None:
+                stats = self.routes[key] = RouteStats()
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            stats.count += 1
+            stats.seconds += seconds
+            if profile is None:
+                return
+            stats.sampled += 1
+            stats.queries += profile.query_count
+            stats.query_seconds += profile.query_seconds
+            stats.serializer_seconds += profile.serializer_seconds
+            stats.duplicates += bool(duplicates)
+            self.recent.append({
+                'route': route,
+                'method': method,
+                'status': status,
+                'at': time.time(),
+                'duration_ms': round(seconds * 1000, 3),
+                'queries': profile.query_count,
+                'query_ms': round(profile.query_seconds * 1000, 3),
+                'serializer_ms': round(profile.serializer_seconds * 1000, 3),
+                'duplicate_queries': [{'sql': sql, 'count': count} for sql, count in duplicates],
+            })
+
+    def snapshot(self):
+        with self._lock:
+            routes = {key: {slot: getattr(stats, slot) for slot in RouteStats.__slots__}
+                      for key, stats in self.routes.items()}
+            for stats in routes.values():
+                stats['buckets'] = list(stats['buckets'])
+            return routes, list(self.recent)
+
+    def reset(self, ring_size=None):
+        with self._lock:
+            self.routes = {}
+            self.recent = deque(maxlen=ring_size or self.recent.maxlen)
+
+
+registry = MetricsRegistry()
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNMATCHED_ROUTE
+    return match.view_name or match.route or UNMATCHED_ROUTE
+
+
+def wrap_connections(profile):
+    """An ``ExitStack`` routing this thread's database connections through ``profile``"""
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(profile))
+    return stack
+
+
+class ProfilingMiddleware:
+    """Times every request; runs natively under both WSGI and ASGI.
+
+    Database connections are per thread, so under ASGI the query wrappers are
+    installed and removed through ``sync_to_async``, in the thread that runs
+    the request's database work.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        config = get_config()
+        self.enabled = config['ENABLED']
+        self.sample_rate = config['SAMPLE_RATE']
+        self.threshold = config['DUPLICATE_QUERY_THRESHOLD']
+        if registry.recent.maxlen != config['RING_SIZE']:
+            registry.reset(config['RING_SIZE'])
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        profile = self.sample()
+        start = time.perf_counter()
+        if profile is None:
+            response = self.get_response(request)
+        else:
+            token = _current.set(profile)
+            try:
+                with wrap_connections(profile):
+                    response = self.get_response(request)
+            finally:
+                _current.reset(token)
+        self.record(request, response, time.perf_counter() - start, profile)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        profile = self.sample()
+        start = time.perf_counter()
+        if profile is None:
+            response = await self.get_response(request)
+        else:
+            token = _current.set(profile)
+            try:
+                stack = await sync_to_async(wrap_connections)(profile)
+                try:
+                    response = await self.get_response(request)
+                finally:
+                    await sync_to_async(stack.close)()
+            finally:
+                _current.reset(token)
+        self.record(request, response, time.perf_counter() - start, profile)
+        return response
+
+    def sample(self):
+        return RequestProfile() if random.random() < self.sample_rate else None
+
+    def record(self, request, response, seconds, profile):
+        route = route_name(request)
+        duplicates = profile.duplicates(self.threshold) if profile is not None else ()
+        if duplicates:
+            logger.warning(
+                'Repeated queries on %s %s (likely N+1): %s', request.method, route,
+                '; '.join(f'{count}x {sql[:200]}' for sql, count in duplicates[:3])
+            )
+        registry.observe(route, request.method, response.status_code, seconds, profile, duplicates)
+
+
+_timed_serializers = {}
+
+
+def timed_serializer(serializer_class):
+    """Subclass of ``serializer_class`` that adds its outermost ``to_representation`` time to the profile"""
+    timed = _timed_serializers.get(serializer_class)
+    if timed is None:
+        def to_representation(self, instance):
+            profile = _current.get()
+            if profile is None or profile.serializing:
+                return super(timed, self).to_representation(instance)
+            profile.serializing = True
+            start = time.perf_counter()
+            try:
+                return super(timed, self).to_representation(instance)
+            finally:
+                profile.serializer_seconds += time.perf_counter() - start
+                profile.serializing = False
+
+        timed = type(serializer_class.__name__, (serializer_class,), {
+            'to_representation': to_representation,
+            '__module__': serializer_class.__module__,
+            '__qualname__': serializer_class.__qualname__,
+        })
+        _timed_serializers[serializer_class] = timed
+    return timed
+
+
+class ProfiledSerializerMixin:
+    """Time serialization on sampled requests"""
+
+    def get_serializer(self, *args, **kwargs):
+        if _current.get() is None:
+            return super().get_serializer(*args, **kwargs)
+        kwargs.setdefault('context', self.get_serializer_context())
+        return timed_serializer(self.get_serializer_class())(*args, **kwargs)
+
+
+def _labels(route, method, **extra):
+    labels = {'route': route, 'method': method, **extra}
+    return ','.join(f'{name}="{str(value)}"' for name, value in labels.items())
+
+
+def _quantile(values, quantile):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+def render_prometheus(routes, recent):
+    lines = []
+
+    def family(name, kind, description):
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    ordered = sorted(routes.items())
+    family('parcel_http_request_duration_seconds', 'histogram', 'Request latency per route')
+    for (route, method), stats in ordered:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stats['buckets']):
+            cumulative += count
+            lines.append(f'parcel_http_request_duration_seconds_bucket{{{_labels(route, method, le=bound)}}} {cumulative}')
+        lines.append(f'parcel_http_request_duration_seconds_sum{{{_labels(route, method)}}} {stats["seconds"]:.6f}')
+        lines.append(f'parcel_http_request_duration_seconds_count{{{_labels(route, method)}}} {stats["count"]}')
+
+    counters = (
+        ('parcel_http_sampled_requests_total', 'sampled', 'Requests profiled in depth'),
+        ('parcel_http_sampled_queries_total', 'queries', 'SQL statements run by sampled requests'),
+        ('parcel_http_sampled_query_seconds_total', 'query_seconds', 'SQL time of sampled requests'),
+        ('parcel_http_sampled_serializer_seconds_total', 'serializer_seconds', 'Serializer time of sampled requests'),
+        ('parcel_http_duplicate_query_requests_total', 'duplicates', 'Sampled requests with repeated statements'),
+    )
+    for name, field, description in counters:
+        family(name, 'counter', description)
+        for (route, method), stats in ordered:
+            value = stats[field]
+            value = f'{value:.6f}' if isinstance(value, float) else value
+            lines.append(f'{name}{{{_labels(route, method)}}} {value}')
+
+    grouped = {}
+    for sample in recent:
+        grouped.setdefault((sample['route'], sample['method']), []).append(sample)
+    summaries = (
+        ('parcel_http_recent_queries', 'queries', 'SQL statements per request over the recent samples'),
+        ('parcel_http_recent_serializer_ms', 'serializer_ms', 'Serializer milliseconds over the recent samples'),
+    )
+    for name, field, description in summaries:
+        family(name, 'gauge', description)
+        for (route, method), samples in sorted(grouped.items()):
+            for quantile in RECENT_QUANTILES:
+                value = _quantile([sample[field] for sample in samples], quantile)
+                lines.append(f'{name}{{{_labels(route, method, quantile=quantile)}}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def _authorized(request):
+    # Not relaxed under DEBUG: the samples include SQL text
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_staff:
+        return True
+    token = get_config()['METRICS_TOKEN']
+    header = request.headers.get('Authorization', '')
+    return bool(token) and header.startswith('Bearer ') and constant_time_compare(header[7:], token)
+
+
+def metrics_view(request):
+    """Prometheus scrape target for this worker's request metrics"""
+    if not _authorized(request):
+        return JsonResponse({'error': 'Not authorized'}, status=403)
+    routes, recent = registry.snapshot()
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'recent': recent})
+    return HttpResponse(render_prometheus(routes, recent), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+SAMPLE_PATTERN = re.compile(r'^(?P<name>[a-z_]+)\{(?P<labels>[^}]*)\} (?P<value>\S+)$')
+LABEL_PATTERN = re.compile(r'(\w+)="([^"]*)"')
+
+
+def parse_prometheus(text):
+    """Per-route ``{buckets, count, seconds, queries, sampled}`` from ``render_prometheus`` output"""
+    routes = {}
+    for line in text.splitlines():
+        match = SAMPLE_PATTERN.match(line)
+        if match is None:
+            continue
+        labels = dict(LABEL_PATTERN.findall(match['labels']))
+        if 'route' not in labels:
+            continue
+        stats = routes.setdefault(
+            (labels['route'], labels['method']), {'buckets': [], 'count': 0, 'seconds': 0.0, 'queries': 0, 'sampled': 0}
+        )
+        name, value = match['name'], float(match['value'])
+        if name == 'parcel_http_request_duration_seconds_bucket':
+            bound = float('inf') if labels['le'] == '+Inf' else float(labels['le'])
+            stats['buckets'].append((bound, value))
+        elif name == 'parcel_http_request_duration_seconds_count':
+            stats['count'] = int(value)
+        elif name == 'parcel_http_request_duration_seconds_sum':
+            stats['seconds'] = value
+        elif name == 'parcel_http_sampled_queries_total':
+            stats['queries'] = int(value)
+        elif name == 'parcel_http_sampled_requests_total':
+            stats['sampled'] = int(value)
+    return routes
+
+
+def histogram_quantile(buckets, quantile):
+    """Estimate a quantile from cumulative ``(upper bound, count)`` buckets by linear interpolation"""
+    if not buckets or not buckets[-1][1]:
+        return None
+    rank = quantile * buckets[-1][1]
+    lower_bound, lower_count = 0.0, 0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float('inf'):
+                return lower_bound
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+    return lower_bound
@@ -0,0 +1,195 @@
+"""Retention for the append-only tables.
+
+Each policy selects prunable rows in primary-key (or time) order, one
+bounded batch at a time, and deletes a batch with a single ``DELETE ... IN``
+so no statement holds locks for long. Policies are configured per model in
+the ``PARCEL_RETENTION`` setting; a policy whose ``DAYS`` is ``None`` is
+disabled. ``manage.py apply_retention`` runs them and can first append the
+pruned rows to a gzip-compressed NDJSON archive.
+
+The deletes bypass model signals, so parcel detail cache entries are
+invalidated here. Stored trajectories notice the changed point count and are
+rebuilt on next read.
+"""
+import gzip
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import parcel_detail_cache
+from .models import Notification, ParcelStatusHistory, TrackingLocation
+
+DEFAULT_BATCH_SIZE = 1000
+
+DEFAULTS = {
+    # Read notifications older than DAYS
+    'notifications': {'DAYS': 30},
+    # Tracking points older than DAYS thinned to one per parcel every KEEP_EVERY_SECONDS
+    'tracking_locations': {'DAYS': 90, 'KEEP_EVERY_SECONDS': 3600},
+    # History of delivered, returned or lost parcels older than DAYS; kept by default as the audit trail
+    'status_history': {'DAYS': None},
+}
+
+FINISHED_STATUSES = ('delivered', 'returned', 'lost')
+
+
+def get_config():
+    configured = getattr(settings, 'PARCEL_RETENTION', {})
+    return {name: {**defaults, **configured.get(name, {})} for name, defaults in DEFAULTS.items()}
+
+
+def delete_rows(model, pks):
+    """Delete rows by primary key in one statement, without loading them or sending signals"""
+    if not pks:
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.pk.column)
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({placeholders})', list(pks))
+
+
+class Archive:
+    """Appends pruned rows to a gzip-compressed NDJSON file, one ``{model, pk, fields}`` object per line"""
+
+    def __init__(self, path):
+        self.file = gzip.open(path, 'at', encoding='utf-8')
+        self.rows = 0
+
+    def write(self, model, pks):
+        label = model._meta.label_lower
+        pk_name = model._meta.pk.attname
+        for row in model.objects.filter(pk__in=pks).order_by(pk_name).values():
+            pk = row.pop(pk_name)
+            self.file.write(json.dumps({'model': label, 'pk': pk, 'fields': row}, cls=DjangoJSONEncoder) + '\n')
+            self.rows += 1
+
+    def close(self):
+        self.file.close()
+
+
+class RetentionPolicy:
+    """Deletes rows older than ``days`` matched by ``prunable``, in primary-key batches"""
+    model = None
+    date_field = None
+    # Whether the rows appear in cached parcel detail payloads
+    invalidates_parcels = True
+
+    def __init__(self, name, days, **options):
+        self.name = name
+        self.days = days
+        self.options = options
+
+    def prunable(self, cutoff):
+        return self.model.objects.filter(**{f'{self.date_field}__lt': cutoff})
+
+    def batches(self, cutoff, batch_size):
+        """Yield lists of ``(pk, parcel_id)`` to delete"""
+        last_pk = 0
+        queryset = self.prunable(cutoff).order_by('pk')
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).values_list('pk', 'parcel_id')[:batch_size])
+            if not rows:
+                return
+            yield rows
+            last_pk = rows[-1][0]
+
+    def run(self, now=None, batch_size=DEFAULT_BATCH_SIZE, archive=None, dry_run=False, pause=0):
+        """Apply the policy, sleeping ``pause`` seconds between batches; returns the rows deleted (or that would be)"""
+        cutoff = (now or timezone.now()) - timedelta(days=self.days)
+        deleted = 0
+        for rows in self.batches(cutoff, batch_size):
+            pks = [pk for pk, _ in rows]
+            deleted += len(pks)
+            if dry_run:
+                continue
+            with transaction.atomic():
+                if archive is not None:
+                    archive.write(self.model, pks)
+                delete_rows(self.model, pks)
+            if self.invalidates_parcels:
+                parcel_detail_cache.invalidate_many({parcel_id for _, parcel_id in rows})
+            if pause:
+                time.sleep(pause)
+        return deleted
+
+
+class NotificationPolicy(RetentionPolicy):
+    model = Notification
+    date_field = 'created_at'
+    invalidates_parcels = False
+
+    def prunable(self, cutoff):
+        # Only read ones, so unread counters are unaffected
+        return super().prunable(cutoff).filter(is_read=True)
+
+    def batches(self, cutoff, batch_size):
+        for rows in super().batches(cutoff, batch_size):
+            yield [(pk, None) for pk, _ in rows]
+
+
+class StatusHistoryPolicy(RetentionPolicy):
+    model = ParcelStatusHistory
+    date_field = 'created_at'
+
+    def prunable(self, cutoff):
+        return super().prunable(cutoff).filter(parcel__status__in=FINISHED_STATUSES)
+
+
+class TrackingDownsamplePolicy(RetentionPolicy):
+    """Keeps the first point per parcel in each ``KEEP_EVERY_SECONDS`` window older than ``days``.
+
+    Without ``KEEP_EVERY_SECONDS`` every point older than ``days`` is deleted.
+    """
+    model = TrackingLocation
+    date_field = 'timestamp'
+
+    def batches(self, cutoff, batch_size):
+        interval = self.options.get('KEEP_EVERY_SECONDS') or 0
+        queryset = self.prunable(cutoff).order_by('parcel_id', 'timestamp', 'id')
+        after = Q()
+        kept = None
+        while True:
+            rows = list(queryset.filter(after).values_list('id', 'parcel_id', 'timestamp')[:batch_size])
+            if not rows:
+                return
+            doomed = []
+            for pk, parcel_id, timestamp in rows:
+                bucket = (parcel_id, int(timestamp.timestamp() // interval)) if interval else None
+                if bucket is None or bucket == kept:
+                    doomed.append((pk, parcel_id))
+                else:
+                    kept = bucket
+            if doomed:
+                yield doomed
+            pk, parcel_id, timestamp = rows[-1]
+            after = (
+                Q(parcel_id__gt=parcel_id)
+                | Q(parcel_id=parcel_id, timestamp__gt=timestamp)
+                | Q(parcel_id=parcel_id, timestamp=timestamp, id__gt=pk)
+            )
+
+
+POLICIES = {
+    'notifications': NotificationPolicy,
+    'tracking_locations': TrackingDownsamplePolicy,
+    'status_history': StatusHistoryPolicy,
+}
+
+
+def get_policies(names=None):
+    """Enabled policies from ``PARCEL_RETENTION``, optionally limited to ``names``"""
+    config = get_config()
+    policies = []
+    for name in names or POLICIES:
+        options = dict(config[name])
+        days = options.pop('DAYS')
+        if days is not None:
+            policies.append(POLICIES[name](name, days, **options))
+    return policies
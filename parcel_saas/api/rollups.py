@@ -0,0 +1,322 @@
+"""Daily parcel and review rollups and monthly review aggregates.
+
+``DailyMetrics`` holds one row per organization, department and day with
+event counters (parcels created, delivered, lost, returned), summed delivery
+times and summed review ratings. ``ReviewAggregate`` keeps the same review
+sums plus recommendation counts per month. The write paths that create
+parcels, change their status or save and delete reviews add their deltas
+here, so the metrics and review summary endpoints read only rollup rows
+however many parcels and reviews exist. ``manage.py backfill_daily_metrics``
+rebuilds a date range of daily rows from the raw tables.
+
+Both paths count the same events: status counters and delivery times come
+from each ``ParcelStatusHistory`` transition (a parcel delivered twice counts
+twice, timed from creation to each delivery), and deleting a parcel takes it,
+its transitions and its review back off the rollups, since a backfill no
+longer sees them.
+"""
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyMetrics, DeliveryReview, Parcel, ParcelStatusHistory, ReviewAggregate
+
+STATUS_COUNTERS = {
+    'delivered': 'delivered_count',
+    'lost': 'lost_count',
+    'returned': 'returned_count',
+}
+
+REVIEW_ASPECTS = ('rating', 'delivery_speed_rating', 'packaging_quality_rating', 'communication_rating')
+
+COUNTER_FIELDS = (
+    'created_count', 'delivered_count', 'lost_count', 'returned_count',
+    'delivery_time_count', 'delivery_seconds_total', 'review_count',
+) + tuple(f'{aspect}_total' for aspect in REVIEW_ASPECTS)
+
+DEFAULT_METRICS_DAYS = 30
+BACKFILL_BATCH_SIZE = 1000
+
+
+REVIEW_AGGREGATE_FIELDS = ('review_count', 'recommend_count') + tuple(f'{aspect}_total' for aspect in REVIEW_ASPECTS)
+
+# Rollup model -> the date field its rows are keyed by
+PERIOD_FIELDS = {DailyMetrics: 'day', ReviewAggregate: 'month'}
+
+
+def month_start(value):
+    return value.replace(day=1)
+
+
+def _add(deltas, organization_id, department_id, period, **changes):
+    bucket = deltas.setdefault((organization_id, department_id, period), {})
+    for field, delta in changes.items():
+        bucket[field] = bucket.get(field, 0) + delta
+
+
+def _increment(model, key, changes):
+    increments = {field: F(field) + delta for field, delta in changes.items()}
+    return model.objects.filter(**key).update(**increments, updated_at=timezone.now())
+
+
+def apply_deltas(deltas, model=DailyMetrics):
+    """Add ``{(organization_id, department_id, period): {field: delta}}`` to ``model`` rows.
+
+    Existing rows get one ``UPDATE`` each; rows seen for the first time are
+    inserted together.
+    """
+    missing = {}
+    period_field = PERIOD_FIELDS[model]
+    for (organization_id, department_id, period), changes in deltas.items():
+        changes = {field: delta for field, delta in changes.items() if delta}
+        key = {'organization_id': organization_id, 'department_id': department_id, period_field: period}
+        if changes and not _increment(model, key, changes):
+            missing[(organization_id, department_id, period)] = (key, changes)
+    if not missing:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create([model(**key, **changes) for key, changes in missing.values()])
+    except IntegrityError:
+        # Another writer created some of the rows first
+        for key, changes in missing.values():
+            if not _increment(model, key, changes):
+                model.objects.create(**key, **changes)
+
+
+def record_parcels_created(parcels):
+    deltas = {}
+    for parcel in parcels:
+        _add(
+            deltas, parcel.organization_id, parcel.department_id, timezone.localdate(parcel.created_at),
+            created_count=1
+        )
+    apply_deltas(deltas)
+
+
+def _status_change(new_status, created_at, changed_at, sign=1):
+    """Counter deltas of one transition to ``new_status`` made at ``changed_at``"""
+    changes = {STATUS_COUNTERS[new_status]: sign}
+    if new_status == 'delivered':
+        changes['delivery_time_count'] = sign
+        changes['delivery_seconds_total'] = sign * (changed_at - created_at).total_seconds()
+    return changes
+
+
+def record_status_changes(rows, new_status, changed_at=None):
+    """Count parcels moved to ``new_status``.
+
+    ``rows`` are mappings with ``organization_id``, ``department_id`` and
+    ``created_at``, plus the ``changed_at`` of their history row when it
+    differs from ``changed_at``; only the statuses in ``STATUS_COUNTERS`` are
+    rolled up.
+    """
+    if new_status not in STATUS_COUNTERS:
+        return
+    changed_at = changed_at or timezone.now()
+    deltas = {}
+    for row in rows:
+        row_changed_at = row.get('changed_at', changed_at)
+        _add(
+            deltas, row['organization_id'], row['department_id'], timezone.localdate(row_changed_at),
+            **_status_change(new_status, row['created_at'], row_changed_at)
+        )
+    apply_deltas(deltas)
+
+
+def record_parcel_status_change(parcel, previous_status, changed_at=None):
+    """Count a parcel's move from ``previous_status``, made when its history row was created"""
+    if parcel.status == previous_status:
+        return
+    row = {
+        'organization_id': parcel.organization_id,
+        'department_id': parcel.department_id,
+        'created_at': parcel.created_at,
+    }
+    record_status_changes([row], parcel.status, changed_at)
+
+
+def record_parcel_deleted(parcel):
+    """Take a parcel about to be deleted, its status changes and its review off the rollups"""
+    key = (parcel.organization_id, parcel.department_id)
+    deltas = {}
+    _add(deltas, *key, timezone.localdate(parcel.created_at), created_count=-1)
+    changes = parcel.status_history.order_by().filter(
+        new_status__in=STATUS_COUNTERS
+    ).exclude(previous_status=F('new_status')).values_list('new_status', 'created_at')
+    for new_status, changed_at in changes:
+        _add(
+            deltas, *key, timezone.localdate(changed_at),
+            **_status_change(new_status, parcel.created_at, changed_at, sign=-1)
+        )
+    apply_deltas(deltas)
+    review = DeliveryReview.objects.filter(parcel=parcel).first()
+    if review is not None:
+        review.parcel = parcel
+        record_review(review, sign=-1)
+
+
+def review_snapshot(review):
+    """The rollup keys and ratings of a review, taken before an update changes them"""
+    return {
+        'organization_id': review.parcel.organization_id,
+        'department_id': review.parcel.department_id,
+        'created_at': review.created_at,
+        'ratings': {aspect: getattr(review, aspect) for aspect in REVIEW_ASPECTS},
+        'would_recommend': review.would_recommend,
+    }
+
+
+def _add_review(daily, monthly, snapshot, sign):
+    totals = {f'{aspect}_total': sign * value for aspect, value in snapshot['ratings'].items()}
+    day = timezone.localdate(snapshot['created_at'])
+    key = (snapshot['organization_id'], snapshot['department_id'])
+    _add(daily, *key, day, review_count=sign, **totals)
+    _add(
+        monthly, *key, month_start(day),
+        review_count=sign, recommend_count=sign if snapshot['would_recommend'] else 0, **totals
+    )
+
+
+def _apply_reviews(daily, monthly):
+    apply_deltas(daily)
+    apply_deltas(monthly, ReviewAggregate)
+
+
+def record_review(review, sign=1):
+    """Add a created review (``sign=1``) or remove a deleted one (``sign=-1``)"""
+    daily, monthly = {}, {}
+    _add_review(daily, monthly, review_snapshot(review), sign)
+    _apply_reviews(daily, monthly)
+
+
+def record_review_changed(previous, review):
+    daily, monthly = {}, {}
+    _add_review(daily, monthly, previous, -1)
+    _add_review(daily, monthly, review_snapshot(review), 1)
+    _apply_reviews(daily, monthly)
+
+
+def _format_reviews(row):
+    reviews = row['review_count']
+    return {
+        'reviews': reviews,
+        'average_ratings': {
+            aspect: round(row[f'{aspect}_total'] / reviews, 2) if reviews else None for aspect in REVIEW_ASPECTS
+        },
+        'recommend_rate': round(row['recommend_count'] / reviews, 4) if reviews else None,
+    }
+
+
+def build_review_summary(aggregates):
+    """Overall and per-month averages from a ``ReviewAggregate`` queryset"""
+    sums = {f'sum_{field}': Sum(field) for field in REVIEW_AGGREGATE_FIELDS}
+    rows = list(aggregates.order_by('month').values('month').annotate(**sums))
+    months, totals = [], dict.fromkeys(REVIEW_AGGREGATE_FIELDS, 0)
+    for row in rows:
+        values = {field: row[f'sum_{field}'] or 0 for field in REVIEW_AGGREGATE_FIELDS}
+        for field, value in values.items():
+            totals[field] += value
+        months.append({'month': row['month'].strftime('%Y-%m'), **_format_reviews(values)})
+    return {**_format_reviews(totals), 'months': months}
+
+
+def _format(row):
+    delivered_times = row['delivery_time_count']
+    reviews = row['review_count']
+    return {
+        'created': row['created_count'],
+        'delivered': row['delivered_count'],
+        'lost': row['lost_count'],
+        'returned': row['returned_count'],
+        'average_delivery_hours': (
+            round(row['delivery_seconds_total'] / delivered_times / 3600, 2) if delivered_times else None
+        ),
+        'reviews': reviews,
+        'average_ratings': {
+            aspect: round(row[f'{aspect}_total'] / reviews, 2) if reviews else None for aspect in REVIEW_ASPECTS
+        },
+    }
+
+
+def build_metrics(organization, since=None, until=None, department=None):
+    """Per-day and total metrics for an inclusive date range, read from rollup rows only"""
+    until = until or timezone.localdate()
+    since = since or until - timedelta(days=DEFAULT_METRICS_DAYS - 1)
+    rows = DailyMetrics.objects.filter(organization=organization, day__gte=since, day__lte=until)
+    if department is not None:
+        rows = rows.filter(department_id=department)
+    rows = list(
+        rows.order_by('day').values('day').annotate(**{f'sum_{field}': Sum(field) for field in COUNTER_FIELDS})
+    )
+    days, totals = [], dict.fromkeys(COUNTER_FIELDS, 0)
+    for row in rows:
+        values = {field: row[f'sum_{field}'] or 0 for field in COUNTER_FIELDS}
+        for field, value in values.items():
+            totals[field] += value
+        days.append({'day': row['day'].isoformat(), **_format(values)})
+    return {'from': since.isoformat(), 'to': until.isoformat(), 'totals': _format(totals), 'days': days}
+
+
+def _merge(merged, rows, organization_key, department_key, fields):
+    for row in rows:
+        key = (row[organization_key], row[department_key], row['day'])
+        bucket = merged.setdefault(key, dict.fromkeys(COUNTER_FIELDS, 0))
+        for target, source in fields.items():
+            value = row[source]
+            if isinstance(value, timedelta):
+                value = value.total_seconds()
+            bucket[target] += value or 0
+
+
+def backfill(since, until, organization_ids=None):
+    """Recompute rollup rows for an inclusive date range from the raw tables; returns rows written"""
+    def scoped(queryset, organization_field):
+        if organization_ids:
+            queryset = queryset.filter(**{f'{organization_field}__in': organization_ids})
+        return queryset.order_by()
+
+    merged = {}
+    created = scoped(Parcel.objects.filter(created_at__date__range=(since, until)), 'organization_id')
+    _merge(merged, created.annotate(day=TruncDate('created_at')).values(
+        'organization_id', 'department_id', 'day'
+    ).annotate(created=Count('id')), 'organization_id', 'department_id', {'created_count': 'created'})
+
+    changes = scoped(ParcelStatusHistory.objects.filter(
+        created_at__date__range=(since, until), new_status__in=STATUS_COUNTERS,
+    ).exclude(previous_status=F('new_status')), 'parcel__organization_id')
+    for new_status, counter in STATUS_COUNTERS.items():
+        _merge(merged, changes.filter(new_status=new_status).annotate(day=TruncDate('created_at')).values(
+            'parcel__organization_id', 'parcel__department_id', 'day'
+        ).annotate(count=Count('id')), 'parcel__organization_id', 'parcel__department_id', {counter: 'count'})
+
+    # Every delivery is timed, as the live path does, not only the parcel's latest delivered_at
+    delivered = changes.filter(new_status='delivered')
+    _merge(merged, delivered.annotate(day=TruncDate('created_at')).values(
+        'parcel__organization_id', 'parcel__department_id', 'day'
+    ).annotate(
+        count=Count('id'),
+        seconds=Sum(ExpressionWrapper(F('created_at') - F('parcel__created_at'), output_field=DurationField())),
+    ), 'parcel__organization_id', 'parcel__department_id',
+        {'delivery_time_count': 'count', 'delivery_seconds_total': 'seconds'})
+
+    reviews = scoped(DeliveryReview.objects.filter(created_at__date__range=(since, until)), 'parcel__organization_id')
+    _merge(merged, reviews.annotate(day=TruncDate('created_at')).values(
+        'parcel__organization_id', 'parcel__department_id', 'day'
+    ).annotate(count=Count('id'), **{f'sum_{aspect}': Sum(aspect) for aspect in REVIEW_ASPECTS}),
+        'parcel__organization_id', 'parcel__department_id',
+        {'review_count': 'count', **{f'{aspect}_total': f'sum_{aspect}' for aspect in REVIEW_ASPECTS}})
+
+    existing = DailyMetrics.objects.filter(day__range=(since, until))
+    if organization_ids:
+        existing = existing.filter(organization_id__in=organization_ids)
+    with transaction.atomic():
+        existing.delete()
+        DailyMetrics.objects.bulk_create([
+            DailyMetrics(organization_id=organization_id, department_id=department_id, day=day, **counters)
+            for (organization_id, department_id, day), counters in merged.items()
+        ], batch_size=BACKFILL_BATCH_SIZE)
+    return len(merged)
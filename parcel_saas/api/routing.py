@@ -0,0 +1,136 @@
+"""Route distance and ETA computation.
+
+All legs of all requested parcels are loaded as NumPy arrays and measured in
+one vectorized haversine pass; per-parcel totals come from ``np.bincount``
+instead of Python loops. Remaining distance starts from the parcel's latest
+``TrackingLocation`` when a leg is in progress, and the ETA assumes
+``ROUTE_AVERAGE_SPEED_KMH``.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .bulk import iter_chunks
+from .cache import parcel_detail_cache
+from .geo import EARTH_RADIUS_KM
+from .models import DeliveryRoute, Parcel, TrackingLocation
+
+DEFAULT_AVERAGE_SPEED_KMH = 40.0
+
+# Parcel ids per query, kept under database parameter limits
+ROUTE_CHUNK_SIZE = 500
+
+COORDINATE_FIELDS = ('from_latitude', 'from_longitude', 'to_latitude', 'to_longitude')
+LEG_FIELDS = ('id', 'parcel_id') + COORDINATE_FIELDS
+
+
+def haversine_km_array(lat1, lon1, lat2, lon2):
+    """Element-wise great-circle distance in km between coordinate arrays"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def to_decimal_km(value):
+    return Decimal(f'{value:.2f}')
+
+
+def leg_distance_km(from_latitude, from_longitude, to_latitude, to_longitude):
+    """Distance of a single leg, rounded for ``DeliveryRoute.distance_km``"""
+    return to_decimal_km(float(haversine_km_array(from_latitude, from_longitude, to_latitude, to_longitude)))
+
+
+def average_speed_kmh():
+    return getattr(settings, 'ROUTE_AVERAGE_SPEED_KMH', DEFAULT_AVERAGE_SPEED_KMH)
+
+
+def _latest_fixes(parcel_ids):
+    latest = TrackingLocation.objects.filter(parcel=OuterRef('pk')).order_by('-timestamp', '-id')
+    return {
+        parcel_id: (latitude, longitude)
+        for parcel_id, latitude, longitude in Parcel.objects.filter(id__in=parcel_ids).annotate(
+            fix_latitude=Subquery(latest.values('latitude')[:1]),
+            fix_longitude=Subquery(latest.values('longitude')[:1]),
+        ).values_list('id', 'fix_latitude', 'fix_longitude')
+        if latitude is not None
+    }
+
+
+def compute_route_metrics(parcel_ids, update_distances=False):
+    """Total, remaining distance and ETA for each parcel that has route legs.
+
+    With ``update_distances`` the stored ``distance_km`` of every leg is
+    rewritten from its coordinates with ``bulk_update`` and the cached
+    details of those parcels are dropped.
+    """
+    metrics = {}
+    for chunk in iter_chunks(sorted(set(parcel_ids)), ROUTE_CHUNK_SIZE):
+        metrics.update(_compute_chunk(chunk, update_distances))
+    return metrics
+
+
+def _compute_chunk(parcel_ids, update_distances):
+    legs = list(
+        DeliveryRoute.objects.filter(parcel_id__in=parcel_ids)
+        .order_by('parcel_id', 'route_sequence')
+        .values_list(*LEG_FIELDS, 'status')
+    )
+    if not legs:
+        return {}
+
+    numeric = np.array([leg[:-1] for leg in legs], dtype=float)
+    statuses = np.array([leg[-1] for leg in legs])
+    leg_ids = numeric[:, 0].astype(np.int64)
+    parcel_of_leg = numeric[:, 1].astype(np.int64)
+    distances = haversine_km_array(numeric[:, 2], numeric[:, 3], numeric[:, 4], numeric[:, 5])
+
+    if update_distances:
+        DeliveryRoute.objects.bulk_update(
+            [DeliveryRoute(id=int(leg_id), distance_km=to_decimal_km(distance))
+             for leg_id, distance in zip(leg_ids, distances)],
+            ['distance_km'], batch_size=ROUTE_CHUNK_SIZE,
+        )
+        # bulk_update sends no signals
+        parcel_detail_cache.invalidate_many(parcel_ids)
+
+    # Dense index per parcel so totals reduce with bincount
+    unique_parcels, parcel_index = np.unique(parcel_of_leg, return_inverse=True)
+    size = len(unique_parcels)
+
+    pending = statuses == 'pending'
+    in_progress = statuses == 'in_progress'
+
+    fixes = _latest_fixes(unique_parcels.tolist())
+    fix_lat = np.array([fixes.get(int(p), (np.nan, np.nan))[0] for p in unique_parcels], dtype=float)
+    fix_lon = np.array([fixes.get(int(p), (np.nan, np.nan))[1] for p in unique_parcels], dtype=float)
+
+    # An in-progress leg counts from the latest fix to its destination, or in full without a fix
+    from_fix = haversine_km_array(fix_lat[parcel_index], fix_lon[parcel_index], numeric[:, 4], numeric[:, 5])
+    in_progress_remaining = np.where(np.isnan(from_fix), distances, np.minimum(from_fix, distances))
+
+    total = np.bincount(parcel_index, weights=distances, minlength=size)
+    remaining = (
+        np.bincount(parcel_index, weights=np.where(pending, distances, 0.0), minlength=size)
+        + np.bincount(parcel_index, weights=np.where(in_progress, in_progress_remaining, 0.0), minlength=size)
+    )
+    legs_count = np.bincount(parcel_index, minlength=size)
+    legs_done = np.bincount(parcel_index, weights=(statuses == 'completed').astype(float), minlength=size)
+
+    now = timezone.now()
+    speed = average_speed_kmh()
+    metrics = {}
+    for index, parcel_id in enumerate(unique_parcels.tolist()):
+        remaining_km = float(remaining[index])
+        metrics[parcel_id] = {
+            'parcel': parcel_id,
+            'legs': int(legs_count[index]),
+            'completed_legs': int(legs_done[index]),
+            'total_distance_km': round(float(total[index]), 2),
+            'remaining_distance_km': round(remaining_km, 2),
+            'eta': now + timedelta(hours=remaining_km / speed) if remaining_km > 0 else None,
+        }
+    return metrics
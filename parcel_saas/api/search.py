@@ -0,0 +1,280 @@
+"""Full-text search over parcels and reviews.
+
+Each searchable model has a side table keyed by the model's primary key that
+holds its text columns: an FTS5 virtual table on SQLite, a weighted
+``tsvector`` with a GIN index on Postgres. Every search term is matched as a
+prefix, so partial tracking numbers such as ``TRK-00`` find their parcels,
+and results are annotated with ``search_rank`` (higher is more relevant).
+
+Signals index single saves and deletes; bulk inserts call
+``index_instances`` themselves. ``manage.py rebuild_search_index``
+repopulates the tables from the source rows in primary-key batches. Other
+database vendors have no backend, and callers fall back to ``icontains``.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+RANK_FIELD = 'search_rank'
+DEFAULT_BATCH_SIZE = 5000
+
+# Searched columns per model with their weight: 'A' ranks above 'B'
+DOCUMENTS = {
+    'api.parcel': {
+        'source': 'api_parcel',
+        'table': 'api_parcel_search',
+        'fields': {'tracking_number': 'A', 'sender_name': 'B', 'receiver_name': 'B'},
+    },
+    'api.deliveryreview': {
+        'source': 'api_deliveryreview',
+        'table': 'api_deliveryreview_search',
+        'fields': {'title': 'A', 'comment': 'B'},
+    },
+}
+
+# Hyphens and underscores are kept inside terms so tracking numbers stay whole
+TERM_PATTERN = re.compile(r'[\w-]+')
+MAX_TERMS = 10
+
+
+def parse_terms(query):
+    terms = (term.strip('-_').lower() for term in TERM_PATTERN.findall(query))
+    return [term for term in terms if term][:MAX_TERMS]
+
+
+class SearchBackend:
+    """Maintains and queries the side tables on one database connection"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_tables(self):
+        with self.connection.cursor() as cursor:
+            for document in DOCUMENTS.values():
+                for statement in self.create_sql(document):
+                    cursor.execute(statement)
+
+    def drop_tables(self):
+        with self.connection.cursor() as cursor:
+            for document in DOCUMENTS.values():
+                cursor.execute(f"DROP TABLE IF EXISTS {document['table']}")
+
+    def is_installed(self):
+        tables = set(self.connection.introspection.table_names())
+        return all(document['table'] in tables for document in DOCUMENTS.values())
+
+    def index(self, label, rows):
+        """Insert or replace ``(pk, {field: value})`` rows"""
+        document = DOCUMENTS[label]
+        rows = [(pk, *[values.get(field) or '' for field in document['fields']]) for pk, values in rows]
+        if not rows:
+            return
+        with self.connection.cursor() as cursor:
+            self.write_rows(cursor, document, rows)
+
+    def remove(self, label, pks):
+        pks = list(pks)
+        if not pks:
+            return
+        with self.connection.cursor() as cursor:
+            self.remove_rows(cursor, DOCUMENTS[label], pks)
+
+    def remove_rows(self, cursor, document, pks):
+        placeholders = ', '.join(['%s'] * len(pks))
+        cursor.execute(f"DELETE FROM {document['table']} WHERE {self.key_column} IN ({placeholders})", pks)
+
+    def rebuild(self, label, batch_size=DEFAULT_BATCH_SIZE):
+        """Repopulate one model's table from its source rows; returns the row count"""
+        document = DOCUMENTS[label]
+        indexed = 0
+        last_id = 0
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {document['table']}")
+            while True:
+                cursor.execute(
+                    f"SELECT MAX(id), COUNT(*) FROM (SELECT id FROM {document['source']} "
+                    f"WHERE id > %s ORDER BY id LIMIT %s) batch",
+                    [last_id, batch_size]
+                )
+                upper_id, count = cursor.fetchone()
+                if not count:
+                    return indexed
+                self.copy_rows(cursor, document, last_id, upper_id)
+                indexed += count
+                last_id = upper_id
+
+    def search(self, queryset, query):
+        """Restrict ``queryset`` to rows matching ``query`` and annotate their rank"""
+        document = DOCUMENTS[queryset.model._meta.label_lower]
+        terms = parse_terms(query)
+        if not terms:
+            return queryset.none()
+        expression = self.match_expression(terms)
+        source_pk = f"{queryset.model._meta.db_table}.{queryset.model._meta.pk.column}"
+        return queryset.filter(
+            pk__in=RawSQL(self.match_sql(document), [expression])
+        ).annotate(**{
+            RANK_FIELD: RawSQL(self.rank_sql(document, source_pk), [expression], output_field=FloatField())
+        })
+
+
+class SQLiteSearchBackend(SearchBackend):
+    key_column = 'rowid'
+
+    def create_sql(self, document):
+        columns = ', '.join(document['fields'])
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {document['table']} USING fts5("
+            f"{columns}, tokenize=\"unicode61 tokenchars '-_'\", prefix='2 3 4')"
+        ]
+
+    def write_rows(self, cursor, document, rows):
+        columns = ', '.join(document['fields'])
+        placeholders = ', '.join(['%s'] * (len(document['fields']) + 1))
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {document['table']}(rowid, {columns}) VALUES ({placeholders})", rows
+        )
+
+    def copy_rows(self, cursor, document, after_id, upper_id):
+        columns = ', '.join(document['fields'])
+        values = ', '.join(f"COALESCE({field}, '')" for field in document['fields'])
+        cursor.execute(
+            f"INSERT INTO {document['table']}(rowid, {columns}) "
+            f"SELECT id, {values} FROM {document['source']} WHERE id > %s AND id <= %s",
+            [after_id, upper_id]
+        )
+
+    def match_expression(self, terms):
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def match_sql(self, document):
+        return f"SELECT rowid FROM {document['table']} WHERE {document['table']} MATCH %s"
+
+    def rank_sql(self, document, source_pk):
+        # bm25() is lower for better matches; negate so higher ranks first on both backends
+        weights = ', '.join('10.0' if weight == 'A' else '1.0' for weight in document['fields'].values())
+        table = document['table']
+        return f"(SELECT -bm25({table}, {weights}) FROM {table} WHERE {table} MATCH %s AND rowid = {source_pk})"
+
+
+class PostgresSearchBackend(SearchBackend):
+    key_column = 'id'
+
+    def create_sql(self, document):
+        table = document['table']
+        return [
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            f"id bigint PRIMARY KEY REFERENCES {document['source']}(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            f"document tsvector NOT NULL)",
+            f"CREATE INDEX IF NOT EXISTS {table}_document_idx ON {table} USING GIN (document)",
+        ]
+
+    def vector_sql(self, document, values):
+        return ' || '.join(
+            f"setweight(to_tsvector('simple', {value}), '{weight}')"
+            for value, weight in zip(values, document['fields'].values())
+        )
+
+    def write_rows(self, cursor, document, rows):
+        vector = self.vector_sql(document, ['%s'] * len(document['fields']))
+        cursor.executemany(
+            f"INSERT INTO {document['table']} (id, document) VALUES (%s, {vector}) "
+            f"ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document",
+            rows
+        )
+
+    def copy_rows(self, cursor, document, after_id, upper_id):
+        vector = self.vector_sql(document, [f"COALESCE({field}, '')" for field in document['fields']])
+        cursor.execute(
+            f"INSERT INTO {document['table']} (id, document) "
+            f"SELECT id, {vector} FROM {document['source']} WHERE id > %s AND id <= %s "
+            f"ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document",
+            [after_id, upper_id]
+        )
+
+    def match_expression(self, terms):
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def match_sql(self, document):
+        return f"SELECT id FROM {document['table']} WHERE document @@ to_tsquery('simple', %s)"
+
+    def rank_sql(self, document, source_pk):
+        table = document['table']
+        return (
+            f"(SELECT ts_rank(document, to_tsquery('simple', %s)) FROM {table} "
+            f"WHERE {table}.id = {source_pk})"
+        )
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+# Aliases whose side tables are known to exist
+_installed = set()
+
+
+def get_backend(using=DEFAULT_DB_ALIAS, require_tables=True):
+    """Search backend for a database alias, or None when unsupported or not migrated"""
+    connection = connections[using]
+    backend_class = BACKENDS.get(connection.vendor)
+    if backend_class is None:
+        return None
+    backend = backend_class(connection)
+    if require_tables and using not in _installed:
+        if not backend.is_installed():
+            return None
+        _installed.add(using)
+    return backend
+
+
+def _fields(instance):
+    return {field: getattr(instance, field) for field in DOCUMENTS[instance._meta.label_lower]['fields']}
+
+
+def index_instances(instances, using=DEFAULT_DB_ALIAS):
+    """Index saved model instances; used where bulk writes bypass the save signals"""
+    backend = get_backend(using)
+    if backend is None:
+        return
+    grouped = {}
+    for instance in instances:
+        grouped.setdefault(instance._meta.label_lower, []).append((instance.pk, _fields(instance)))
+    for label, rows in grouped.items():
+        backend.index(label, rows)
+
+
+def remove_instances(label, pks, using=DEFAULT_DB_ALIAS):
+    backend = get_backend(using)
+    if backend is not None:
+        backend.remove(label, pks)
+
+
+def search_queryset(queryset, query):
+    """Ranked full-text matches, or None when the model or database has no index"""
+    if queryset.model._meta.label_lower not in DOCUMENTS:
+        return None
+    backend = get_backend(queryset.db)
+    if backend is None:
+        return None
+    return backend.search(queryset, query)
+
+
+def create_index_tables(apps, schema_editor):
+    backend = get_backend(schema_editor.connection.alias, require_tables=False)
+    if backend is None:
+        return
+    backend.create_tables()
+    for label in DOCUMENTS:
+        backend.rebuild(label)
+    _installed.add(schema_editor.connection.alias)
+
+
+def drop_index_tables(apps, schema_editor):
+    backend = get_backend(schema_editor.connection.alias, require_tables=False)
+    if backend is not None:
+        backend.drop_tables()
+    _installed.discard(schema_editor.connection.alias)
@@ -4,6 +4,9 @@ from .models import (
     Organization, Department, Parcel, ParcelStatusHistory, ParcelDeliveryHistory,
     DeliveryReview, TrackingLocation, DeliveryRoute, Notification
 )
+from .fieldsets import SparseFieldsMixin
+from .rows import ValuesRowMixin
+from .trajectory import trajectory_payload
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -18,6 +21,7 @@ class OrganizationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Organization
         fields = ['id', 'name', 'description', 'admin', 'created_at', 'updated_at']
+        select_related = ['admin']
 
 
 class DepartmentSerializer(serializers.ModelSerializer):
@@ -26,14 +30,16 @@ class DepartmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Department
         fields = ['id', 'organization', 'organization_name', 'name', 'description', 'created_at']
+        select_related = ['organization']
 
 
-class ParcelStatusHistorySerializer(serializers.ModelSerializer):
+class ParcelStatusHistorySerializer(ValuesRowMixin, serializers.ModelSerializer):
     changed_by_username = serializers.CharField(source='changed_by.username', read_only=True)
 
     class Meta:
         model = ParcelStatusHistory
         fields = ['id', 'parcel', 'previous_status', 'new_status', 'changed_by', 'changed_by_username', 'notes', 'created_at']
+        select_related = ['changed_by']
 
 
 class ParcelDeliveryHistorySerializer(serializers.ModelSerializer):
@@ -42,34 +48,51 @@ class ParcelDeliveryHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = ParcelDeliveryHistory
         fields = ['id', 'user', 'user_username', 'parcel', 'role', 'timestamp']
+        select_related = ['user']
 
 
-class TrackingLocationSerializer(serializers.ModelSerializer):
+class TrackingLocationSerializer(ValuesRowMixin, serializers.ModelSerializer):
     class Meta:
         model = TrackingLocation
         fields = ['id', 'parcel', 'latitude', 'longitude', 'location_name', 'status', 'timestamp', 'notes']
+        read_only_fields = ['timestamp']
 
 
-class DeliveryRouteSerializer(serializers.ModelSerializer):
-    parcel_tracking = serializers.CharField(source='parcel.tracking_number', read_only=True)
+class GPSPositionSerializer(serializers.Serializer):
+    parcel = serializers.IntegerField()
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    timestamp = serializers.DateTimeField(required=False)
+    location_name = serializers.CharField(max_length=255, required=False)
+    status = serializers.CharField(max_length=50, required=False)
 
-    class Meta:
-        model = DeliveryRoute
-        fields = ['id', 'parcel', 'parcel_tracking', 'route_sequence', 'from_location', 'to_location',
-                  'from_latitude', 'from_longitude', 'to_latitude', 'to_longitude', 'distance_km', 'status', 'created_at']
 
+class GPSReportSerializer(serializers.Serializer):
+    device = serializers.CharField(max_length=100)
+    positions = GPSPositionSerializer(many=True, allow_empty=False, max_length=1000)
 
-class DeliveryReviewSerializer(serializers.ModelSerializer):
-    reviewer_username = serializers.CharField(source='reviewer.username', read_only=True)
-    parcel_tracking = serializers.CharField(source='parcel.tracking_number', read_only=True)
 
-    class Meta:
-        model = DeliveryReview
-        fields = ['id', 'parcel', 'parcel_tracking', 'reviewer', 'reviewer_username', 'rating', 'title', 'comment',
-                  'delivery_speed_rating', 'packaging_quality_rating', 'communication_rating', 'would_recommend', 'created_at', 'updated_at']
+class RouteOptimizeSerializer(serializers.Serializer):
+    organization = serializers.IntegerField(required=False)
+    department = serializers.IntegerField(required=False)
+    depot_latitude = serializers.FloatField(min_value=-90, max_value=90)
+    depot_longitude = serializers.FloatField(min_value=-180, max_value=180)
+    depot_name = serializers.CharField(max_length=255, required=False)
+    statuses = serializers.ListField(
+        child=serializers.ChoiceField(choices=Parcel.STATUS_CHOICES), required=False, allow_empty=False
+    )
+    return_to_depot = serializers.BooleanField(default=True)
+    time_budget_ms = serializers.IntegerField(min_value=0, max_value=10000, default=2000)
+    dry_run = serializers.BooleanField(default=False)
 
+    def validate(self, data):
+        if data.get('organization') is None and data.get('department') is None:
+            raise serializers.ValidationError('organization or department required')
+        return data
 
-class ParcelListSerializer(serializers.ModelSerializer):
+
+class ParcelListSerializer(ValuesRowMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    """Also serializes ``rows.values_rows`` dicts, which list pages use to skip building instances"""
     department_name = serializers.CharField(source='department.name', read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     type_display = serializers.CharField(source='get_parcel_type_display', read_only=True)
@@ -78,9 +101,35 @@ class ParcelListSerializer(serializers.ModelSerializer):
         model = Parcel
         fields = ['id', 'tracking_number', 'parcel_type', 'type_display', 'status', 'status_display',
                   'sender_name', 'receiver_name', 'current_location', 'created_at', 'delivered_at', 'department', 'department_name']
+        select_related = ['department']
+
 
+class DeliveryRouteSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    parcel_tracking = serializers.CharField(source='parcel.tracking_number', read_only=True)
 
-class ParcelDetailSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeliveryRoute
+        fields = ['id', 'parcel', 'parcel_tracking', 'route_sequence', 'from_location', 'to_location',
+                  'from_latitude', 'from_longitude', 'to_latitude', 'to_longitude', 'distance_km', 'status',
+                  'optimized', 'created_at']
+        read_only_fields = ['optimized']
+        select_related = ['parcel']
+        expandable = {'parcel': ParcelListSerializer}
+
+
+class DeliveryReviewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    reviewer_username = serializers.CharField(source='reviewer.username', read_only=True)
+    parcel_tracking = serializers.CharField(source='parcel.tracking_number', read_only=True)
+
+    class Meta:
+        model = DeliveryReview
+        fields = ['id', 'parcel', 'parcel_tracking', 'reviewer', 'reviewer_username', 'rating', 'title', 'comment',
+                  'delivery_speed_rating', 'packaging_quality_rating', 'communication_rating', 'would_recommend', 'created_at', 'updated_at']
+        select_related = ['reviewer', 'parcel']
+        expandable = {'parcel': ParcelListSerializer, 'reviewer': UserSerializer}
+
+
+class ParcelDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     department = DepartmentSerializer(read_only=True)
     status_history = ParcelStatusHistorySerializer(many=True, read_only=True)
     tracking_locations = TrackingLocationSerializer(many=True, read_only=True)
@@ -97,6 +146,28 @@ class ParcelDetailSerializer(serializers.ModelSerializer):
                   'current_location', 'latitude', 'longitude', 'created_at', 'delivered_at',
                   'updated_at', 'department', 'organization', 'status_history', 'tracking_locations',
                   'delivery_routes', 'review']
+        # Routes and tracking locations get their parcel back-reference from the prefetch itself
+        select_related = ['department__organization', 'review__reviewer']
+        expandable = {'organization': OrganizationSerializer}
+        prefetch_related = [
+            ('status_history', ParcelStatusHistorySerializer),
+            'tracking_locations',
+            'delivery_routes',
+        ]
+
+
+class ParcelTrajectoryDetailSerializer(ParcelDetailSerializer):
+    """Parcel detail with a simplified trajectory in place of every tracking location"""
+    trajectory = serializers.SerializerMethodField()
+
+    class Meta(ParcelDetailSerializer.Meta):
+        fields = [name for name in ParcelDetailSerializer.Meta.fields if name != 'tracking_locations'] + ['trajectory']
+        prefetch_related = [
+            entry for entry in ParcelDetailSerializer.Meta.prefetch_related if entry != 'tracking_locations'
+        ]
+
+    def get_trajectory(self, parcel):
+        return trajectory_payload(parcel.id, self.context['resolution'])
 
 
 class ParcelCreateUpdateSerializer(serializers.ModelSerializer):
@@ -113,6 +184,21 @@ class ParcelCreateUpdateSerializer(serializers.ModelSerializer):
         return value
 
 
+class ParcelBulkRowSerializer(serializers.ModelSerializer):
+    """Per-row validation for bulk ingestion.
+
+    Field-level checks only: tracking number uniqueness and foreign keys are
+    validated per chunk with set-based queries by ``api.bulk``.
+    """
+    organization = serializers.IntegerField()
+    department = serializers.IntegerField(required=False, allow_null=True)
+
+    class Meta:
+        model = Parcel
+        fields = ParcelCreateUpdateSerializer.Meta.fields
+        extra_kwargs = {'tracking_number': {'validators': []}}
+
+
 class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
@@ -0,0 +1,126 @@
+"""Model signal handlers that keep derived data in step with writes"""
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import events, notifications, search, user_index
+from .cache import parcel_detail_cache
+from .models import (
+    DeliveryReview, DeliveryRoute, Department, Notification, Organization, Parcel, ParcelDeliveryHistory,
+    ParcelStatusHistory, TrackingLocation
+)
+from .tenancy import membership_cache
+
+
+@receiver(post_save, sender=Parcel)
+@receiver(post_delete, sender=Parcel)
+def invalidate_parcel_detail(sender, instance, **kwargs):
+    parcel_detail_cache.invalidate(instance.pk, instance.tracking_number)
+
+
+@receiver(post_save, sender=ParcelStatusHistory)
+@receiver(post_delete, sender=ParcelStatusHistory)
+@receiver(post_save, sender=TrackingLocation)
+@receiver(post_delete, sender=TrackingLocation)
+@receiver(post_save, sender=DeliveryRoute)
+@receiver(post_delete, sender=DeliveryRoute)
+@receiver(post_save, sender=DeliveryReview)
+@receiver(post_delete, sender=DeliveryReview)
+def invalidate_parent_parcel_detail(sender, instance, **kwargs):
+    parcel_detail_cache.invalidate(instance.parcel_id)
+
+
+# Fields of related rows that cached parcel payloads render, and the parcels that render them
+EMBEDDED_FIELDS = {
+    Organization: (('name',), lambda instance: Q(organization=instance) | Q(department__organization=instance)),
+    Department: (('name', 'description', 'organization'), lambda instance: Q(department=instance)),
+    User: (('username',), lambda instance: Q(review__reviewer=instance) | Q(status_history__changed_by=instance)),
+}
+
+
+@receiver(pre_save, sender=Organization)
+@receiver(pre_save, sender=Department)
+@receiver(pre_save, sender=User)
+def detect_embedded_change(sender, instance, update_fields=None, **kwargs):
+    fields = EMBEDDED_FIELDS[sender][0]
+    instance._embedded_change = False
+    if instance.pk is None or (update_fields is not None and not set(fields) & set(update_fields)):
+        return
+    attnames = [sender._meta.get_field(field).attname for field in fields]
+    stored = sender.objects.filter(pk=instance.pk).values_list(*attnames).first()
+    instance._embedded_change = stored is not None and stored != tuple(getattr(instance, name) for name in attnames)
+
+
+@receiver(post_save, sender=Organization)
+@receiver(post_save, sender=Department)
+@receiver(post_save, sender=User)
+def invalidate_embedding_parcels(sender, instance, **kwargs):
+    # A rename reaches every cached payload that shows the name, e.g. a reviewer's username
+    if not getattr(instance, '_embedded_change', False):
+        return
+    parcel_ids = Parcel.objects.filter(EMBEDDED_FIELDS[sender][1](instance)).values_list('id', flat=True).distinct()
+    parcel_detail_cache.invalidate_many(parcel_ids.iterator())
+
+
+@receiver(post_save, sender=TrackingLocation)
+def publish_tracking_location(sender, instance, created, **kwargs):
+    if created:
+        events.publish_location(instance, instance.parcel.organization_id)
+
+
+@receiver(post_save, sender=ParcelStatusHistory)
+def publish_status_change(sender, instance, created, **kwargs):
+    if created:
+        parcel = instance.parcel
+        events.publish_status(
+            parcel.id, parcel.organization_id, parcel.tracking_number, instance.previous_status, instance.new_status
+        )
+
+
+@receiver(post_save, sender=Parcel)
+def sync_user_parcel_status(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and 'status' not in update_fields):
+        return
+    user_index.update_status([instance.pk], instance.status)
+
+
+@receiver(post_save, sender=ParcelDeliveryHistory)
+@receiver(post_delete, sender=ParcelDeliveryHistory)
+def sync_user_parcel_index(sender, instance, **kwargs):
+    user_index.sync_user_parcel(instance.user_id, instance.parcel_id)
+
+
+@receiver(post_save, sender=Parcel)
+@receiver(post_save, sender=DeliveryReview)
+def index_search_document(sender, instance, update_fields=None, **kwargs):
+    fields = search.DOCUMENTS[sender._meta.label_lower]['fields']
+    if update_fields is not None and not fields.keys() & set(update_fields):
+        return
+    search.index_instances([instance], using=instance._state.db)
+
+
+@receiver(post_delete, sender=Parcel)
+@receiver(post_delete, sender=DeliveryReview)
+def remove_search_document(sender, instance, **kwargs):
+    search.remove_instances(sender._meta.label_lower, [instance.pk], using=instance._state.db)
+
+
+@receiver(post_save, sender=Organization)
+@receiver(post_delete, sender=Organization)
+def invalidate_tenant_memberships(sender, instance, **kwargs):
+    # Admins can change hands, so drop every cached membership rather than one user's
+    membership_cache.clear()
+
+
+# Deletes are counted by NotificationViewSet; a post_delete receiver would stop cascades from fast-deleting
+@receiver(post_save, sender=Notification)
+def count_new_notification(sender, instance, created, **kwargs):
+    if created:
+        notifications.record_counts({instance.user_id: (0 if instance.is_read else 1, instance.pk)})
+
+
+# Runs inside the delete's transaction, before the cascade removes the parcel's notifications
+@receiver(pre_delete, sender=Parcel)
+def uncount_parcel_notifications(sender, instance, **kwargs):
+    notifications.record_deleted(Notification.objects.filter(parcel=instance))
@@ -0,0 +1,183 @@
+"""Organization parcel statistics.
+
+Counts are served from a per-organization ``OrganizationStatistics`` snapshot
+that is adjusted incrementally as parcels are created, updated, deleted or
+change status. A snapshot is (re)built from a single grouped aggregate query
+whenever it is missing or a refresh is requested.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDay, TruncWeek
+from django.utils import timezone
+
+from .models import Department, OrganizationStatistics, Parcel
+
+NO_DEPARTMENT = 'none'
+
+TIMELINE_BUCKETS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+}
+
+DEFAULT_TIMELINE_DAYS = 30
+
+
+def parcel_key(parcel):
+    """Return the (status, parcel_type, department) triple a parcel is counted under"""
+    department = str(parcel.department_id) if parcel.department_id else NO_DEPARTMENT
+    return parcel.status, parcel.parcel_type, department
+
+
+def _bump(counts, key, delta):
+    counts[key] = counts.get(key, 0) + delta
+    if counts[key] <= 0:
+        del counts[key]
+
+
+def recompute_organization_statistics(organization):
+    """Rebuild an organization's snapshot with one grouped aggregate query"""
+    rows = (
+        Parcel.objects.filter(organization=organization)
+        .order_by()
+        .values('status', 'parcel_type', 'department_id')
+        .annotate(count=Count('id'))
+    )
+    status_counts, type_counts, department_counts = {}, {}, {}
+    total = 0
+    for row in rows:
+        department = str(row['department_id']) if row['department_id'] else NO_DEPARTMENT
+        _bump(status_counts, row['status'], row['count'])
+        _bump(type_counts, row['parcel_type'], row['count'])
+        _bump(department_counts, department, row['count'])
+        total += row['count']
+
+    snapshot, _ = OrganizationStatistics.objects.update_or_create(
+        organization=organization,
+        defaults={
+            'total_parcels': total,
+            'status_counts': status_counts,
+            'type_counts': type_counts,
+            'department_counts': department_counts,
+            'computed_at': timezone.now(),
+        },
+    )
+    return snapshot
+
+
+def get_organization_statistics(organization, refresh=False):
+    """Return the organization's snapshot, computing it on first use"""
+    if not refresh:
+        snapshot = OrganizationStatistics.objects.filter(organization=organization).first()
+        if snapshot is not None:
+            return snapshot
+    return recompute_organization_statistics(organization)
+
+
+def apply_count_delta(organization_id, removed=None, added=None):
+    """Move one parcel between count buckets of an organization's snapshot.
+
+    ``removed`` and ``added`` are ``parcel_key`` triples (or None).
+    """
+    if removed == added:
+        return
+    apply_count_deltas(
+        organization_id,
+        removed=[removed] if removed else (),
+        added=[added] if added else (),
+    )
+
+
+def apply_count_deltas(organization_id, removed=(), added=()):
+    """Apply many ``parcel_key`` removals and additions in one snapshot update.
+
+    Nothing is done when no snapshot exists yet; it will be fully computed on
+    next read.
+    """
+    with transaction.atomic():
+        snapshot = (
+            OrganizationStatistics.objects.select_for_update()
+            .filter(organization_id=organization_id)
+            .first()
+        )
+        if snapshot is None:
+            return
+        changes = [(key, -1) for key in removed] + [(key, 1) for key in added]
+        for (status, parcel_type, department), delta in changes:
+            _bump(snapshot.status_counts, status, delta)
+            _bump(snapshot.type_counts, parcel_type, delta)
+            _bump(snapshot.department_counts, department, delta)
+            snapshot.total_parcels += delta
+        snapshot.save(update_fields=[
+            'total_parcels', 'status_counts', 'type_counts', 'department_counts', 'updated_at'
+        ])
+
+
+def record_parcel_created(parcel):
+    apply_count_delta(parcel.organization_id, added=parcel_key(parcel))
+
+
+def record_parcel_deleted(parcel):
+    apply_count_delta(parcel.organization_id, removed=parcel_key(parcel))
+
+
+def record_parcel_changed(organization_id, previous_key, parcel):
+    """Apply a change to an already-counted parcel, including moves between organizations"""
+    if organization_id != parcel.organization_id:
+        apply_count_delta(organization_id, removed=previous_key)
+        apply_count_delta(parcel.organization_id, added=parcel_key(parcel))
+    else:
+        apply_count_delta(organization_id, removed=previous_key, added=parcel_key(parcel))
+
+
+def build_timeline(organization, bucket='day', since=None, until=None):
+    """Per-period, per-status counts of parcels created in a bounded time window.
+
+    The window keeps the query on the (organization, -created_at) index
+    instead of scanning every parcel the organization has ever had.
+    """
+    trunc = TIMELINE_BUCKETS[bucket]
+    until = until or timezone.now()
+    since = since or until - timedelta(days=DEFAULT_TIMELINE_DAYS)
+    rows = (
+        Parcel.objects.filter(organization=organization, created_at__gte=since, created_at__lt=until)
+        .order_by()
+        .annotate(period=trunc('created_at'))
+        .values('period', 'status')
+        .annotate(count=Count('id'))
+        .order_by('period')
+    )
+    timeline = {}
+    for row in rows:
+        period = row['period'].date().isoformat()
+        entry = timeline.setdefault(period, {'period': period, 'total': 0})
+        entry[row['status']] = row['count']
+        entry['total'] += row['count']
+    return list(timeline.values())
+
+
+def format_statistics(snapshot):
+    """Shape a snapshot into the statistics endpoint payload"""
+    status_counts = snapshot.status_counts
+    department_names = dict(
+        Department.objects.filter(organization_id=snapshot.organization_id).values_list('id', 'name')
+    )
+    by_department = []
+    for key, count in snapshot.department_counts.items():
+        if key == NO_DEPARTMENT:
+            by_department.append({'department': None, 'department_name': None, 'count': count})
+        else:
+            by_department.append({
+                'department': int(key),
+                'department_name': department_names.get(int(key)),
+                'count': count,
+            })
+
+    stats = {'total_parcels': snapshot.total_parcels}
+    for value, _ in Parcel.STATUS_CHOICES:
+        stats[value] = status_counts.get(value, 0)
+    stats['by_type'] = {value: snapshot.type_counts.get(value, 0) for value, _ in Parcel.TYPE_CHOICES}
+    stats['by_department'] = by_department
+    stats['computed_at'] = snapshot.computed_at
+    return stats
@@ -0,0 +1,97 @@
+"""Server-Sent Events endpoint for live tracking updates.
+
+``GET /api/stream/?parcel=<id>`` or ``?organization=<id>`` streams new
+tracking locations and status changes as they are committed. Clients resume
+after a reconnect with the ``Last-Event-ID`` header (sent automatically by
+``EventSource``) or ``?last_event_id=``. The view is async, so it holds no
+worker thread while idle when served by an ASGI server (``parcel_config.asgi``);
+under WSGI the endless stream would pin a worker for good, so it answers 501.
+
+Like the API, the stream is scoped to the caller's organizations (session
+authentication): channels for other organizations' parcels answer 404.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+
+from .events import get_broker, organization_channel, parcel_channel
+from .models import Parcel
+from .tenancy import get_tenant
+
+HEARTBEAT_SECONDS = 15
+RETRY_MILLISECONDS = 3000
+
+
+def format_event(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+async def event_stream(broker, channels, last_event_id=None):
+    # Subscribe before replaying so nothing published in between is missed
+    subscription = broker.subscribe(channels)
+    try:
+        yield f'retry: {RETRY_MILLISECONDS}\n\n'
+        if last_event_id is not None:
+            for event in broker.replay(channels, last_event_id):
+                last_event_id = event['id']
+                yield format_event(event)
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            if last_event_id is not None and event['id'] <= last_event_id:
+                continue
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def _int_param(value):
+    return int(value) if value not in (None, '') else None
+
+
+def _visible(request, parcel_id, organization_id):
+    """Whether the caller may see the requested organization and parcel"""
+    tenant = get_tenant(request)
+    if organization_id is not None and not tenant.allows(organization_id):
+        return False
+    if parcel_id is None:
+        return True
+    parcel_organization_id = Parcel.objects.filter(pk=parcel_id).values_list('organization_id', flat=True).first()
+    return parcel_organization_id is not None and tenant.allows(parcel_organization_id)
+
+
+async def tracking_stream(request):
+    """Stream tracking events for one parcel and/or one organization"""
+    try:
+        parcel_id = _int_param(request.GET.get('parcel'))
+        organization_id = _int_param(request.GET.get('organization'))
+        last_event_id = _int_param(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id'))
+    except ValueError:
+        return JsonResponse({'error': 'parcel, organization and last_event_id must be integers'}, status=400)
+
+    channels = []
+    if parcel_id is not None:
+        channels.append(parcel_channel(parcel_id))
+    if organization_id is not None:
+        channels.append(organization_channel(organization_id))
+    if not channels:
+        return JsonResponse({'error': 'parcel or organization parameter required'}, status=400)
+    # Resolving the user and their organizations queries the database
+    if not await sync_to_async(_visible)(request, parcel_id, organization_id):
+        return JsonResponse({'error': 'Not found'}, status=404)
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'The tracking stream requires an ASGI server'}, status=501)
+
+    response = StreamingHttpResponse(
+        event_stream(get_broker(), channels, last_event_id),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
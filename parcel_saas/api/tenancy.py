@@ -0,0 +1,121 @@
+"""Per-request organization scoping.
+
+``TenantMiddleware`` attaches a ``Tenant`` to every request. Its organization
+ids are resolved on first use, after DRF authentication has set the user,
+and cached for the rest of the request. ``TenantScopedMixin`` restricts each
+viewset's queryset to them through the models' ``TenantManager``.
+
+Staff users are unrestricted, other users see the organizations they
+administer, and anonymous callers see none. Any caller can narrow the scope
+to one organization with the ``X-Organization`` header. Each user's
+organization ids are also kept in a short-lived per-process cache, cleared
+whenever an organization is saved or deleted, so cached reads stay free of
+queries.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.functional import cached_property
+from rest_framework.exceptions import PermissionDenied
+
+from .cache import LRUCache
+from .models import Organization
+
+ORGANIZATION_HEADER = 'HTTP_X_ORGANIZATION'
+
+# Users whose organization ids are cached, and for how long (seconds)
+MEMBERSHIP_CACHE_SIZE = 10000
+MEMBERSHIP_CACHE_TIMEOUT = 60
+
+membership_cache = LRUCache(MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TIMEOUT)
+
+
+def user_organization_ids(user):
+    organization_ids = membership_cache.get(user.pk)
+    if organization_ids is None:
+        organization_ids = frozenset(Organization.objects.filter(admin=user).values_list('id', flat=True))
+        membership_cache.set(user.pk, organization_ids)
+    return organization_ids
+
+
+class Tenant:
+
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def organization_ids(self):
+        """Visible organization ids, or None when the caller is unrestricted"""
+        user = getattr(self.request, 'user', None)
+        if user is None or not user.is_authenticated:
+            organization_ids = frozenset()
+        elif user.is_staff:
+            organization_ids = None
+        else:
+            organization_ids = user_organization_ids(user)
+
+        requested = self.request.META.get(ORGANIZATION_HEADER)
+        if not requested:
+            return organization_ids
+        try:
+            requested = int(requested)
+        except ValueError:
+            return frozenset()
+        if organization_ids is None or requested in organization_ids:
+            return frozenset({requested})
+        return frozenset()
+
+    def allows(self, organization_id):
+        return self.organization_ids is None or organization_id in self.organization_ids
+
+
+def get_tenant(request):
+    """The request's ``Tenant``, created on demand when the middleware is not installed"""
+    request = getattr(request, '_request', request)
+    tenant = getattr(request, 'tenant', None)
+    if tenant is None:
+        tenant = request.tenant = Tenant(request)
+    return tenant
+
+
+class TenantMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        # Resolving the tenant is lazy, so attaching it needs no database access in either mode
+        request.tenant = Tenant(request)
+        return self.get_response(request)
+
+
+class TenantScopedMixin:
+    """Restrict the viewset's queryset to the caller's organizations and reject writes outside them"""
+
+    @property
+    def tenant(self):
+        return get_tenant(self.request)
+
+    def get_queryset(self):
+        return super().get_queryset().for_tenant(self.tenant)
+
+    def check_tenant(self, serializer):
+        """Raise PermissionDenied if the validated data belongs to another organization"""
+        data = serializer.validated_data
+        organization_ids = {
+            related.pk if field == 'organization' else related.organization_id
+            for field in ('organization', 'department', 'parcel')
+            if (related := data.get(field)) is not None
+        }
+        if not all(self.tenant.allows(organization_id) for organization_id in organization_ids):
+            raise PermissionDenied('You do not have access to this organization.')
+
+    def perform_create(self, serializer):
+        self.check_tenant(serializer)
+        serializer.save()
+
+    def perform_update(self, serializer):
+        self.check_tenant(serializer)
+        serializer.save()
@@ -1,3 +1,1514 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from . import benchmark, export, notifications, rollups, transitions
+from .cache import parcel_detail_cache
+from .profiling import histogram_quantile, registry
+from .geo import geohash_encode
+from .optimizer import distance_matrix, optimize_tour
+from .rows import values_rows
+from .search import DOCUMENTS
+from .serializers import ParcelDetailSerializer, ParcelListSerializer
+from .routing import haversine_km_array
+from .trajectory import douglas_peucker
+from .ingestion import get_position_buffer
+from .events import InProcessBroker, parcel_channel
+from .models import (
+    Organization, Department, Parcel, ParcelStatusHistory, ParcelDeliveryHistory, DeliveryReview, TrackingLocation,
+    DeliveryRoute, Notification, UserParcel, DailyMetrics, ReviewAggregate, NotificationJob, NotificationCounter
+)
+from .streaming import event_stream
+from .tenancy import membership_cache
+
+# Upper bound on queries for a parcel detail, independent of history length
+PARCEL_DETAIL_QUERY_BUDGET = 5
+
+# Upper bound on queries for a page of my_parcels, independent of page size
+MY_PARCELS_QUERY_BUDGET = 2
+
+
+class ParcelAPITestCase(APITestCase):
+    """Shared fixtures for API tests"""
+
+    def setUp(self):
+        parcel_detail_cache.clear()
+        membership_cache.clear()
+        self.user = User.objects.create_user(username='courier', password='secret')
+        self.client.force_authenticate(self.user)
+        self.organization = Organization.objects.create(name='Acme', admin=self.user)
+        self.department = Department.objects.create(organization=self.organization, name='Mailroom')
+
+    def make_parcel(self, tracking_number, **kwargs):
+        kwargs.setdefault('organization', self.organization)
+        kwargs.setdefault('department', self.department)
+        kwargs.setdefault('sender_name', 'Sender')
+        kwargs.setdefault('receiver_name', 'Receiver')
+        return Parcel.objects.create(tracking_number=tracking_number, **kwargs)
+
+    def assertWithinQueryBudget(self, budget, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = func(*args, **kwargs)
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{len(queries)} queries exceeds budget of {budget}:\n'
+            + '\n'.join(query['sql'] for query in queries.captured_queries)
+        )
+        return response
+
+
+class OrganizationStatisticsTests(ParcelAPITestCase):
+
+    def statistics_url(self):
+        return f'/api/organizations/{self.organization.id}/statistics/'
+
+    def test_statistics_counts_by_status_and_type(self):
+        self.make_parcel('T1')
+        self.make_parcel('T2', status='delivered', parcel_type='letter')
+        self.make_parcel('T3', department=None)
+
+        response = self.client.get(self.statistics_url())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_parcels'], 3)
+        self.assertEqual(response.data['pending'], 2)
+        self.assertEqual(response.data['delivered'], 1)
+        self.assertEqual(response.data['by_type']['letter'], 1)
+        by_department = {row['department']: row['count'] for row in response.data['by_department']}
+        self.assertEqual(by_department, {self.department.id: 2, None: 1})
+
+    def test_snapshot_is_updated_incrementally(self):
+        parcel = self.make_parcel('T1')
+        self.client.get(self.statistics_url())
+
+        self.client.post(f'/api/parcels/{parcel.id}/update_status/', {'status': 'in_transit'})
+        self.client.post('/api/parcels/', {
+            'tracking_number': 'T2', 'sender_name': 'S', 'receiver_name': 'R',
+            'organization': self.organization.id,
+        })
+
+        with self.assertNumQueries(3):
+            response = self.client.get(self.statistics_url())
+        self.assertEqual(response.data['total_parcels'], 2)
+        self.assertEqual(response.data['pending'], 1)
+        self.assertEqual(response.data['in_transit'], 1)
+
+        self.client.delete(f'/api/parcels/{parcel.id}/')
+        response = self.client.get(self.statistics_url())
+        self.assertEqual(response.data['total_parcels'], 1)
+        self.assertEqual(response.data['in_transit'], 0)
+
+    def test_timeline_buckets(self):
+        self.make_parcel('T1')
+        self.make_parcel('T2', status='delivered')
+
+        response = self.client.get(self.statistics_url(), {'bucket': 'day'})
+
+        self.assertEqual(len(response.data['timeline']), 1)
+        self.assertEqual(response.data['timeline'][0]['total'], 2)
+        self.assertEqual(response.data['timeline'][0]['delivered'], 1)
+        self.assertEqual(self.client.get(self.statistics_url(), {'bucket': 'year'}).status_code, 400)
+
+    def test_timeline_accepts_dates_and_rejects_invalid_bounds(self):
+        self.make_parcel('T1')
+        today = timezone.localdate()
+        timeline = self.client.get(self.statistics_url(), {'bucket': 'day', 'from': today.isoformat(),
+                                                           'to': today.isoformat()}).data['timeline']
+        self.assertEqual(timeline[0]['total'], 1)
+        yesterday = (today - timedelta(days=1)).isoformat()
+        response = self.client.get(self.statistics_url(), {'bucket': 'day', 'from': '2020-01-01', 'to': yesterday})
+        self.assertEqual(response.data['timeline'], [])
+
+        for bounds in ({'from': 'soon'}, {'to': '2020-13-01'}, {'from': '2020-01-01T25:00'}):
+            response = self.client.get(self.statistics_url(), {'bucket': 'day', **bounds})
+            self.assertEqual(response.status_code, 400)
+
+
+class ParcelDetailQueryBudgetTests(ParcelAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.parcel = self.make_parcel('BUDGET1')
+        for index in range(25):
+            ParcelStatusHistory.objects.create(
+                parcel=self.parcel, previous_status='pending', new_status='in_transit', changed_by=self.user
+            )
+            TrackingLocation.objects.create(
+                parcel=self.parcel, latitude=1.0, longitude=2.0, location_name=f'Hub {index}', status='in_transit'
+            )
+            DeliveryRoute.objects.create(
+                parcel=self.parcel, route_sequence=index, from_location='A', to_location='B',
+                from_latitude=0, from_longitude=0, to_latitude=1, to_longitude=1
+            )
+        DeliveryReview.objects.create(
+            parcel=self.parcel, reviewer=self.user, rating=5, title='Great', comment='Fast',
+            delivery_speed_rating=5, packaging_quality_rating=5, communication_rating=5
+        )
+
+    def test_retrieve_within_budget(self):
+        response = self.assertWithinQueryBudget(
+            PARCEL_DETAIL_QUERY_BUDGET, self.client.get, f'/api/parcels/{self.parcel.id}/'
+        )
+        self.assertEqual(len(response.data['status_history']), 25)
+        self.assertEqual(response.data['status_history'][0]['changed_by_username'], 'courier')
+        self.assertEqual(response.data['delivery_routes'][0]['parcel_tracking'], 'BUDGET1')
+        self.assertEqual(response.data['review']['parcel_tracking'], 'BUDGET1')
+        self.assertEqual(response.data['department']['organization_name'], 'Acme')
+
+    def test_search_by_barcode_within_budget(self):
+        response = self.assertWithinQueryBudget(
+            PARCEL_DETAIL_QUERY_BUDGET, self.client.get,
+            '/api/parcels/search_by_barcode/', {'tracking_number': 'BUDGET1'}
+        )
+        self.assertEqual(len(response.data['tracking_locations']), 25)
+
+
+class KeysetPaginationTests(ParcelAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        for index in range(7):
+            self.make_parcel(f'PAGE{index}')
+
+    def test_cursor_pages_cover_every_parcel_without_count(self):
+        seen = []
+        url = '/api/parcels/?page_size=3'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+            self.assertNotIn('count', response.data)
+            seen.extend(row['tracking_number'] for row in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(sorted(seen), [f'PAGE{index}' for index in range(7)])
+
+    def test_page_number_mode_with_estimated_count(self):
+        response = self.client.get('/api/parcels/', {'page': 2, 'page_size': 3, 'count': 'estimate'})
+
+        self.assertEqual(response.data['count'], 7)
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIsNotNone(response.data['next'])
+
+        response = self.client.get('/api/parcels/', {'page': 1})
+        self.assertEqual(response.data['count'], 7)
+
+
+class BulkParcelIngestionTests(ParcelAPITestCase):
+    url = '/api/parcels/bulk/'
+
+    def row(self, tracking_number, **kwargs):
+        return {
+            'tracking_number': tracking_number, 'sender_name': 'S', 'receiver_name': 'R',
+            'organization': self.organization.id, **kwargs
+        }
+
+    def test_json_array_reports_row_errors_without_aborting(self):
+        self.make_parcel('EXISTS')
+        rows = [
+            self.row('B1', department=self.department.id),
+            self.row('EXISTS'),
+            self.row('B2', status='bogus'),
+            self.row('B1'),
+            self.row('B3', organization=999),
+            self.row('B4'),
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'{self.url}?batch_size=2', rows, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['row'] for error in response.data['errors']], [1, 2, 3, 4])
+        # Includes creating each chunk's first daily metrics row (update miss, then insert in a savepoint)
+        self.assertLess(len(queries), 30)
+        self.assertEqual(Parcel.objects.get(tracking_number='B1').department, self.department)
+
+    def test_ndjson_and_csv_streams(self):
+        ndjson = '\n'.join(json.dumps(self.row(f'N{index}')) for index in range(3))
+        response = self.client.post(self.url, ndjson, content_type='application/x-ndjson')
+        self.assertEqual(response.data['created'], 3)
+
+        csv_body = f'tracking_number,sender_name,receiver_name,organization,weight\n' \
+                   f'C1,S,R,{self.organization.id},1.50\nC2,S,R,{self.organization.id},\n'
+        response = self.client.post(self.url, csv_body, content_type='text/csv')
+        self.assertEqual(response.data['created'], 2)
+        self.assertIsNone(Parcel.objects.get(tracking_number='C2').weight)
+
+    def test_unparseable_ndjson_lines_are_row_errors(self):
+        lines = [json.dumps(self.row(f'N{index}')) for index in range(3)]
+        lines[2:2] = ['', '{"tracking_number": ']
+        response = self.client.post(
+            f'{self.url}?batch_size=2', '\n'.join(lines), content_type='application/x-ndjson'
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['received'], response.data['created']), (4, 3))
+        self.assertEqual(response.data['errors'][0]['row'], 2)
+        self.assertIn('line 4', response.data['errors'][0]['errors']['non_field_errors'][0])
+        self.assertEqual(Parcel.objects.count(), 3)
+
+    def test_rejects_bodies_that_are_not_a_list_of_rows(self):
+        for body in (123, 'B1', None, {'tracking_number': 'B1'}, {'parcels': 'B1'}):
+            response = self.client.post(self.url, json.dumps(body), content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Parcel.objects.exists())
+
+        response = self.client.post(self.url, {'parcels': [self.row('B1')]}, format='json')
+        self.assertEqual(response.data['created'], 1)
+
+
+class BulkStatusTransitionTests(ParcelAPITestCase):
+    url = '/api/parcels/bulk_update_status/'
+
+    def test_transitions_in_bulk(self):
+        for index in range(4):
+            self.make_parcel(f'S{index}', status='in_transit' if index % 2 else 'pending')
+        self.make_parcel('DONE', status='delivered')
+        self.client.get(f'/api/organizations/{self.organization.id}/statistics/')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {
+                'tracking_numbers': ['S0', 'S1', 'S2', 'S3', 'DONE', 'MISSING'], 'status': 'delivered',
+            }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'updated': 4, 'unchanged': ['DONE'], 'not_found': ['MISSING']})
+        # Includes creating the day's delivered metrics row (update miss, then insert in a savepoint)
+        self.assertLess(len(queries), 17)
+        self.assertEqual(Parcel.objects.filter(status='delivered', delivered_at__isnull=False).count(), 4)
+        self.assertEqual(ParcelStatusHistory.objects.count(), 4)
+        self.assertEqual(NotificationJob.objects.count(), 4)
+        self.assertEqual(self.user.notifications.count(), 0)
+        notifications.drain(coalesce_seconds=0)
+        self.assertEqual(self.user.notifications.count(), 4)
+        statistics = self.client.get(f'/api/organizations/{self.organization.id}/statistics/').data
+        self.assertEqual(statistics['delivered'], 5)
+        self.assertEqual(statistics['pending'], 0)
+
+    def test_rejects_invalid_status(self):
+        response = self.client.post(self.url, {'ids': [1], 'status': 'bogus'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_malformed_selections(self):
+        parcel = self.make_parcel('S0')
+        for data in ({'ids': ['x']}, {'ids': [None]}, {'ids': [parcel.id], 'tracking_numbers': ['S0']}):
+            response = self.client.post(self.url, {**data, 'status': 'delivered'}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Parcel.objects.get(pk=parcel.pk).status, 'pending')
+
+    @mock.patch.object(transitions, 'TRANSITION_CHUNK_SIZE', 2)
+    def test_selects_tracking_numbers_in_chunks(self):
+        for index in range(5):
+            self.make_parcel(f'S{index}')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {
+                'tracking_numbers': [f'S{index}' for index in range(5)], 'status': 'delivered',
+            }, format='json')
+        self.assertEqual(response.data['updated'], 5)
+        selects = [query for query in queries if '"tracking_number" IN' in query['sql']]
+        self.assertEqual(len(selects), 3)
+
+
+class BarcodeCacheTests(ParcelAPITestCase):
+    url = '/api/parcels/search_by_barcode/'
+
+    def setUp(self):
+        super().setUp()
+        self.parcel = self.make_parcel('SCAN1')
+
+    def test_repeat_scans_are_served_from_cache(self):
+        self.client.get(self.url, {'tracking_number': 'SCAN1'})
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {'tracking_number': 'SCAN1'})
+        self.assertEqual(response.data['tracking_number'], 'SCAN1')
+        stats = self.client.get('/api/parcels/barcode_cache_stats/').data
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_writes_invalidate_cached_payload(self):
+        self.client.get(self.url, {'tracking_number': 'SCAN1'})
+        self.client.post(f'/api/parcels/{self.parcel.id}/update_status/', {'status': 'in_transit'})
+        response = self.client.get(self.url, {'tracking_number': 'SCAN1'})
+        self.assertEqual(response.data['status'], 'in_transit')
+
+        TrackingLocation.objects.create(
+            parcel=self.parcel, latitude=1, longitude=1, location_name='Hub', status='in_transit'
+        )
+        response = self.client.get(self.url, {'tracking_number': 'SCAN1'})
+        self.assertEqual(len(response.data['tracking_locations']), 1)
+
+    def test_payload_built_across_an_invalidation_is_not_stored(self):
+        shared = {'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                  'PARCEL_DETAIL_CACHE': {'BACKEND': 'default'}}
+        for overrides in ({}, shared):
+            with self.subTest(shared=bool(overrides)), self.settings(**overrides):
+                parcel_detail_cache.clear()
+                self.assertEqual(parcel_detail_cache.local.timeout, 5)
+                other = self.make_parcel(f'OTHER-{len(overrides)}')
+                # Parcel id not seen yet: any invalidation blocks the store
+                token = parcel_detail_cache.begin('SCAN1')
+                parcel_detail_cache.invalidate(other.id)
+                parcel_detail_cache.set('SCAN1', self.parcel.id, {'stale': True}, token)
+                self.assertIsNone(parcel_detail_cache.get('SCAN1'))
+
+                # Known parcel id: only its own invalidations do
+                token = parcel_detail_cache.begin('SCAN1')
+                parcel_detail_cache.invalidate(other.id)
+                parcel_detail_cache.set('SCAN1', self.parcel.id, {'fresh': True}, token)
+                self.assertEqual(parcel_detail_cache.get('SCAN1'), {'fresh': True})
+                token = parcel_detail_cache.begin('SCAN1')
+                parcel_detail_cache.invalidate(self.parcel.id)
+                parcel_detail_cache.set('SCAN1', self.parcel.id, {'stale': True}, token)
+                self.assertIsNone(parcel_detail_cache.get('SCAN1'))
+                self.assertEqual(parcel_detail_cache.stats()['discarded'], 2)
+        parcel_detail_cache.clear()
+
+    def test_renames_invalidate_cached_payload(self):
+        self.client.post(f'/api/parcels/{self.parcel.id}/update_status/', {'status': 'in_transit'})
+        self.client.get(self.url, {'tracking_number': 'SCAN1'})
+        self.user.email = 'courier@example.com'
+        self.user.save()
+        self.department.save()
+        with self.assertNumQueries(0):
+            self.client.get(self.url, {'tracking_number': 'SCAN1'})
+
+        renames = [
+            (self.department, 'name', 'Loading dock', lambda payload: payload['department']['name']),
+            (self.organization, 'name', 'Acme Logistics', lambda payload: payload['department']['organization_name']),
+            (self.user, 'username', 'driver', lambda payload: payload['status_history'][0]['changed_by_username']),
+        ]
+        for instance, field, value, rendered in renames:
+            setattr(instance, field, value)
+            instance.save(update_fields=[field])
+            self.assertEqual(rendered(self.client.get(self.url, {'tracking_number': 'SCAN1'}).data), value)
+
+        self.client.post('/api/parcels/bulk_update_status/', {'ids': [self.parcel.id], 'status': 'lost'}, format='json')
+        response = self.client.get(self.url, {'tracking_number': 'SCAN1'})
+        self.assertEqual(response.data['status'], 'lost')
+
+        self.client.patch(f'/api/parcels/{self.parcel.id}/', {'tracking_number': 'SCAN2'})
+        response = self.client.get(self.url, {'tracking_number': 'SCAN1'})
+        self.assertEqual(response.status_code, 404)
+
+
+class TrackingStreamTests(SimpleTestCase):
+
+    async def test_stream_replays_then_pushes_new_events(self):
+        broker = InProcessBroker()
+        channels = [parcel_channel(1)]
+        first = broker.publish(channels, 'status', {'new_status': 'received'})
+        broker.publish([parcel_channel(2)], 'status', {'new_status': 'lost'})
+        broker.publish(channels, 'status', {'new_status': 'in_transit'})
+
+        stream = event_stream(broker, channels, last_event_id=first['id'])
+        self.assertTrue((await anext(stream)).startswith('retry:'))
+        self.assertIn('"new_status": "in_transit"', await anext(stream))
+
+        # Publishers run in sync worker threads
+        thread = threading.Thread(target=broker.publish, args=(channels, 'location', {'location_name': 'Hub'}))
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        thread.start()
+        message = await asyncio.wait_for(pending, 1)
+        self.assertIn('event: location', message)
+        await stream.aclose()
+        self.assertFalse(broker._subscriptions)
+
+    def test_requires_a_channel(self):
+        self.assertEqual(self.client.get('/api/stream/').status_code, 400)
+        self.assertEqual(self.client.get('/api/stream/', {'parcel': 'x'}).status_code, 400)
+
+
+class TrackingStreamScopeTests(ParcelAPITestCase):
+    url = '/api/stream/'
+
+    def test_stream_is_scoped_to_the_callers_organizations(self):
+        other = Organization.objects.create(name='Other', admin=User.objects.create_user(username='other'))
+        foreign = self.make_parcel('FOREIGN', organization=other, department=None)
+        own = self.make_parcel('OWN')
+        self.client.force_login(self.user)
+        for params in ({'organization': other.id}, {'parcel': foreign.id}, {'parcel': 999999},
+                       {'parcel': own.id, 'organization': other.id}):
+            self.assertEqual(self.client.get(self.url, params).status_code, 404, params)
+        # WSGI workers cannot hold the endless stream
+        self.assertEqual(self.client.get(self.url, {'parcel': own.id}).status_code, 501)
+        self.async_client.force_login(self.user)
+        response = async_to_sync(self.async_client.get)(self.url, {'parcel': own.id})
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url, {'organization': self.organization.id}).status_code, 404)
+
+
+@override_settings(PARCEL_GPS_INGEST={'FLUSH_SIZE': 3, 'FLUSH_THREAD': False})
+class GPSIngestionTests(ParcelAPITestCase):
+    url = '/api/tracking-locations/ingest/'
+
+    def setUp(self):
+        super().setUp()
+        self.parcel = self.make_parcel('GPS1')
+
+    def position(self, latitude, longitude, seconds):
+        return {
+            'parcel': self.parcel.id, 'latitude': latitude, 'longitude': longitude,
+            'timestamp': f'2026-01-01T10:00:{seconds:02d}Z',
+        }
+
+    def test_positions_are_coalesced_and_flushed_in_bulk(self):
+        response = self.client.post(self.url, {'device': 'd1', 'positions': [
+            self.position(51.5000, -0.1000, 0),
+            self.position(51.5000, -0.1001, 5),
+            self.position(51.6000, -0.1000, 10),
+            {**self.position(0, 0, 0), 'parcel': 999},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data, {'accepted': 2, 'dropped': 1, 'unknown_parcels': [999]})
+        self.assertEqual(TrackingLocation.objects.count(), 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, [{'device': 'd1', 'positions': [self.position(51.7, -0.1, 20)]}], format='json')
+        self.assertLessEqual(len(queries), 6)
+
+        self.assertEqual(TrackingLocation.objects.filter(parcel=self.parcel).count(), 3)
+        self.parcel.refresh_from_db()
+        self.assertEqual((self.parcel.latitude, self.parcel.longitude), (51.7, -0.1))
+        self.assertEqual(get_position_buffer().pending(), 0)
+
+    def test_rejects_invalid_reports(self):
+        response = self.client.post(self.url, {'device': 'd1', 'positions': [{'parcel': 1, 'latitude': 100}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class SpatialQueryTests(ParcelAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.depot = self.make_parcel('DEPOT', latitude=51.5074, longitude=-0.1278)
+        self.nearby = self.make_parcel('NEAR', latitude=51.5155, longitude=-0.1420)
+        self.far = self.make_parcel('FAR', latitude=53.4808, longitude=-2.2426)
+        self.unlocated = self.make_parcel('NOWHERE')
+
+    def tracking_numbers(self, response):
+        return sorted(row['tracking_number'] for row in response.data['results'])
+
+    def test_geohash_is_maintained_on_save(self):
+        self.assertEqual(self.depot.geohash, geohash_encode(51.5074, -0.1278))
+        self.assertEqual(geohash_encode(57.64911, 10.40744, 6), 'u4pruy')
+        self.assertIsNone(self.unlocated.geohash)
+
+        self.unlocated.latitude, self.unlocated.longitude = 53.4808, -2.2426
+        self.unlocated.save(update_fields=['latitude', 'longitude'])
+        self.unlocated.refresh_from_db()
+        self.assertEqual(self.unlocated.geohash, geohash_encode(53.4808, -2.2426))
+
+    def test_near_and_bbox_filters(self):
+        response = self.client.get('/api/parcels/', {'near': '51.5074,-0.1278', 'radius_km': 2})
+        self.assertEqual(self.tracking_numbers(response), ['DEPOT', 'NEAR'])
+
+        response = self.client.get('/api/parcels/', {'within_bbox': '53,-3,54,-2'})
+        self.assertEqual(self.tracking_numbers(response), ['FAR'])
+
+        response = self.client.get('/api/parcels/', {'near': 'north'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_tracking_location_near_filter(self):
+        TrackingLocation.objects.create(parcel=self.far, latitude=51.51, longitude=-0.13, location_name='London', status='x')
+        TrackingLocation.objects.create(parcel=self.far, latitude=53.48, longitude=-2.24, location_name='Leeds', status='x')
+        response = self.client.get('/api/tracking-locations/', {'near': '51.5074,-0.1278', 'radius_km': 5})
+        self.assertEqual([row['location_name'] for row in response.data['results']], ['London'])
+
+
+class TrajectoryTests(ParcelAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.parcel = self.make_parcel('TRAJ1')
+        start = timezone.now() - timedelta(hours=2)
+        # A straight 200-point leg north, then a right-angle turn east
+        for index in range(200):
+            TrackingLocation.objects.create(
+                parcel=self.parcel, latitude=51.0 + index * 0.001, longitude=0.0,
+                location_name='leg', status='in_transit', timestamp=start + timedelta(seconds=index * 30)
+            )
+        TrackingLocation.objects.create(
+            parcel=self.parcel, latitude=51.199, longitude=0.1, location_name='turn', status='in_transit',
+            timestamp=start + timedelta(seconds=200 * 30)
+        )
+
+    def test_douglas_peucker_keeps_corners(self):
+        points = [(0.0, 0.0), (0.0, 0.0005), (0.0, 0.001), (0.001, 0.001)]
+        self.assertEqual(douglas_peucker(points, 10), [(0.0, 0.0), (0.0, 0.001), (0.001, 0.001)])
+
+    def test_detail_serves_simplified_trajectory(self):
+        response = self.client.get(f'/api/parcels/{self.parcel.id}/', {'resolution': 'medium'})
+
+        self.assertNotIn('tracking_locations', response.data)
+        self.assertEqual(response.data['trajectory']['source_count'], 201)
+        self.assertEqual(len(response.data['trajectory']['points']), 3)
+        self.assertEqual(self.client.get(f'/api/parcels/{self.parcel.id}/', {'resolution': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/parcels/', {'resolution': 'x'}).status_code, 200)
+
+    def test_stored_trajectory_refreshes_when_points_change(self):
+        url = f'/api/parcels/{self.parcel.id}/trajectory/'
+        self.assertEqual(len(self.client.get(url).data['points']), 3)
+        TrackingLocation.objects.create(
+            parcel=self.parcel, latitude=52.0, longitude=0.1, location_name='end', status='delivered'
+        )
+        self.assertEqual(len(self.client.get(url).data['points']), 4)
+
+        response = self.client.get(url, {'bucket_seconds': 3600})
+        self.assertEqual(response.data['source_count'], 202)
+        self.assertLessEqual(len(response.data['points']), 5)
+
+
+class RouteMetricsTests(ParcelAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.parcel = self.make_parcel('ROUTE1')
+        # London -> Oxford -> Birmingham
+        self.legs = [
+            (51.5074, -0.1278, 51.7520, -1.2577, 'completed'),
+            (51.7520, -1.2577, 52.4862, -1.8904, 'in_progress'),
+        ]
+
+    def create_legs(self, parcel):
+        for sequence, (from_lat, from_lon, to_lat, to_lon, leg_status) in enumerate(self.legs, start=1):
+            response = self.client.post('/api/delivery-routes/', {
+                'parcel': parcel.id, 'route_sequence': sequence, 'from_location': 'A', 'to_location': 'B',
+                'from_latitude': from_lat, 'from_longitude': from_lon, 'to_latitude': to_lat,
+                'to_longitude': to_lon, 'status': leg_status,
+            })
+            self.assertEqual(response.status_code, 201)
+
+    def test_vectorized_haversine(self):
+        distances = haversine_km_array([51.5074, 0], [-0.1278, 0], [48.8566, 0], [2.3522, 1])
+        self.assertAlmostEqual(distances[0], 343.5, delta=1)
+        self.assertAlmostEqual(distances[1], 111.2, delta=0.5)
+
+    def test_distance_filled_on_create_and_metrics(self):
+        self.create_legs(self.parcel)
+        first_leg = DeliveryRoute.objects.get(parcel=self.parcel, route_sequence=1).distance_km
+        self.assertAlmostEqual(first_leg, Decimal('82.6'), delta=Decimal('0.5'))
+
+        response = self.client.get(f'/api/parcels/{self.parcel.id}/route_metrics/')
+        self.assertEqual(response.data['completed_legs'], 1)
+        self.assertAlmostEqual(
+            response.data['total_distance_km'] - response.data['remaining_distance_km'], float(first_leg), delta=0.01
+        )
+        self.assertIsNotNone(response.data['eta'])
+
+        TrackingLocation.objects.create(
+            parcel=self.parcel, latitude=52.4862, longitude=-1.8904, location_name='Birmingham', status='x'
+        )
+        response = self.client.get(f'/api/parcels/{self.parcel.id}/route_metrics/')
+        self.assertEqual(response.data['remaining_distance_km'], 0)
+        self.assertIsNone(response.data['eta'])
+
+    def test_batch_recompute(self):
+        other = self.make_parcel('ROUTE2')
+        self.create_legs(self.parcel)
+        self.create_legs(other)
+        DeliveryRoute.objects.update(distance_km=None)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/delivery-routes/recompute/', {'organization': self.organization.id}, format='json'
+            )
+        self.assertLessEqual(len(queries), 5)
+        self.assertEqual(response.data['parcels'], 2)
+        self.assertFalse(DeliveryRoute.objects.filter(distance_km__isnull=True).exists())
+
+    def test_recompute_invalidates_cached_parcels(self):
+        self.create_legs(self.parcel)
+        DeliveryRoute.objects.update(distance_km=None)
+        url = '/api/parcels/search_by_barcode/'
+        cached = self.client.get(url, {'tracking_number': 'ROUTE1'}).data
+        self.assertIsNone(cached['delivery_routes'][0]['distance_km'])
+
+        self.client.post('/api/delivery-routes/recompute/', {'parcels': [self.parcel.id]}, format='json')
+        response = self.client.get(url, {'tracking_number': 'ROUTE1'})
+        self.assertIsNotNone(response.data['delivery_routes'][0]['distance_km'])
+
+    def test_recompute_rejects_parcels_that_are_not_a_list(self):
+        for parcels in ('123', 123, {'id': 1}):
+            response = self.client.post('/api/delivery-routes/recompute/', {'parcels': parcels}, format='json')
+            self.assertEqual(response.status_code, 400)
+
+
+class RouteOptimizerTests(ParcelAPITestCase):
+
+    def test_tour_visits_points_along_a_line_in_order(self):
+        # Depot at 0, stops shuffled along one meridian
+        latitudes = [0.0, 0.4, 0.1, 0.3, 0.5, 0.2]
+        matrix = distance_matrix(latitudes, [0.0] * len(latitudes))
+        order, initial, final, _ = optimize_tour(matrix, return_to_depot=False)
+        self.assertEqual([latitudes[node] for node in order], [0.1, 0.2, 0.3, 0.4, 0.5])
+        self.assertLessEqual(final, initial)
+
+    def test_improvement_beats_nearest_neighbour(self):
+        rng = random.Random(7)
+        latitudes = [rng.uniform(51, 52) for _ in range(60)]
+        longitudes = [rng.uniform(-1, 0) for _ in range(60)]
+        order, initial, final, passes = optimize_tour(distance_matrix(latitudes, longitudes), time_budget_ms=5000)
+        self.assertEqual(sorted(order), list(range(1, 60)))
+        self.assertLess(final, initial)
+        self.assertGreaterEqual(passes, 1)
+
+    def test_time_budget_is_kept_within_a_pass(self):
+        rng = random.Random(7)
+        latitudes = [rng.uniform(51, 52) for _ in range(1001)]
+        longitudes = [rng.uniform(-1, 0) for _ in range(1001)]
+        matrix = distance_matrix(latitudes, longitudes)
+        start = time.monotonic()
+        order, initial, final, _ = optimize_tour(matrix, time_budget_ms=20)
+        # One full 2-opt and Or-opt pass over 1000 stops takes several times longer
+        self.assertLess(time.monotonic() - start, 0.15)
+        self.assertEqual(sorted(order), list(range(1, 1001)))
+        self.assertLessEqual(final, initial)
+
+    def test_optimize_writes_route_legs(self):
+        for index, latitude in enumerate([51.6, 51.2, 51.4]):
+            self.make_parcel(f'OPT{index}', latitude=latitude, longitude=0.0, receiver_address=f'Stop {index}')
+        self.make_parcel('OPTX', latitude=51.3, longitude=0.0, status='delivered')
+        self.make_parcel('OPTY')
+
+        response = self.client.post('/api/delivery-routes/optimize/', {
+            'department': self.department.id, 'depot_latitude': 51.0, 'depot_longitude': 0.0,
+            'depot_name': 'Hub', 'return_to_depot': False,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([stop['tracking_number'] for stop in response.data['stops']], ['OPT1', 'OPT2', 'OPT0'])
+        self.assertEqual(response.data['unlocated_parcels'], 1)
+        self.assertEqual(response.data['routes_created'], 3)
+
+        legs = list(DeliveryRoute.objects.order_by('route_sequence'))
+        self.assertEqual([leg.from_location for leg in legs], ['Hub', 'Stop 1', 'Stop 2'])
+        self.assertAlmostEqual(float(sum(leg.distance_km for leg in legs)), 66.7, delta=0.5)
+
+    def test_optimize_replaces_pending_legs(self):
+        parcels = [self.make_parcel(f'OPT{index}', latitude=latitude, longitude=0.0)
+                   for index, latitude in enumerate([51.6, 51.2])]
+        leg = {'route_sequence': 1, 'from_location': 'A', 'to_location': 'B', 'from_latitude': 50.0,
+               'from_longitude': 0.0, 'to_latitude': 50.5, 'to_longitude': 0.0}
+        done = DeliveryRoute.objects.create(parcel=parcels[0], status='completed', **leg)
+        manual = DeliveryRoute.objects.create(parcel=parcels[1], **leg)
+        data = {'organization': self.organization.id, 'depot_latitude': 51.0, 'depot_longitude': 0.0}
+        for depot_name in ('Hub', 'Second hub'):
+            response = self.client.post('/api/delivery-routes/optimize/', {**data, 'depot_name': depot_name},
+                                        format='json')
+            self.assertEqual(response.data['routes_created'], 2)
+
+        planned = DeliveryRoute.objects.filter(status='pending', optimized=True)
+        self.assertEqual(planned.count(), 2)
+        self.assertEqual(planned.get(route_sequence=1).from_location, 'Second hub')
+        # Only the optimizer's own pending legs are replaced
+        self.assertEqual(set(DeliveryRoute.objects.filter(optimized=False)), {done, manual})
+
+    def test_optimize_dry_run_and_validation(self):
+        self.make_parcel('OPT0', latitude=51.5, longitude=0.0)
+        response = self.client.post('/api/delivery-routes/optimize/', {
+            'organization': self.organization.id, 'depot_latitude': 51.0, 'depot_longitude': 0.0, 'dry_run': True,
+        }, format='json')
+        self.assertEqual(response.data['routes_created'], 0)
+        self.assertFalse(DeliveryRoute.objects.exists())
+
+        response = self.client.post(
+            '/api/delivery-routes/optimize/', {'depot_latitude': 51.0, 'depot_longitude': 0.0}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class UserParcelIndexTests(ParcelAPITestCase):
+    url = '/api/parcels/my_parcels/'
+
+    def add_history(self, parcel, role='receiver', user=None):
+        return ParcelDeliveryHistory.objects.create(user=user or self.user, parcel=parcel, role=role)
+
+    def test_my_parcels_is_paginated_from_the_index(self):
+        other_department = Department.objects.create(organization=self.organization, name='Dock')
+        for index in range(6):
+            department = self.department if index % 2 else other_department
+            self.add_history(self.make_parcel(f'MY{index}', department=department))
+        self.add_history(self.make_parcel('OTHER'), user=User.objects.create_user(username='other'))
+
+        response = self.assertWithinQueryBudget(
+            MY_PARCELS_QUERY_BUDGET, self.client.get, self.url, {'page_size': 4}
+        )
+        self.assertEqual([row['tracking_number'] for row in response.data['results']], ['MY5', 'MY4', 'MY3', 'MY2'])
+        self.assertEqual(response.data['results'][1]['department_name'], 'Dock')
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['tracking_number'] for row in response.data['results']], ['MY1', 'MY0'])
+        self.assertIsNone(response.data['next'])
+
+    def test_index_follows_history_and_status_changes(self):
+        parcel = self.make_parcel('IDX1')
+        self.add_history(parcel, role='sender')
+        latest = self.add_history(parcel, role='receiver')
+        entry = UserParcel.objects.get(user=self.user, parcel=parcel)
+        self.assertEqual((entry.role, entry.status), ('receiver', 'pending'))
+
+        self.client.post(f'/api/parcels/{parcel.id}/update_status/', {'status': 'in_transit'}, format='json')
+        self.assertEqual(self.client.get(self.url, {'status': 'in_transit'}).data['results'][0]['id'], parcel.id)
+
+        self.client.post('/api/parcels/bulk_update_status/', {'ids': [parcel.id], 'status': 'delivered'}, format='json')
+        self.assertEqual(UserParcel.objects.get(parcel=parcel).status, 'delivered')
+
+        latest.delete()
+        self.assertEqual(UserParcel.objects.get(parcel=parcel).role, 'sender')
+        ParcelDeliveryHistory.objects.filter(parcel=parcel).delete()
+        self.assertFalse(UserParcel.objects.exists())
+
+
+class FullTextSearchTests(ParcelAPITestCase):
+    url = '/api/parcels/'
+
+    def search(self, query, **params):
+        response = self.client.get(self.url, {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['tracking_number'] for row in response.data['results']]
+
+    def test_prefix_search_on_tracking_numbers(self):
+        for tracking_number in ('TRK-1001', 'TRK-1002', 'TRK-2001', 'XYZ-1001'):
+            self.make_parcel(tracking_number)
+        self.assertEqual(sorted(self.search('TRK-10')), ['TRK-1001', 'TRK-1002'])
+        self.assertEqual(sorted(self.search('trk')), ['TRK-1001', 'TRK-1002', 'TRK-2001'])
+
+    def test_results_are_ranked_and_paginated(self):
+        # The weaker match sorts first by tracking number, so rank order and ?ordering= disagree
+        self.make_parcel('ALPHA-1')
+        self.make_parcel('AAA-1', sender_name='Alpha Industries')
+        self.make_parcel('OTHER-2')
+
+        self.assertEqual(self.search('alpha'), ['ALPHA-1', 'AAA-1'])
+        first = self.client.get(self.url, {'search': 'alpha', 'page_size': 1}).data
+        second = self.client.get(first['next']).data
+        self.assertEqual(
+            [first['results'][0]['tracking_number'], second['results'][0]['tracking_number']], ['ALPHA-1', 'AAA-1']
+        )
+        self.assertEqual(self.search('alpha', ordering='tracking_number'), ['AAA-1', 'ALPHA-1'])
+
+    def test_index_follows_saves_deletes_and_bulk_imports(self):
+        parcel = self.make_parcel('EDIT-1')
+        self.client.patch(f'/api/parcels/{parcel.id}/', {'sender_name': 'Zebra Logistics'}, format='json')
+        self.assertEqual(self.search('zebra'), ['EDIT-1'])
+        parcel.delete()
+        self.assertEqual(self.search('zebra'), [])
+
+        self.client.post('/api/parcels/bulk/', [
+            {'tracking_number': 'BULK-1', 'sender_name': 'Quokka', 'receiver_name': 'R',
+             'organization': self.organization.id},
+        ], format='json')
+        self.assertEqual(self.search('quokka'), ['BULK-1'])
+
+    def test_review_search(self):
+        parcel = self.make_parcel('REV-1')
+        DeliveryReview.objects.create(
+            parcel=parcel, reviewer=self.user, rating=5, title='Speedy courier', comment='Arrived early',
+            delivery_speed_rating=5, packaging_quality_rating=5, communication_rating=5,
+        )
+        response = self.client.get('/api/reviews/', {'search': 'spee'})
+        self.assertEqual([row['parcel_tracking'] for row in response.data['results']], ['REV-1'])
+
+    def test_rebuild_command_repopulates_index(self):
+        self.make_parcel('REBUILD-1')
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {DOCUMENTS['api.parcel']['table']}")
+        self.assertEqual(self.search('rebuild'), [])
+        call_command('rebuild_search_index', '--model', 'parcel', '--batch-size', '1', stdout=io.StringIO())
+        self.assertEqual(self.search('rebuild'), ['REBUILD-1'])
+
+
+class TenantScopingTests(ParcelAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other_admin = User.objects.create_user(username='rival')
+        self.other_organization = Organization.objects.create(name='Rival', admin=self.other_admin)
+        self.own = self.make_parcel('OWN-1')
+        self.foreign = self.make_parcel('FOREIGN-1', organization=self.other_organization, department=None)
+        for parcel in (self.own, self.foreign):
+            TrackingLocation.objects.create(parcel=parcel, latitude=1, longitude=1, location_name='x', status='x')
+
+    def tracking_numbers(self, response):
+        return [row['tracking_number'] for row in response.data['results']]
+
+    def test_lists_and_details_are_scoped_to_the_callers_organizations(self):
+        self.assertEqual(self.tracking_numbers(self.client.get('/api/parcels/')), ['OWN-1'])
+        self.assertEqual(self.client.get(f'/api/parcels/{self.foreign.id}/').status_code, 404)
+        locations = self.client.get('/api/tracking-locations/').data['results']
+        self.assertEqual({row['parcel'] for row in locations}, {self.own.id})
+        organizations = self.client.get('/api/organizations/').data['results']
+        self.assertEqual([row['id'] for row in organizations], [self.organization.id])
+
+    def test_created_organizations_are_administered_by_their_creator(self):
+        newcomer = User.objects.create_user(username='newcomer')
+        self.client.force_authenticate(newcomer)
+        response = self.client.post('/api/organizations/', {'name': 'Startup'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['admin']['username'], 'newcomer')
+        self.assertEqual(self.client.get(f"/api/organizations/{response.data['id']}/").status_code, 200)
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.post('/api/organizations/', {'name': 'Nobody'}, format='json').status_code, 403)
+
+    def test_cached_barcode_lookups_respect_the_tenant(self):
+        self.client.force_authenticate(self.other_admin)
+        self.assertEqual(self.client.get('/api/parcels/search_by_barcode/', {'tracking_number': 'FOREIGN-1'}).status_code, 200)
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/parcels/search_by_barcode/', {'tracking_number': 'FOREIGN-1'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_header_narrows_and_staff_and_anonymous_scopes(self):
+        self.other_organization.admin = self.user
+        self.other_organization.save()
+        self.assertEqual(len(self.client.get('/api/parcels/').data['results']), 2)
+        response = self.client.get('/api/parcels/', HTTP_X_ORGANIZATION=str(self.other_organization.id))
+        self.assertEqual(self.tracking_numbers(response), ['FOREIGN-1'])
+
+        self.client.force_authenticate(User.objects.create_user(username='ops', is_staff=True))
+        self.assertEqual(len(self.client.get('/api/parcels/').data['results']), 2)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/parcels/').data['results'], [])
+
+    def test_writes_into_other_organizations_are_rejected(self):
+        response = self.client.post('/api/parcels/', {
+            'tracking_number': 'NEW-1', 'sender_name': 'S', 'receiver_name': 'R',
+            'organization': self.other_organization.id,
+        }, format='json')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post('/api/tracking-locations/', {
+            'parcel': self.foreign.id, 'latitude': 1, 'longitude': 1, 'location_name': 'x', 'status': 'x',
+        }, format='json')
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.post('/api/parcels/bulk/', [
+            {'tracking_number': 'NEW-2', 'sender_name': 'S', 'receiver_name': 'R',
+             'organization': self.other_organization.id},
+        ], format='json')
+        self.assertEqual(response.data['failed'], 1)
+        self.assertFalse(Parcel.objects.filter(tracking_number__startswith='NEW').exists())
+
+
+class DailyMetricsTests(ParcelAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/organizations/{self.organization.id}/metrics/'
+
+    def create_activity(self):
+        for index in range(3):
+            response = self.client.post('/api/parcels/', {
+                'tracking_number': f'M{index}', 'sender_name': 'S', 'receiver_name': 'R',
+                'organization': self.organization.id, 'department': self.department.id,
+            }, format='json')
+            self.assertEqual(response.status_code, 201)
+        parcels = list(Parcel.objects.order_by('tracking_number'))
+        self.client.post(f'/api/parcels/{parcels[0].id}/update_status/', {'status': 'delivered'}, format='json')
+        self.client.post('/api/parcels/bulk_update_status/', {'ids': [parcels[1].id], 'status': 'lost'}, format='json')
+        self.client.patch(f'/api/parcels/{parcels[2].id}/', {'status': 'returned'}, format='json')
+        response = self.client.post('/api/reviews/', {
+            'parcel': parcels[0].id, 'reviewer': self.user.id, 'rating': 4, 'title': 'Good', 'comment': 'Fine',
+            'delivery_speed_rating': 5, 'packaging_quality_rating': 3, 'communication_rating': 4,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return parcels, response.data['id']
+
+    def test_rollups_follow_writes_and_endpoint_reads_only_rollups(self):
+        parcels, review_id = self.create_activity()
+        self.client.patch(f'/api/reviews/{review_id}/', {'rating': 2}, format='json')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            self.assertNotIn('api_parcel', query['sql'])
+            self.assertNotIn('api_deliveryreview', query['sql'])
+
+        totals = response.data['totals']
+        self.assertEqual(
+            (totals['created'], totals['delivered'], totals['lost'], totals['returned'], totals['reviews']),
+            (3, 1, 1, 1, 1)
+        )
+        self.assertEqual(totals['average_ratings']['rating'], 2)
+        self.assertEqual(totals['average_ratings']['packaging_quality_rating'], 3)
+        self.assertIsNotNone(totals['average_delivery_hours'])
+        self.assertEqual([day['day'] for day in response.data['days']], [timezone.localdate().isoformat()])
+
+        self.client.delete(f'/api/reviews/{review_id}/')
+        totals = self.client.get(self.url).data['totals']
+        self.assertEqual(totals['reviews'], 0)
+        self.assertIsNone(totals['average_ratings']['rating'])
+
+    def test_range_and_department_filters(self):
+        self.create_activity()
+        yesterday = (timezone.localdate() - timedelta(days=1)).isoformat()
+        self.assertEqual(self.client.get(self.url, {'to': yesterday}).data['days'], [])
+        other = self.client.get(self.url, {'department': self.department.id + 1000}).data
+        self.assertEqual(other['totals']['created'], 0)
+        self.assertEqual(self.client.get(self.url, {'from': 'soon'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'from': '2026-02-01', 'to': '2026-01-01'}).status_code, 400)
+
+    def test_backfill_matches_incremental_rollups(self):
+        self.create_activity()
+        incremental = self.client.get(self.url).data
+        DailyMetrics.objects.all().delete()
+        self.assertEqual(self.client.get(self.url).data['totals']['created'], 0)
+
+        call_command('backfill_daily_metrics', '--organization', str(self.organization.id), stdout=io.StringIO())
+        self.assertEqual(self.client.get(self.url).data, incremental)
+
+    def test_backfill_matches_live_rollups_after_redeliveries_and_deletes(self):
+        parcels, _ = self.create_activity()
+        redelivered = parcels[2]
+        self.client.patch(f'/api/parcels/{redelivered.id}/', {'status': 'delivered'}, format='json')
+        for status_name in ('in_transit', 'delivered'):
+            self.client.post(
+                '/api/parcels/bulk_update_status/', {'ids': [redelivered.id], 'status': status_name}, format='json'
+            )
+        # The first parcel was delivered and reviewed, the second lost
+        for parcel in parcels[:2]:
+            self.assertEqual(self.client.delete(f'/api/parcels/{parcel.id}/').status_code, 204)
+
+        def counters():
+            rows = DailyMetrics.objects.order_by('day').values('department_id', 'day', *rollups.COUNTER_FIELDS)
+            return [{**row, 'delivery_seconds_total': round(row['delivery_seconds_total'], 3)} for row in rows]
+
+        live = counters()
+        self.assertEqual(
+            [(row['created_count'], row['delivered_count'], row['lost_count'], row['returned_count'],
+              row['delivery_time_count'], row['review_count']) for row in live],
+            [(1, 2, 0, 1, 2, 0)]
+        )
+        DailyMetrics.objects.all().delete()
+        call_command('backfill_daily_metrics', '--organization', str(self.organization.id), stdout=io.StringIO())
+        self.assertEqual(counters(), live)
+
+
+class ReviewSummaryTests(ParcelAPITestCase):
+    url = '/api/reviews/summary/'
+
+    def review(self, tracking_number, rating, would_recommend=True, **kwargs):
+        parcel = self.make_parcel(tracking_number, **kwargs)
+        response = self.client.post('/api/reviews/', {
+            'parcel': parcel.id, 'reviewer': self.user.id, 'rating': rating, 'title': 'T', 'comment': 'C',
+            'delivery_speed_rating': rating, 'packaging_quality_rating': 5, 'communication_rating': 1,
+            'would_recommend': would_recommend,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_summary_follows_review_writes(self):
+        first = self.review('R1', 4)
+        self.review('R2', 2, would_recommend=False, department=None)
+        other_admin = User.objects.create_user(username='rival')
+        other = Organization.objects.create(name='Rival', admin=other_admin)
+        DeliveryReview.objects.create(
+            parcel=self.make_parcel('FOREIGN', organization=other, department=None), reviewer=other_admin,
+            rating=1, title='T', comment='C', delivery_speed_rating=1, packaging_quality_rating=1,
+            communication_rating=1,
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            summary = self.client.get(self.url).data
+        # The caller's organizations, then one aggregate read
+        self.assertEqual(len(queries), 2)
+        self.assertIn('api_reviewaggregate', queries.captured_queries[-1]['sql'])
+        self.assertEqual(summary['reviews'], 2)
+        self.assertEqual(summary['average_ratings']['rating'], 3)
+        self.assertEqual(summary['average_ratings']['packaging_quality_rating'], 5)
+        self.assertEqual(summary['recommend_rate'], 0.5)
+        self.assertEqual([month['month'] for month in summary['months']], [timezone.localdate().strftime('%Y-%m')])
+
+        department = self.client.get(self.url, {'department': self.department.id}).data
+        self.assertEqual((department['reviews'], department['average_ratings']['rating']), (1, 4))
+
+        self.client.patch(f'/api/reviews/{first}/', {'rating': 5, 'would_recommend': False}, format='json')
+        summary = self.client.get(self.url).data
+        self.assertEqual((summary['average_ratings']['rating'], summary['recommend_rate']), (3.5, 0))
+
+        self.client.delete(f'/api/reviews/{first}/')
+        summary = self.client.get(self.url).data
+        self.assertEqual((summary['reviews'], summary['average_ratings']['rating']), (1, 2))
+        self.assertEqual(ReviewAggregate.objects.filter(organization=self.organization).count(), 2)
+
+    def test_rejects_invalid_filters(self):
+        self.assertEqual(self.client.get(self.url, {'from': '2026-13'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'organization': 'acme'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'to': '1999-01'}).data['reviews'], 0)
+
+
+class NotificationFanOutTests(ParcelAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.parcel = self.make_parcel('NOTE-1')
+        self.sender = User.objects.create_user(username='sender')
+        self.receiver = User.objects.create_user(username='receiver')
+        ParcelDeliveryHistory.objects.create(user=self.sender, parcel=self.parcel, role='sender')
+        ParcelDeliveryHistory.objects.create(user=self.receiver, parcel=self.parcel, role='receiver')
+
+    def update_status(self, new_status):
+        response = self.client.post(f'/api/parcels/{self.parcel.id}/update_status/', {'status': new_status}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_status_changes_are_queued_and_fanned_out_to_linked_users(self):
+        self.update_status('in_transit')
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(notifications.process_pending(), (0, 0))
+
+        self.assertEqual(notifications.process_pending(coalesce_seconds=0), (1, 3))
+        for user in (self.user, self.sender, self.receiver):
+            self.assertEqual(
+                list(user.notifications.values_list('message', flat=True)), ['Parcel status changed to in_transit']
+            )
+        self.assertFalse(NotificationJob.objects.exists())
+
+    def test_rapid_changes_are_coalesced_per_parcel(self):
+        self.update_status('received')
+        self.update_status('in_transit')
+        self.update_status('delivered')
+        self.assertEqual(NotificationJob.objects.count(), 1)
+
+        out = io.StringIO()
+        call_command('process_notifications', '--once', '--coalesce-seconds', '0', stdout=out)
+        self.assertIn('Processed 1 jobs, wrote 3 notifications', out.getvalue())
+        self.assertEqual(
+            list(self.sender.notifications.values_list('message', flat=True)), ['Parcel status changed to delivered']
+        )
+
+    def test_busy_parcels_are_flushed_after_the_maximum_delay(self):
+        self.update_status('received')
+        NotificationJob.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(notifications.process_pending(coalesce_seconds=60, max_delay_seconds=30), (1, 3))
+
+
+class NotificationPollingTests(ParcelAPITestCase):
+    url = '/api/notifications/poll/'
+
+    def notify(self, count=1):
+        parcel = self.make_parcel(f'POLL-{Notification.objects.count()}')
+        for index in range(count):
+            Notification.objects.create(user=self.user, parcel=parcel, title=f'T{index}', message='M')
+
+    def test_poll_returns_new_notifications_then_not_modified(self):
+        self.notify(2)
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['unread_count'], 2)
+        self.assertEqual(len(response.data['results']), 2)
+        etag, latest_id = response['ETag'], response.data['latest_id']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 1)
+
+        self.notify()
+        response = self.client.get(self.url, {'since': latest_id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['unread_count'], 3)
+        self.assertEqual([row['title'] for row in response.data['results']], ['T0'])
+
+        response = self.client.get(self.url, {'since': response.data['latest_id']})
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(self.client.get(self.url, {'since': 'new'}).status_code, 400)
+
+    def test_counter_follows_reads_deletes_and_fan_out(self):
+        self.notify(3)
+        self.assertEqual(self.client.get(self.url).data['unread_count'], 3)
+        first = Notification.objects.filter(user=self.user).first()
+
+        self.client.post(f'/api/notifications/{first.id}/mark_as_read/')
+        self.client.post(f'/api/notifications/{first.id}/mark_as_read/')
+        self.assertEqual(NotificationCounter.objects.get(user=self.user).unread_count, 2)
+        self.client.patch(f'/api/notifications/{first.id}/', {'is_read': False}, format='json')
+        self.assertEqual(NotificationCounter.objects.get(user=self.user).unread_count, 3)
+        self.client.delete(f'/api/notifications/{first.id}/')
+        self.assertEqual(NotificationCounter.objects.get(user=self.user).unread_count, 2)
+
+        parcel = self.make_parcel('POLL-FANOUT')
+        self.client.post(f'/api/parcels/{parcel.id}/update_status/', {'status': 'received'}, format='json')
+        notifications.drain(coalesce_seconds=0)
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['unread_count'], 3)
+        self.assertEqual(response.data['latest_id'], Notification.objects.latest('id').id)
+
+        self.client.post('/api/notifications/mark_all_as_read/')
+        self.assertEqual(self.client.get(self.url).data['unread_count'], 0)
+        self.assertEqual(NotificationCounter.objects.get(user=self.user).unread_count, 0)
+
+    def test_deleting_a_parcel_uncounts_its_unread_notifications(self):
+        self.notify(2)
+        self.notify()
+        Notification.objects.filter(title='T1').update(is_read=True)
+        self.assertEqual(self.client.get(self.url).data['unread_count'], 2)
+
+        parcel = Parcel.objects.get(tracking_number='POLL-0')
+        self.client.delete(f'/api/parcels/{parcel.id}/')
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['unread_count'], 1)
+        self.assertEqual(Notification.objects.filter(user=self.user, is_read=False).count(), 1)
+
+    def test_list_is_cursor_paginated(self):
+        self.notify(3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/notifications/', {'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+
+class RetentionTests(ParcelAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.parcel = self.make_parcel('KEEP-1', status='delivered')
+        self.old = timezone.now() - timedelta(days=120)
+
+    def apply(self, *args):
+        out = io.StringIO()
+        call_command('apply_retention', *args, stdout=out)
+        return out.getvalue()
+
+    def test_prunes_old_read_notifications_only(self):
+        for is_read in (True, False):
+            Notification.objects.create(user=self.user, title='old', message='M', is_read=is_read)
+        Notification.objects.update(created_at=self.old)
+        Notification.objects.create(user=self.user, title='new', message='M', is_read=True)
+
+        self.assertIn('notifications: Deleted 1 rows', self.apply('--policy', 'notifications'))
+        self.assertEqual(
+            sorted(Notification.objects.values_list('title', 'is_read')), [('new', True), ('old', False)]
+        )
+
+    def test_downsamples_old_tracking_points_in_batches(self):
+        start = self.old.replace(minute=0, second=0, microsecond=0)
+        for minutes in range(0, 180, 10):
+            TrackingLocation.objects.create(
+                parcel=self.parcel, latitude=1, longitude=1, location_name='x', status='x',
+                timestamp=start + timedelta(minutes=minutes),
+            )
+        recent = TrackingLocation.objects.create(parcel=self.parcel, latitude=1, longitude=1, location_name='x', status='x')
+
+        self.assertIn('Would delete 15 rows', self.apply('--policy', 'tracking_locations', '--dry-run'))
+        self.assertEqual(TrackingLocation.objects.count(), 19)
+        self.apply('--policy', 'tracking_locations', '--batch-size', '4')
+        kept = list(TrackingLocation.objects.order_by('timestamp').values_list('timestamp', flat=True))
+        self.assertEqual(kept, [start, start + timedelta(hours=1), start + timedelta(hours=2), recent.timestamp])
+
+    @override_settings(PARCEL_RETENTION={'status_history': {'DAYS': 30}, 'notifications': {'DAYS': None}})
+    def test_archives_pruned_history_of_finished_parcels(self):
+        active = self.make_parcel('ACTIVE-1', status='in_transit')
+        for parcel in (self.parcel, active):
+            ParcelStatusHistory.objects.create(parcel=parcel, previous_status='pending', new_status=parcel.status)
+        ParcelStatusHistory.objects.update(created_at=self.old)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'archive.ndjson.gz')
+            output = self.apply('--policy', 'status_history', '--policy', 'notifications', '--archive', path)
+            with gzip.open(path, 'rt') as archive:
+                rows = [json.loads(line) for line in archive]
+        self.assertIn('Archived 1 rows', output)
+        self.assertNotIn('notifications', output)
+        self.assertEqual(rows[0]['model'], 'api.parcelstatushistory')
+        self.assertEqual(rows[0]['fields']['parcel_id'], self.parcel.id)
+        self.assertEqual(list(ParcelStatusHistory.objects.values_list('parcel_id', flat=True)), [active.id])
+
+
+@override_settings(PARCEL_PROFILING={'SAMPLE_RATE': 1.0, 'DUPLICATE_QUERY_THRESHOLD': 2, 'METRICS_TOKEN': 'scrape'})
+class ProfilingTests(ParcelAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.token = {'HTTP_AUTHORIZATION': 'Bearer scrape'}
+
+    def scrape(self):
+        response = self.client.get('/api/_metrics', **self.token)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_records_latency_queries_serializer_time_and_repeated_statements(self):
+        self.make_parcel('P0', status='pending')
+        self.make_parcel('P1', status='in_transit')
+        self.client.get('/api/parcels/')
+        self.client.post(
+            '/api/parcels/bulk_update_status/', {'tracking_numbers': ['P0', 'P1'], 'status': 'delivered'}, format='json'
+        )
+
+        text = self.scrape()
+        self.assertIn('parcel_http_request_duration_seconds_count{route="parcel-list",method="GET"} 1', text)
+        self.assertIn('parcel_http_request_duration_seconds_bucket{route="parcel-list",method="GET",le="+Inf"} 1', text)
+        self.assertIn('parcel_http_duplicate_query_requests_total{route="parcel-bulk-update-status",method="POST"} 1', text)
+
+        recent = json.loads(self.client.get('/api/_metrics', {'format': 'json'}, **self.token).content)['recent']
+        listing = next(sample for sample in recent if sample['route'] == 'parcel-list')
+        self.assertGreater(listing['queries'], 0)
+        self.assertGreater(listing['serializer_ms'], 0)
+        bulk = next(sample for sample in recent if sample['route'] == 'parcel-bulk-update-status')
+        self.assertTrue(any('UPDATE "api_parcel"' in row['sql'] for row in bulk['duplicate_queries']))
+
+    def test_metrics_endpoint_requires_staff_or_token(self):
+        self.assertEqual(self.client.get('/api/_metrics').status_code, 403)
+        self.assertEqual(self.client.get('/api/_metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get('/api/_metrics').status_code, 403)
+        response = self.client.get('/api/_metrics', **self.token)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/_metrics').status_code, 200)
+
+    async def test_profiles_requests_served_over_asgi(self):
+        await sync_to_async(self.make_parcel)('P0')
+        await self.async_client.aforce_login(self.user)
+        await self.async_client.get('/api/parcels/')
+        response = await self.async_client.get(
+            '/api/_metrics', {'format': 'json'}, headers={'Authorization': 'Bearer scrape'}
+        )
+        listing = next(sample for sample in json.loads(response.content)['recent'] if sample['route'] == 'parcel-list')
+        self.assertGreater(listing['queries'], 0)
+        self.assertGreater(listing['serializer_ms'], 0)
+
+    @override_settings(PARCEL_PROFILING={'SAMPLE_RATE': 0, 'METRICS_TOKEN': 'scrape'})
+    def test_unsampled_requests_only_feed_the_histogram(self):
+        self.client.get('/api/parcels/')
+        text = self.scrape()
+        self.assertIn('parcel_http_request_duration_seconds_count{route="parcel-list",method="GET"} 1', text)
+        self.assertIn('parcel_http_sampled_requests_total{route="parcel-list",method="GET"} 0', text)
+
+    def test_slowest_endpoints_command_ranks_routes(self):
+        for _ in range(3):
+            self.client.get('/api/parcels/')
+        self.client.get('/api/organizations/')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'scrape.txt')
+            with open(path, 'w') as scrape:
+                scrape.write(self.scrape())
+            out = io.StringIO()
+            call_command('slowest_endpoints', '--file', path, '--sort', 'total', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn('GET parcel-list', lines[1])
+        self.assertIn('GET organization-list', out.getvalue())
+
+    def test_histogram_quantile_interpolates_within_buckets(self):
+        buckets = [(0.1, 0), (0.2, 10), (float('inf'), 10)]
+        self.assertAlmostEqual(histogram_quantile(buckets, 0.5), 0.15)
+        self.assertIsNone(histogram_quantile([(0.1, 0), (float('inf'), 0)], 0.5))
+
+
+@override_settings(PARCEL_PROFILING={'ENABLED': False})
+class BenchmarkTests(ParcelAPITestCase):
+    def test_generated_dataset_has_full_chains(self):
+        data = benchmark.generate(organizations=2, departments=2, parcels=20, locations=3, history=2, linked_share=1)
+        self.assertEqual(len(data.parcel_ids), 10)
+        self.assertEqual(TrackingLocation.objects.filter(parcel_id__in=data.parcel_ids).count(), 30)
+        self.assertEqual(ParcelStatusHistory.objects.filter(parcel_id__in=data.parcel_ids).count(), 20)
+        self.assertEqual(UserParcel.objects.filter(user=data.user).count(), 10)
+        metrics = DailyMetrics.objects.filter(organization_id=data.organization_id)
+        self.assertEqual(metrics.aggregate(total=Sum('created_count'))['total'], 10)
+
+    def test_scenarios_run_and_report_query_counts(self):
+        data = benchmark.generate(organizations=1, parcels=10, locations=2, history=2)
+        for name in benchmark.SCENARIOS:
+            result = benchmark.run_scenario(name, data, iterations=3, warmup=1)
+            self.assertEqual(result['iterations'], 3)
+            self.assertGreaterEqual(result['p99_ms'], result['p50_ms'])
+            self.assertGreaterEqual(result['queries_max'], result['queries_p50'])
+
+    def test_compare_flags_query_and_latency_regressions(self):
+        baseline = {'parcel_list': {'queries_max': 3, 'p99_ms': 10.0}}
+        self.assertEqual(benchmark.compare({'parcel_list': {'queries_max': 3, 'p99_ms': 14.0}}, baseline), [])
+        regressions = benchmark.compare({'parcel_list': {'queries_max': 4, 'p99_ms': 16.0}}, baseline)
+        self.assertEqual(len(regressions), 2)
+        self.assertEqual(benchmark.compare({'my_parcels': {'queries_max': 9, 'p99_ms': 99.0}}, baseline), [])
+
+
+class ValuesRowSerializationTests(ParcelAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.make_parcel('ROW-1', status='delivered', delivered_at=timezone.now(), current_location='Depot')
+        self.make_parcel('ROW-2', department=None, parcel_type='letter')
+        # Unknown values fall back to the raw value, as get_FOO_display does
+        Parcel.objects.create(tracking_number='ROW-3', organization=self.organization, status='archived',
+                              sender_name='Sender', receiver_name='Receiver')
+
+    def test_rows_serialize_like_instances(self):
+        parcels = Parcel.objects.order_by('id')
+        expected = ParcelListSerializer(parcels, many=True).data
+        rows = values_rows(parcels, ParcelListSerializer())
+        with CaptureQueriesContext(connection) as queries:
+            data = ParcelListSerializer(rows, many=True).data
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(json.dumps(data), json.dumps(expected))
+        self.assertNotIn('department_name', data[1])
+        self.assertEqual(data[2]['status_display'], 'archived')
+
+    def test_list_endpoints_return_the_instance_payload(self):
+        for parcel in Parcel.objects.all():
+            UserParcel.objects.create(user=self.user, parcel=parcel, role='sender', status=parcel.status,
+                                      created_at=parcel.created_at)
+        expected = ParcelListSerializer(Parcel.objects.order_by('-created_at'), many=True).data
+        response = self.client.get('/api/parcels/')
+        self.assertEqual(json.dumps(response.data['results']), json.dumps(expected))
+        response = self.client.get('/api/parcels/my_parcels/')
+        self.assertEqual(json.dumps(response.data['results']), json.dumps(expected))
+
+
+class ExportTests(ParcelAPITestCase):
+    url = '/api/parcels/export/'
+
+    def setUp(self):
+        super().setUp()
+        self.parcels = [self.make_parcel(f'EXP-{number}', status='delivered' if number % 2 else 'pending')
+                        for number in range(5)]
+        for parcel in self.parcels:
+            ParcelStatusHistory.objects.create(parcel=parcel, previous_status='pending', new_status=parcel.status)
+            TrackingLocation.objects.create(parcel=parcel, latitude=1.0, longitude=2.0, location_name='Hub',
+                                            status=parcel.status)
+
+    def read(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv_applies_parcel_filters_and_list_representation(self):
+        response = self.client.get(self.url, {'status': 'delivered'})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="parcels.csv"')
+        rows = list(csv.DictReader(io.StringIO(self.read(response).decode())))
+        self.assertEqual([row['tracking_number'] for row in rows], ['EXP-1', 'EXP-3'])
+        self.assertEqual(rows[0]['status_display'], 'Delivered')
+        self.assertEqual(rows[0]['department_name'], 'Mailroom')
+
+    def test_ndjson_matches_the_list_serializer_and_resumes_after_an_id(self):
+        response = self.client.get(self.url, {'output': 'ndjson', 'after': self.parcels[2].id})
+        lines = [json.loads(line) for line in self.read(response).decode().splitlines()]
+        expected = ParcelListSerializer(self.parcels[3:], many=True).data
+        self.assertEqual(lines, json.loads(json.dumps(expected)))
+
+    def test_history_and_locations_for_matching_parcels_gzipped(self):
+        response = self.client.get(self.url, {'dataset': 'status_history', 'status': 'pending',
+                                              'output': 'ndjson', 'compression': 'gzip'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(self.read(response)).decode().splitlines()
+        self.assertEqual({json.loads(line)['parcel'] for line in lines}, {self.parcels[i].id for i in (0, 2, 4)})
+
+        response = self.client.get(self.url, {'dataset': 'tracking_locations'})
+        rows = list(csv.DictReader(io.StringIO(self.read(response).decode())))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['location_name'], 'Hub')
+
+    def test_streams_chunks_from_a_single_query(self):
+        parcels = Parcel.objects.all()
+        with CaptureQueriesContext(connection) as queries:
+            chunks = list(export.serialized_chunks(parcels, ParcelListSerializer(), chunk_size=2))
+        self.assertEqual([len(rows) for rows in chunks], [2, 2, 1])
+        self.assertEqual(len(queries), 1)
+
+    def test_rejects_invalid_options(self):
+        response = self.client.get(self.url, {'output': 'xml', 'after': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'output', 'after'})
+
+
+class SparseFieldsetTests(ParcelAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.parcel = self.make_parcel('SPARSE1', current_location='Depot')
+        ParcelStatusHistory.objects.create(parcel=self.parcel, previous_status='pending', new_status='received')
+        TrackingLocation.objects.create(parcel=self.parcel, latitude=1.0, longitude=2.0, location_name='Hub',
+                                        status='received')
+        DeliveryRoute.objects.create(
+            parcel=self.parcel, route_sequence=1, from_location='A', to_location='B',
+            from_latitude=0, from_longitude=0, to_latitude=1, to_longitude=1
+        )
+        DeliveryReview.objects.create(
+            parcel=self.parcel, reviewer=self.user, rating=5, title='Great', comment='Fast',
+            delivery_speed_rating=5, packaging_quality_rating=5, communication_rating=5
+        )
+
+    def get(self, url, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data, ' '.join(query['sql'] for query in queries)
+
+    def test_detail_skips_unrequested_relations(self):
+        url = f'/api/parcels/{self.parcel.id}/'
+        data, sql = self.get(url, {'fields': 'id,status,current_location'})
+        self.assertEqual(data, {'id': self.parcel.id, 'status': 'pending', 'current_location': 'Depot'})
+        for table in ('api_parcelstatushistory', 'api_trackinglocation', 'api_deliveryroute', 'api_deliveryreview'):
+            self.assertNotIn(table, sql)
+        self.assertNotIn('receiver_address', sql)
+
+        data, sql = self.get(url, {'fields': 'status,tracking_locations', 'expand': 'organization'})
+        self.assertEqual(list(data), ['status', 'organization', 'tracking_locations'])
+        self.assertEqual(data['organization']['admin']['username'], 'courier')
+        self.assertNotIn('api_parcelstatushistory', sql)
+
+    def test_every_detail_field_can_be_requested_alone(self):
+        url = f'/api/parcels/{self.parcel.id}/'
+        full = self.client.get(url).data
+        for name in ParcelDetailSerializer.Meta.fields:
+            data, _ = self.get(url, {'fields': name})
+            self.assertEqual(data, {name: full[name]}, name)
+        data, sql = self.get(url, {'fields': 'id,review'})
+        self.assertEqual(data['review']['reviewer_username'], 'courier')
+        self.assertNotIn('api_trackinglocation', sql)
+
+    def test_list_and_my_parcels_read_only_requested_columns(self):
+        UserParcel.objects.create(user=self.user, parcel=self.parcel, role='sender', status='pending',
+                                  created_at=self.parcel.created_at)
+        for url in ('/api/parcels/', '/api/parcels/my_parcels/'):
+            data, sql = self.get(url, {'fields': 'tracking_number,status_display'})
+            self.assertEqual(data['results'], [{'tracking_number': 'SPARSE1', 'status_display': 'Pending'}])
+            self.assertNotIn('sender_name', sql)
+            self.assertNotIn('api_department', sql)
+
+    def test_routes_and_reviews_expand_related_objects(self):
+        data, sql = self.get('/api/delivery-routes/', {'fields': 'id,route_sequence', 'expand': 'parcel'})
+        self.assertEqual(data['results'][0]['parcel']['department_name'], 'Mailroom')
+        self.assertEqual(list(data['results'][0]), ['id', 'parcel', 'route_sequence'])
+
+        data, sql = self.get('/api/reviews/', {'fields': 'rating'})
+        self.assertEqual(data['results'], [{'rating': 5}])
+        self.assertNotIn('api_parcel"."tracking_number', sql)
+        data, _ = self.get('/api/reviews/', {'expand': 'reviewer'})
+        self.assertEqual(data['results'][0]['reviewer']['username'], 'courier')
+
+    def test_barcode_lookup_trims_the_cached_payload(self):
+        params = {'tracking_number': 'SPARSE1', 'fields': 'status,current_location'}
+        for _ in range(2):
+            data, _ = self.get('/api/parcels/search_by_barcode/', params)
+            self.assertEqual(data, {'status': 'pending', 'current_location': 'Depot'})
+
+    def test_unknown_fields_and_expansions_are_rejected(self):
+        url = f'/api/parcels/{self.parcel.id}/'
+        self.assertEqual(self.client.get(url, {'fields': 'id,nope'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'expand': 'department'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/parcels/search_by_barcode/',
+                                         {'tracking_number': 'SPARSE1', 'fields': 'nope'}).status_code, 400)
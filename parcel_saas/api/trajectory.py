@@ -0,0 +1,120 @@
+"""Simplified parcel trajectories.
+
+A parcel's tracking points are reduced with Douglas-Peucker at a named
+resolution and stored as a ``ParcelTrajectory`` polyline. The stored copy is
+reused until the parcel's tracking points change (new max id or a different
+count), so long-haul parcels are only re-simplified when they move.
+Time-bucket downsampling is derived on demand.
+"""
+from math import cos, radians, sqrt
+
+from django.db.models import Count, Max
+
+from .models import ParcelTrajectory, TrackingLocation
+
+# Douglas-Peucker tolerance in metres per named resolution
+RESOLUTIONS = {
+    'high': 10,
+    'medium': 50,
+    'low': 200,
+}
+
+METERS_PER_DEGREE_LAT = 110540.0
+METERS_PER_DEGREE_LON = 111320.0
+
+
+def _project(points):
+    """Equirectangular projection to metres around the first point's latitude"""
+    scale_x = METERS_PER_DEGREE_LON * cos(radians(points[0][0]))
+    return [(lon * scale_x, lat * METERS_PER_DEGREE_LAT) for lat, lon, *_ in points]
+
+
+def _segment_distance(point, start, end):
+    (px, py), (ax, ay), (bx, by) = point, start, end
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        return sqrt((px - ax) ** 2 + (py - ay) ** 2)
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length_sq))
+    return sqrt((px - ax - t * dx) ** 2 + (py - ay - t * dy) ** 2)
+
+
+def douglas_peucker(points, tolerance_m):
+    """Simplify ``(lat, lon, ...)`` points, keeping endpoints; iterative to avoid deep recursion"""
+    if len(points) < 3:
+        return list(points)
+    projected = _project(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_distance, index = 0.0, None
+        for i in range(first + 1, last):
+            distance = _segment_distance(projected[i], projected[first], projected[last])
+            if distance > max_distance:
+                max_distance, index = distance, i
+        if index is not None and max_distance > tolerance_m:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def downsample_by_time(points, bucket_seconds):
+    """Keep the last point of each ``bucket_seconds`` window, plus the first point"""
+    if not points:
+        return []
+    sampled = [points[0]]
+    current_bucket = None
+    for point in points[1:]:
+        bucket = int(point[2].timestamp() // bucket_seconds)
+        if bucket == current_bucket:
+            sampled[-1] = point
+        else:
+            sampled.append(point)
+            current_bucket = bucket
+    return sampled
+
+
+def raw_points(parcel_id):
+    """Chronological ``(lat, lon, timestamp)`` tuples for a parcel"""
+    return list(
+        TrackingLocation.objects.filter(parcel_id=parcel_id)
+        .order_by('timestamp', 'id')
+        .values_list('latitude', 'longitude', 'timestamp')
+    )
+
+
+def _format(points):
+    return [[lat, lon, timestamp.isoformat()] for lat, lon, timestamp in points]
+
+
+def get_trajectory(parcel_id, resolution):
+    """Stored simplified polyline for a parcel, recomputed when its points have changed"""
+    tolerance = RESOLUTIONS[resolution]
+    source = TrackingLocation.objects.filter(parcel_id=parcel_id).aggregate(last_id=Max('id'), count=Count('id'))
+    trajectory = ParcelTrajectory.objects.filter(parcel_id=parcel_id, resolution=resolution).first()
+    if (
+        trajectory is not None
+        and trajectory.last_location_id == source['last_id']
+        and trajectory.source_count == source['count']
+    ):
+        return trajectory
+
+    points = _format(douglas_peucker(raw_points(parcel_id), tolerance))
+    trajectory, _ = ParcelTrajectory.objects.update_or_create(
+        parcel_id=parcel_id, resolution=resolution,
+        defaults={'points': points, 'source_count': source['count'], 'last_location_id': source['last_id']},
+    )
+    return trajectory
+
+
+def trajectory_payload(parcel_id, resolution=None, bucket_seconds=None):
+    """Response body for a parcel trajectory at a named resolution or time bucket"""
+    if bucket_seconds:
+        points = raw_points(parcel_id)
+        simplified = _format(downsample_by_time(points, bucket_seconds))
+        return {'bucket_seconds': bucket_seconds, 'source_count': len(points), 'points': simplified}
+    trajectory = get_trajectory(parcel_id, resolution)
+    return {'resolution': resolution, 'source_count': trajectory.source_count, 'points': trajectory.points}
@@ -0,0 +1,83 @@
+"""Batched parcel status transitions.
+
+Parcels are moved to a new status with one ``UPDATE`` per previous-status
+group; the matching ``ParcelStatusHistory`` rows are written with
+``bulk_create`` and notification jobs queued in the same transaction.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from . import events, notifications, rollups, stats, user_index
+from .bulk import iter_chunks
+from .cache import parcel_detail_cache
+from .models import Parcel, ParcelStatusHistory
+
+# Ids per UPDATE/SELECT, kept well under database parameter limits
+TRANSITION_CHUNK_SIZE = 500
+MAX_TRANSITION_PARCELS = 10000
+
+
+ROW_FIELDS = ('id', 'tracking_number', 'status', 'parcel_type', 'department_id', 'organization_id', 'created_at')
+
+
+def bulk_transition(parcels, new_status, user=None, notes='', field='id', values=None):
+    """Move every parcel in the ``parcels`` queryset to ``new_status``.
+
+    With ``values`` only the parcels whose ``field`` is one of them are moved,
+    selected ``TRANSITION_CHUNK_SIZE`` values at a time. Parcels already in
+    ``new_status`` are left untouched. Returns the ``(id, tracking_number)``
+    pairs that changed and those that were unchanged.
+    """
+    now = timezone.now()
+    changed, unchanged = [], []
+    with transaction.atomic():
+        parcels = parcels.select_for_update().order_by()
+        if values is None:
+            rows = list(parcels.values(*ROW_FIELDS))
+        else:
+            rows = []
+            for chunk in iter_chunks(list(values), TRANSITION_CHUNK_SIZE):
+                rows.extend(parcels.filter(**{f'{field}__in': chunk}).values(*ROW_FIELDS))
+        groups = {}
+        for row in rows:
+            if row['status'] == new_status:
+                unchanged.append(row)
+            else:
+                groups.setdefault(row['status'], []).append(row)
+
+        update = {'status': new_status, 'updated_at': now}
+        if new_status == 'delivered':
+            update['delivered_at'] = now
+
+        history, removed, added = [], {}, {}
+        for previous_status, group in groups.items():
+            for chunk in iter_chunks(group, TRANSITION_CHUNK_SIZE):
+                Parcel.objects.filter(id__in=[row['id'] for row in chunk], status=previous_status).update(**update)
+            for row in group:
+                history.append(ParcelStatusHistory(
+                    parcel_id=row['id'], previous_status=previous_status, new_status=new_status,
+                    changed_by=user, notes=notes,
+                ))
+                department = str(row['department_id']) if row['department_id'] else stats.NO_DEPARTMENT
+                removed.setdefault(row['organization_id'], []).append((previous_status, row['parcel_type'], department))
+                added.setdefault(row['organization_id'], []).append((new_status, row['parcel_type'], department))
+                changed.append(row)
+                events.publish_status(
+                    row['id'], row['organization_id'], row['tracking_number'], previous_status, new_status
+                )
+
+        ParcelStatusHistory.objects.bulk_create(history, batch_size=TRANSITION_CHUNK_SIZE)
+        notifications.enqueue_status_change([row['id'] for row in changed], new_status, actor=user)
+        # QuerySet.update skips the signal that keeps the user parcel index current
+        for chunk in iter_chunks([row['id'] for row in changed], TRANSITION_CHUNK_SIZE):
+            user_index.update_status(chunk, new_status)
+        for organization_id in removed:
+            stats.apply_count_deltas(organization_id, removed=removed[organization_id], added=added[organization_id])
+        # Timed like a backfill, from each history row
+        rollups.record_status_changes(
+            [{**row, 'changed_at': entry.created_at} for row, entry in zip(changed, history)], new_status
+        )
+
+    # Queryset updates and bulk_create bypass model signals, so invalidate and publish here
+    parcel_detail_cache.invalidate_many(row['id'] for row in changed)
+    return changed, unchanged
@@ -0,0 +1,31 @@
+"""Maintenance of the per-user parcel index (``UserParcel``).
+
+One row per user and parcel the user has delivery history for, carrying the
+role from the most recent history row and a copy of the parcel's status and
+``created_at`` so ``my_parcels`` can filter and keyset-paginate on a single
+``(user, ..., -created_at)`` index. Signals keep it in step with single-row
+writes; bulk paths that bypass signals call ``update_status`` directly.
+"""
+from .models import Parcel, ParcelDeliveryHistory, UserParcel
+
+
+def sync_user_parcel(user_id, parcel_id):
+    """Rebuild the index row for one user and parcel from their delivery history"""
+    role = (
+        ParcelDeliveryHistory.objects.filter(user_id=user_id, parcel_id=parcel_id)
+        .order_by('-timestamp', '-id')
+        .values_list('role', flat=True)
+        .first()
+    )
+    if role is None:
+        UserParcel.objects.filter(user_id=user_id, parcel_id=parcel_id).delete()
+        return
+    parcel = Parcel.objects.filter(pk=parcel_id).values('status', 'created_at').first()
+    if parcel is None:
+        return
+    UserParcel.objects.update_or_create(user_id=user_id, parcel_id=parcel_id, defaults={'role': role, **parcel})
+
+
+def update_status(parcel_ids, status):
+    """Copy a parcel status change onto every index row for ``parcel_ids``"""
+    return UserParcel.objects.filter(parcel_id__in=parcel_ids).exclude(status=status).update(status=status)
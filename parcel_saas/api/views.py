@@ -1,21 +1,65 @@
+from collections.abc import Iterator
+from datetime import datetime, time, timedelta
+
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotAuthenticated, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db import transaction
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from . import export, notifications, rollups, stats
+from .bulk import BulkParcelImporter
+from .cache import parcel_detail_cache
+from .fieldsets import prune_payload, requested_fieldset
+from .filters import FullTextSearchFilter, RankedOrderingFilter, SpatialFilterBackend
+from .ingestion import BufferFull, get_position_buffer, prepare_positions
+from .optimizer import DEFAULT_STATUSES, MAX_STOPS, candidate_parcels, plan_route, write_routes
+from .pagination import KeysetCursorPagination, KeysetPagination
+from .parsers import CSVParser, NDJSONParser
+from .prefetch import PrefetchPlanMixin, apply_prefetch_plan
+from .profiling import ProfiledSerializerMixin
+from .tenancy import TenantScopedMixin
+from .rows import values_rows
+from .routing import COORDINATE_FIELDS, compute_route_metrics, leg_distance_km
+from .trajectory import RESOLUTIONS, trajectory_payload
+from .transitions import MAX_TRANSITION_PARCELS, bulk_transition
 from .models import (
     Organization, Department, Parcel, ParcelStatusHistory, ParcelDeliveryHistory,
-    DeliveryReview, TrackingLocation, DeliveryRoute, Notification
+    DeliveryReview, TrackingLocation, DeliveryRoute, Notification, UserParcel, ReviewAggregate
 )
 from .serializers import (
     OrganizationSerializer, DepartmentSerializer, ParcelListSerializer, ParcelDetailSerializer,
     ParcelCreateUpdateSerializer, ParcelStatusHistorySerializer, ParcelDeliveryHistorySerializer,
-    DeliveryReviewSerializer, TrackingLocationSerializer, DeliveryRouteSerializer, NotificationSerializer
+    DeliveryReviewSerializer, TrackingLocationSerializer, DeliveryRouteSerializer, NotificationSerializer,
+    GPSReportSerializer, ParcelTrajectoryDetailSerializer, RouteOptimizeSerializer
 )
 
 
-class OrganizationViewSet(viewsets.ModelViewSet):
+def _parse_timeline_bound(value, end=False):
+    """An aware datetime from an ISO datetime or date; a date ``end`` bound covers that whole day.
+
+    Returns None for an empty value and raises ``ValueError`` for anything else unparseable.
+    """
+    if not value:
+        return None
+    # Dates first: on recent Pythons parse_datetime also accepts a bare date, as midnight
+    day = parse_date(value)
+    if day is not None:
+        parsed = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    else:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(value)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class OrganizationViewSet(TenantScopedMixin, PrefetchPlanMixin, ProfiledSerializerMixin, viewsets.ModelViewSet):
     """ViewSet for managing organizations"""
     queryset = Organization.objects.all()
     serializer_class = OrganizationSerializer
@@ -24,21 +68,61 @@ class OrganizationViewSet(viewsets.ModelViewSet):
     search_fields = ['name', 'description']
     filterset_fields = ['id', 'name']
 
+    def perform_create(self, serializer):
+        # The creator administers the organization, so it stays within their scope
+        if not self.request.user.is_authenticated:
+            raise NotAuthenticated('Log in to create an organization.')
+        serializer.save(admin=self.request.user)
+
     @action(detail=True, methods=['get'])
     def statistics(self, request, pk=None):
-        """Get organization statistics"""
+        """Get organization statistics from the cached snapshot"""
         organization = self.get_object()
-        stats = {
-            'total_parcels': Parcel.objects.filter(organization=organization).count(),
-            'delivered': Parcel.objects.filter(organization=organization, status='delivered').count(),
-            'in_transit': Parcel.objects.filter(organization=organization, status='in_transit').count(),
-            'pending': Parcel.objects.filter(organization=organization, status='pending').count(),
-            'lost': Parcel.objects.filter(organization=organization, status='lost').count(),
-        }
-        return Response(stats)
+        refresh = request.query_params.get('refresh', '').lower() in ('1', 'true')
+        snapshot = stats.get_organization_statistics(organization, refresh=refresh)
+        data = stats.format_statistics(snapshot)
+
+        bucket = request.query_params.get('bucket')
+        if bucket:
+            if bucket not in stats.TIMELINE_BUCKETS:
+                return Response({'error': 'bucket must be one of: day, week'}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                since = _parse_timeline_bound(request.query_params.get('from'))
+                until = _parse_timeline_bound(request.query_params.get('to'), end=True)
+            except ValueError:
+                return Response(
+                    {'error': 'from and to must be ISO 8601 dates or datetimes'}, status=status.HTTP_400_BAD_REQUEST
+                )
+            data['timeline'] = stats.build_timeline(organization, bucket=bucket, since=since, until=until)
+        return Response(data)
+
+    @action(detail=True, methods=['get'])
+    def metrics(self, request, pk=None):
+        """Daily parcel and review metrics for a date range, read from the rollup table"""
+        organization = self.get_object()
+        bounds = {}
+        for param in ('from', 'to'):
+            value = request.query_params.get(param)
+            try:
+                bounds[param] = parse_date(value) if value else None
+            except ValueError:
+                bounds[param] = None
+            if value and bounds[param] is None:
+                return Response({'error': f'{param} must be a date (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+        if bounds['from'] and bounds['to'] and bounds['from'] > bounds['to']:
+            return Response({'error': 'from must not be after to'}, status=status.HTTP_400_BAD_REQUEST)
+
+        department = request.query_params.get('department')
+        if department is not None and not department.isdigit():
+            return Response({'error': 'department must be an id'}, status=status.HTTP_400_BAD_REQUEST)
+        data = rollups.build_metrics(
+            organization, since=bounds['from'], until=bounds['to'],
+            department=int(department) if department is not None else None,
+        )
+        return Response(data)
 
 
-class DepartmentViewSet(viewsets.ModelViewSet):
+class DepartmentViewSet(TenantScopedMixin, PrefetchPlanMixin, ProfiledSerializerMixin, viewsets.ModelViewSet):
     """ViewSet for managing departments"""
     queryset = Department.objects.all()
     serializer_class = DepartmentSerializer
@@ -48,25 +132,103 @@ class DepartmentViewSet(viewsets.ModelViewSet):
     filterset_fields = ['organization', 'name']
 
 
-class ParcelViewSet(viewsets.ModelViewSet):
+class ParcelViewSet(TenantScopedMixin, PrefetchPlanMixin, ProfiledSerializerMixin, viewsets.ModelViewSet):
     """ViewSet for managing parcels"""
     permission_classes = [AllowAny]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, RankedOrderingFilter, SpatialFilterBackend]
     filterset_fields = ['organization', 'status', 'parcel_type', 'department']
     search_fields = ['tracking_number', 'sender_name', 'receiver_name']
     ordering_fields = ['created_at', 'tracking_number']
     ordering = ['-created_at']
+    sparse_actions = ('list', 'retrieve', 'my_parcels')
 
-    def get_queryset(self):
-        return Parcel.objects.all()
+    queryset = Parcel.objects.all()
+
+    def get_resolution(self):
+        resolution = self.request.query_params.get('resolution')
+        if resolution is not None and resolution not in RESOLUTIONS:
+            raise ValidationError({'resolution': f"Must be one of: {', '.join(RESOLUTIONS)}"})
+        return resolution
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # Only the detail response embeds a trajectory; other actions ignore ?resolution=
+        if self.action == 'retrieve':
+            context['resolution'] = self.get_resolution()
+        return context
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
+            if self.get_resolution():
+                return ParcelTrajectoryDetailSerializer
             return ParcelDetailSerializer
         elif self.action in ['create', 'update', 'partial_update']:
             return ParcelCreateUpdateSerializer
         return ParcelListSerializer
 
+    def list(self, request, *args, **kwargs):
+        # Serialize from values() rows: no model instances, labels and department name from the query
+        queryset = self.filter_queryset(self.get_queryset())
+        # The cursor reads its position from the ordering columns, e.g. the search rank
+        ordering = [field.lstrip('-') for field in queryset.query.order_by if isinstance(field, str)]
+        queryset = values_rows(queryset, self.get_serializer(), extra=ordering)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(queryset, many=True).data)
+
+    def perform_create(self, serializer):
+        self.check_tenant(serializer)
+        parcel = serializer.save()
+        stats.record_parcel_created(parcel)
+        rollups.record_parcels_created([parcel])
+
+    def perform_update(self, serializer):
+        self.check_tenant(serializer)
+        organization_id = serializer.instance.organization_id
+        previous_key = stats.parcel_key(serializer.instance)
+        previous_status = serializer.instance.status
+        new_status = serializer.validated_data.get('status', previous_status)
+        changes = {}
+        if new_status == 'delivered' and previous_status != 'delivered':
+            changes['delivered_at'] = timezone.now()
+        with transaction.atomic():
+            parcel = serializer.save(**changes)
+            if parcel.status != previous_status:
+                # Recorded as update_status does, so rollups rebuilt from the history match the live counters
+                history = ParcelStatusHistory.objects.create(
+                    parcel=parcel, previous_status=previous_status, new_status=parcel.status,
+                    changed_by=self.request.user if self.request.user.is_authenticated else None,
+                )
+                rollups.record_parcel_status_change(parcel, previous_status, history.created_at)
+            stats.record_parcel_changed(organization_id, previous_key, parcel)
+
+    def perform_destroy(self, instance):
+        stats.record_parcel_deleted(instance)
+        with transaction.atomic():
+            rollups.record_parcel_deleted(instance)
+            instance.delete()
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser, CSVParser])
+    def bulk(self, request):
+        """Create parcels from a JSON array (or ``{"parcels": [...]}``), NDJSON or CSV upload"""
+        rows = request.data
+        if isinstance(rows, dict):
+            rows = rows.get('parcels')
+        # The NDJSON and CSV parsers return lazy iterators of rows
+        if not isinstance(rows, (list, Iterator)):
+            return Response({'error': 'Expected a list of parcels'}, status=status.HTTP_400_BAD_REQUEST)
+
+        importer = BulkParcelImporter(
+            batch_size=request.query_params.get('batch_size'),
+            organizations=Organization.objects.for_tenant(self.tenant),
+            departments=Department.objects.for_tenant(self.tenant),
+        )
+        result = importer.run(rows)
+        response_status = status.HTTP_201_CREATED if result['created'] else status.HTTP_400_BAD_REQUEST
+        return Response(result, status=response_status)
+
     @action(detail=False, methods=['get'])
     def search_by_barcode(self, request):
         """Search parcel by tracking number/barcode"""
@@ -74,12 +236,33 @@ class ParcelViewSet(viewsets.ModelViewSet):
         if not tracking_number:
             return Response({'error': 'tracking_number parameter required'}, status=status.HTTP_400_BAD_REQUEST)
         
+        # The full payload is cached; ?fields= trims the response
+        fields = requested_fieldset(request)[0]
+        payload = parcel_detail_cache.get(tracking_number)
+        if payload is not None:
+            if not self.tenant.allows(payload['organization']):
+                return Response({'error': 'Parcel not found'}, status=status.HTTP_404_NOT_FOUND)
+            return Response(prune_payload(payload, fields) if fields else payload)
+
+        token = parcel_detail_cache.begin(tracking_number)
         try:
-            parcel = Parcel.objects.get(tracking_number=tracking_number)
-            serializer = ParcelDetailSerializer(parcel)
-            return Response(serializer.data)
+            parcel = apply_prefetch_plan(self.get_queryset(), ParcelDetailSerializer).get(tracking_number=tracking_number)
         except Parcel.DoesNotExist:
             return Response({'error': 'Parcel not found'}, status=status.HTTP_404_NOT_FOUND)
+        payload = ParcelDetailSerializer(parcel).data
+        parcel_detail_cache.set(tracking_number, parcel.id, payload, token)
+        return Response(prune_payload(payload, fields) if fields else payload)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the filtered parcels, or their status history or tracking locations, as CSV or NDJSON"""
+        options = export.parse_options(request.query_params)
+        return export.export_response(self.filter_queryset(self.get_queryset()), **options)
+
+    @action(detail=False, methods=['get'])
+    def barcode_cache_stats(self, request):
+        """Hit/miss counters for this worker's search_by_barcode cache"""
+        return Response(parcel_detail_cache.stats())
 
     @action(detail=True, methods=['post'])
     def update_status(self, request, pk=None):
@@ -94,55 +277,140 @@ class ParcelViewSet(viewsets.ModelViewSet):
         if new_status not in dict(Parcel.STATUS_CHOICES):
             return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Create status history
-        ParcelStatusHistory.objects.create(
-            parcel=parcel,
-            previous_status=parcel.status,
-            new_status=new_status,
-            changed_by=request.user,
-            notes=notes
-        )
+        previous_key = stats.parcel_key(parcel)
+        previous_status = parcel.status
+
+        with transaction.atomic():
+            # Create status history
+            history = ParcelStatusHistory.objects.create(
+                parcel=parcel,
+                previous_status=parcel.status,
+                new_status=new_status,
+                changed_by=request.user,
+                notes=notes
+            )
+
+            # Update parcel status
+            parcel.status = new_status
+            if new_status == 'delivered':
+                parcel.delivered_at = timezone.now()
+            parcel.save(update_fields=['status', 'delivered_at', 'updated_at'])
+            stats.record_parcel_changed(parcel.organization_id, previous_key, parcel)
+            rollups.record_parcel_status_change(parcel, previous_status, history.created_at)
+
+            # Linked users are notified by the background worker
+            notifications.enqueue_status_change([parcel.id], new_status, actor=request.user)
+
+        # Reload with the detail plan so the response includes the new history entry
+        parcel = apply_prefetch_plan(Parcel.objects.all(), ParcelDetailSerializer).get(pk=parcel.pk)
+        serializer = ParcelDetailSerializer(parcel)
+        return Response(serializer.data)
 
-        # Update parcel status
-        parcel.status = new_status
-        if new_status == 'delivered':
-            parcel.delivered_at = timezone.now()
-        parcel.save()
-
-        # Create notification
-        Notification.objects.create(
-            user=request.user,
-            parcel=parcel,
-            title=f"Status Updated: {parcel.tracking_number}",
-            message=f"Parcel status changed to {new_status}"
+    @action(detail=False, methods=['post'])
+    def bulk_update_status(self, request):
+        """Move many parcels, by tracking number or id, to one status"""
+        new_status = request.data.get('status')
+        notes = request.data.get('notes', '')
+        tracking_numbers = request.data.get('tracking_numbers') or []
+        ids = request.data.get('ids') or []
+
+        if not new_status:
+            return Response({'error': 'status field required'}, status=status.HTTP_400_BAD_REQUEST)
+        if new_status not in dict(Parcel.STATUS_CHOICES):
+            return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(tracking_numbers, list) or not isinstance(ids, list):
+            return Response({'error': 'tracking_numbers and ids must be lists'}, status=status.HTTP_400_BAD_REQUEST)
+        if not tracking_numbers and not ids:
+            return Response({'error': 'tracking_numbers or ids required'}, status=status.HTTP_400_BAD_REQUEST)
+        if tracking_numbers and ids:
+            return Response(
+                {'error': 'Send either tracking_numbers or ids, not both'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            ids = [int(parcel_id) for parcel_id in ids]
+        except (TypeError, ValueError):
+            return Response({'error': 'ids must be a list of ids'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(tracking_numbers) + len(ids) > MAX_TRANSITION_PARCELS:
+            return Response(
+                {'error': f'At most {MAX_TRANSITION_PARCELS} parcels per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        key = 'tracking_number' if tracking_numbers else 'id'
+        requested = tracking_numbers or ids
+        user = request.user if request.user.is_authenticated else None
+        changed, unchanged = bulk_transition(
+            self.get_queryset(), new_status, user=user, notes=notes, field=key, values=requested
         )
 
-        serializer = ParcelDetailSerializer(parcel)
-        return Response(serializer.data)
+        found = {row[key] for row in changed} | {row[key] for row in unchanged}
+        return Response({
+            'updated': len(changed),
+            'unchanged': [row[key] for row in unchanged],
+            'not_found': [value for value in requested if value not in found],
+        })
 
-    @action(detail=False, methods=['get'])
-    def my_parcels(self, request):
-        """Get parcels for current user"""
-        histories = ParcelDeliveryHistory.objects.filter(user=request.user).values_list('parcel_id', flat=True)
-        parcels = Parcel.objects.filter(id__in=histories)
-        serializer = ParcelListSerializer(parcels, many=True)
-        return Response(serializer.data)
+    @action(detail=True, methods=['get'])
+    def trajectory(self, request, pk=None):
+        """Simplified tracking polyline at ?resolution= or downsampled to ?bucket_seconds="""
+        parcel = self.get_object()
+        bucket_seconds = request.query_params.get('bucket_seconds')
+        if bucket_seconds:
+            try:
+                bucket_seconds = int(bucket_seconds)
+            except ValueError:
+                bucket_seconds = 0
+            if bucket_seconds <= 0:
+                return Response({'error': 'bucket_seconds must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(trajectory_payload(parcel.id, bucket_seconds=bucket_seconds))
+        return Response(trajectory_payload(parcel.id, self.get_resolution() or 'medium'))
 
+    @action(detail=True, methods=['get'])
+    def route_metrics(self, request, pk=None):
+        """Total and remaining route distance and ETA from the latest tracking location"""
+        parcel = self.get_object()
+        metrics = compute_route_metrics([parcel.id]).get(parcel.id)
+        if metrics is None:
+            return Response({'error': 'Parcel has no delivery routes'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(metrics)
 
-class ParcelStatusHistoryViewSet(viewsets.ReadOnlyModelViewSet):
+    @action(detail=False, methods=['get'])
+    def my_parcels(self, request):
+        """Get parcels for current user, newest first, from the per-user parcel index"""
+        entries = UserParcel.objects.filter(user=request.user)
+        for field in ('status', 'role'):
+            value = request.query_params.get(field)
+            if value:
+                entries = entries.filter(**{field: value})
+        # No view passed: the cursor keys on the index's -created_at, ignoring ParcelViewSet's ?ordering=
+        paginator = KeysetCursorPagination()
+        # Cursor on the entry's own created_at; parcel columns read through the join
+        context = {**self.get_serializer_context(), 'values_prefix': 'parcel__'}
+        rows = values_rows(entries, ParcelListSerializer(context=context), prefix='parcel__', extra=['created_at'])
+        page = paginator.paginate_queryset(rows, request)
+        serializer = ParcelListSerializer(page, many=True, context=context)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class ParcelStatusHistoryViewSet(
+    TenantScopedMixin, PrefetchPlanMixin, ProfiledSerializerMixin, viewsets.ReadOnlyModelViewSet
+):
     """ViewSet for viewing parcel status history"""
     queryset = ParcelStatusHistory.objects.all()
     serializer_class = ParcelStatusHistorySerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ['parcel']
+    ordering = ['-created_at']
 
 
-class ParcelDeliveryHistoryViewSet(viewsets.ReadOnlyModelViewSet):
+class ParcelDeliveryHistoryViewSet(PrefetchPlanMixin, ProfiledSerializerMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for viewing parcel delivery history"""
     queryset = ParcelDeliveryHistory.objects.all()
     serializer_class = ParcelDeliveryHistorySerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['user', 'role']
     ordering_fields = ['timestamp']
@@ -152,33 +420,100 @@ class ParcelDeliveryHistoryViewSet(viewsets.ReadOnlyModelViewSet):
         return ParcelDeliveryHistory.objects.filter(user=self.request.user)
 
 
-class DeliveryReviewViewSet(viewsets.ModelViewSet):
+class DeliveryReviewViewSet(TenantScopedMixin, PrefetchPlanMixin, ProfiledSerializerMixin, viewsets.ModelViewSet):
     """ViewSet for managing delivery reviews"""
     queryset = DeliveryReview.objects.all()
     serializer_class = DeliveryReviewSerializer
     permission_classes = [AllowAny]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, RankedOrderingFilter]
     filterset_fields = ['parcel', 'reviewer']
     search_fields = ['title', 'comment']
     ordering_fields = ['created_at', 'rating']
     ordering = ['-created_at']
 
     def perform_create(self, serializer):
-        serializer.save(reviewer=self.request.user)
+        self.check_tenant(serializer)
+        review = serializer.save(reviewer=self.request.user)
+        rollups.record_review(review)
+
+    def perform_update(self, serializer):
+        self.check_tenant(serializer)
+        previous = rollups.review_snapshot(serializer.instance)
+        review = serializer.save()
+        rollups.record_review_changed(previous, review)
 
+    def perform_destroy(self, instance):
+        rollups.record_review(instance, sign=-1)
+        instance.delete()
 
-class TrackingLocationViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """Average ratings and recommendation rate from the monthly review aggregates.
+
+        Filters: ``organization``, ``department`` (ids) and ``from``/``to`` months (YYYY-MM).
+        """
+        aggregates = ReviewAggregate.objects.for_tenant(self.tenant)
+        for param in ('organization', 'department'):
+            value = request.query_params.get(param)
+            if value is None:
+                continue
+            if not value.isdigit():
+                return Response({'error': f'{param} must be an id'}, status=status.HTTP_400_BAD_REQUEST)
+            aggregates = aggregates.filter(**{f'{param}_id': int(value)})
+        for param, lookup in (('from', 'month__gte'), ('to', 'month__lte')):
+            value = request.query_params.get(param)
+            if value is None:
+                continue
+            try:
+                month = parse_date(f'{value}-01') if len(value) == 7 else None
+            except ValueError:
+                month = None
+            if month is None:
+                return Response({'error': f'{param} must be a month (YYYY-MM)'}, status=status.HTTP_400_BAD_REQUEST)
+            aggregates = aggregates.filter(**{lookup: month})
+        return Response(rollups.build_review_summary(aggregates))
+
+
+class TrackingLocationViewSet(TenantScopedMixin, PrefetchPlanMixin, ProfiledSerializerMixin, viewsets.ModelViewSet):
     """ViewSet for managing tracking locations"""
     queryset = TrackingLocation.objects.all()
     serializer_class = TrackingLocationSerializer
     permission_classes = [AllowAny]
-    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, SpatialFilterBackend]
     filterset_fields = ['parcel', 'status']
     ordering_fields = ['timestamp']
     ordering = ['-timestamp']
 
+    @action(detail=False, methods=['post'])
+    def ingest(self, request):
+        """Queue batched GPS reports from one or more devices"""
+        many = isinstance(request.data, list)
+        serializer = GPSReportSerializer(data=request.data, many=many)
+        serializer.is_valid(raise_exception=True)
+        reports = serializer.validated_data if many else [serializer.validated_data]
+        positions = [position for report in reports for position in prepare_positions(report)]
+
+        parcel_ids = {position['parcel'] for position in positions}
+        organization_ids = dict(
+            Parcel.objects.for_tenant(self.tenant).filter(id__in=parcel_ids).values_list('id', 'organization_id')
+        )
+        unknown = sorted(parcel_ids - organization_ids.keys())
+        positions = [position for position in positions if position['parcel'] in organization_ids]
+
+        try:
+            accepted, dropped = get_position_buffer().add(positions, organization_ids)
+        except BufferFull:
+            response = Response({'error': 'Ingestion buffer full, retry shortly'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = '1'
+            return response
+        return Response(
+            {'accepted': accepted, 'dropped': dropped, 'unknown_parcels': unknown},
+            status=status.HTTP_202_ACCEPTED
+        )
 
-class DeliveryRouteViewSet(viewsets.ModelViewSet):
+
+class DeliveryRouteViewSet(TenantScopedMixin, PrefetchPlanMixin, ProfiledSerializerMixin, viewsets.ModelViewSet):
     """ViewSet for managing delivery routes"""
     queryset = DeliveryRoute.objects.all()
     serializer_class = DeliveryRouteSerializer
@@ -188,12 +523,101 @@ class DeliveryRouteViewSet(viewsets.ModelViewSet):
     ordering_fields = ['route_sequence', 'created_at']
     ordering = ['route_sequence']
 
+    # Recompute in one request at most this many parcels' routes
+    max_recompute_parcels = 10000
+
+    def save_with_distance(self, serializer):
+        """Fill distance_km from the leg coordinates unless the client supplied it"""
+        self.check_tenant(serializer)
+        data = serializer.validated_data
+        coordinates_changed = any(field in data for field in COORDINATE_FIELDS)
+        if data.get('distance_km') is None and (serializer.instance is None or coordinates_changed):
+            coordinates = [data.get(field, getattr(serializer.instance, field, None)) for field in COORDINATE_FIELDS]
+            return serializer.save(distance_km=leg_distance_km(*coordinates))
+        return serializer.save()
 
-class NotificationViewSet(viewsets.ModelViewSet):
+    def perform_create(self, serializer):
+        self.save_with_distance(serializer)
+
+    def perform_update(self, serializer):
+        self.save_with_distance(serializer)
+
+    @action(detail=False, methods=['post'])
+    def recompute(self, request):
+        """Recompute leg distances, totals, remaining distance and ETA for many parcels"""
+        parcel_ids = request.data.get('parcels')
+        organization = request.data.get('organization')
+        if parcel_ids is None and organization is None:
+            return Response({'error': 'parcels or organization required'}, status=status.HTTP_400_BAD_REQUEST)
+        if parcel_ids is None:
+            parcel_ids = self.get_queryset().filter(parcel__organization=organization).values_list(
+                'parcel_id', flat=True
+            ).distinct()
+        elif not isinstance(parcel_ids, list):
+            return Response({'error': 'parcels must be a list of ids'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            parcel_ids = [int(parcel_id) for parcel_id in parcel_ids]
+        except (TypeError, ValueError):
+            return Response({'error': 'parcels must be a list of ids'}, status=status.HTTP_400_BAD_REQUEST)
+        if self.tenant.organization_ids is not None and 'parcels' in request.data:
+            parcel_ids = list(
+                Parcel.objects.for_tenant(self.tenant).filter(id__in=parcel_ids).values_list('id', flat=True)
+            )
+        if len(parcel_ids) > self.max_recompute_parcels:
+            return Response(
+                {'error': f'At most {self.max_recompute_parcels} parcels per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        metrics = compute_route_metrics(parcel_ids, update_distances=True)
+        return Response({'parcels': len(metrics), 'results': list(metrics.values())})
+
+    @action(detail=False, methods=['post'])
+    def optimize(self, request):
+        """Plan a multi-stop tour from a depot through pending parcels and store it as route legs"""
+        serializer = RouteOptimizeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+
+        parcels, unlocated = candidate_parcels(
+            Parcel.objects.for_tenant(self.tenant),
+            organization=options.get('organization'),
+            department=options.get('department'),
+            statuses=options.get('statuses', DEFAULT_STATUSES),
+        )
+        if len(parcels) > MAX_STOPS:
+            return Response(
+                {'error': f'At most {MAX_STOPS} stops per tour; narrow to a department or status'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        depot = {
+            'latitude': options['depot_latitude'],
+            'longitude': options['depot_longitude'],
+            'name': options.get('depot_name'),
+        }
+        plan = plan_route(parcels, depot, options['return_to_depot'], options['time_budget_ms'])
+        created = 0 if options['dry_run'] else write_routes(plan, parcels, depot)
+        return Response({
+            'stops': [
+                {key: stop[key] for key in ('sequence', 'id', 'tracking_number', 'latitude', 'longitude', 'leg_distance_km')}
+                for stop in plan['stops']
+            ],
+            'unlocated_parcels': unlocated,
+            'initial_distance_km': plan['initial_distance_km'],
+            'total_distance_km': plan['total_distance_km'],
+            'improvement_pct': plan['improvement_pct'],
+            'passes': plan['passes'],
+            'routes_created': created,
+        })
+
+
+class NotificationViewSet(PrefetchPlanMixin, ProfiledSerializerMixin, viewsets.ModelViewSet):
     """ViewSet for managing notifications"""
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     permission_classes = [AllowAny]
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['is_read']
     ordering_fields = ['created_at']
@@ -202,17 +626,50 @@ class NotificationViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Notification.objects.filter(user=self.request.user)
 
+    def perform_update(self, serializer):
+        was_read = serializer.instance.is_read
+        notification = serializer.save()
+        if notification.is_read != was_read:
+            notifications.record_counts({notification.user_id: (-1 if notification.is_read else 1, None)})
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        notifications.record_counts({instance.user_id: (0 if instance.is_read else -1, None)})
+
     @action(detail=False, methods=['post'])
     def mark_all_as_read(self, request):
         """Mark all notifications as read"""
-        notifications = self.get_queryset().filter(is_read=False)
-        notifications.update(is_read=True)
+        updated = self.get_queryset().filter(is_read=False).update(is_read=True)
+        if updated:
+            notifications.record_counts({request.user.pk: (-updated, None)})
         return Response({'status': 'All notifications marked as read'})
 
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
         """Mark a single notification as read"""
         notification = self.get_object()
-        notification.is_read = True
-        notification.save()
+        if not notification.is_read:
+            notification.is_read = True
+            notification.save(update_fields=['is_read'])
+            notifications.record_counts({notification.user_id: (-1, None)})
         return Response({'status': 'Notification marked as read'})
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def poll(self, request):
+        """Unread count and notifications newer than ``?since=<id>``; 304 while the ETag still matches"""
+        since = request.query_params.get('since', '0')
+        if not since.isdigit():
+            return Response({'error': 'since must be a notification id'}, status=status.HTTP_400_BAD_REQUEST)
+        since = int(since)
+
+        counter = notifications.get_counter(request.user.pk)
+        etag = f'"{counter.version}-{counter.latest_id}-{since}"'
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        results = []
+        if counter.latest_id > since:
+            newer = self.get_queryset().filter(id__gt=since).order_by('-id')[:notifications.POLL_LIMIT]
+            results = NotificationSerializer(newer, many=True).data
+        data = {'unread_count': counter.unread_count, 'latest_id': counter.latest_id, 'results': results}
+        return Response(data, headers={'ETag': etag})
@@ -2,6 +2,9 @@
 ASGI config for parcel_config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn parcel_config.asgi:application``)
+so the ``/api/stream/`` Server-Sent Events endpoint can hold many idle
+connections without tying up worker threads.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -44,12 +44,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.tenancy.TenantMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -156,3 +158,59 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+
+# The React dev servers send the session's CSRF token on writes
+CSRF_TRUSTED_ORIGINS = CORS_ALLOWED_ORIGINS
+
+# After logging in at /api-auth/login/ (linked from the React navbar)
+LOGIN_REDIRECT_URL = '/api/'
+
+# Bulk parcel ingestion (rows validated and inserted per chunk)
+PARCEL_BULK_BATCH_SIZE = 1000
+
+# search_by_barcode payload cache (see api/cache.py); BACKEND may name a CACHES alias
+PARCEL_DETAIL_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 300,
+    'BACKEND': None,
+}
+
+# Pub/sub used by the /api/stream/ tracking events endpoint (see api/events.py)
+PARCEL_EVENT_BROKER = 'api.events.InProcessBroker'
+
+# Buffered GPS ingestion for /api/tracking-locations/ingest/ (see api/ingestion.py)
+PARCEL_GPS_INGEST = {
+    'FLUSH_SIZE': 500,
+    'FLUSH_INTERVAL': 2.0,
+    'MAX_PENDING': 50000,
+    'MIN_DISTANCE_METERS': 25,
+    'MIN_INTERVAL_SECONDS': 30,
+}
+
+# Average courier speed used for route ETAs (see api/routing.py)
+ROUTE_AVERAGE_SPEED_KMH = 40.0
+
+# Background notification fan-out (see api/notifications.py); run `manage.py process_notifications`
+PARCEL_NOTIFICATIONS = {
+    'COALESCE_SECONDS': 2.0,
+    'MAX_DELAY_SECONDS': 30.0,
+    'BATCH_SIZE': 500,
+    'POLL_INTERVAL': 1.0,
+}
+
+# Retention for append-only tables (see api/retention.py); run `manage.py apply_retention`. DAYS None disables
+PARCEL_RETENTION = {
+    'notifications': {'DAYS': 30},
+    'tracking_locations': {'DAYS': 90, 'KEEP_EVERY_SECONDS': 3600},
+    'status_history': {'DAYS': None},
+}
+
+# Request profiling (see api/profiling.py); every request feeds the latency histograms, SAMPLE_RATE of them
+# also record SQL counts/time, repeated statements and serializer time. Scraped at /api/_metrics
+PARCEL_PROFILING = {
+    'ENABLED': True,
+    'SAMPLE_RATE': 0.1,
+    'RING_SIZE': 1000,
+    'DUPLICATE_QUERY_THRESHOLD': 5,
+    'METRICS_TOKEN': None,
+}
@@ -22,6 +22,8 @@ from api.views import (
     ParcelDeliveryHistoryViewSet, DeliveryReviewViewSet, TrackingLocationViewSet,
     DeliveryRouteViewSet, NotificationViewSet
 )
+from api.profiling import metrics_view
+from api.streaming import tracking_stream
 
 router = DefaultRouter()
 router.register(r'organizations', OrganizationViewSet, basename='organization')
@@ -36,6 +38,8 @@ router.register(r'notifications', NotificationViewSet, basename='notification')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/stream/', tracking_stream, name='tracking-stream'),
+    path('api/_metrics', metrics_view, name='metrics'),
     path('api/', include(router.urls)),
     path('api-auth/', include('rest_framework.urls')),
 ]